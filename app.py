@@ -1,13 +1,26 @@
 import os
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory
+import json
+import time
+import asyncio
+import threading
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, Response, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user, UserMixin
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
 import database
 import openai_generator
+import async_generator
+import job_queue
+import image_prep
+import circuit_breaker
+import events
+import user_cache
+import password_hasher
+import generation_cache
+import morph_sequence
+import retry
 from datetime import datetime
-import threading
 
 # Load environment variables from .env file
 load_dotenv()
@@ -26,6 +39,27 @@ login_manager.init_app(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Please log in to access this page.'
 
+# Generation engine: 'threads' (one OS thread per branch) or 'async' (coroutines on a shared event loop)
+GENERATION_ENGINE = os.environ.get('GENERATION_ENGINE', 'threads')
+
+# /events streams: each open stream holds a server thread, so streams end after
+# EVENTS_STREAM_TIMEOUT seconds and the browser reconnects (EventSource does this itself)
+EVENTS_STREAM_TIMEOUT = float(os.environ.get('EVENTS_STREAM_TIMEOUT', 25))
+# Seconds a ?poll=1 long-poll is held open before it returns the unchanged status
+EVENTS_POLL_TIMEOUT = float(os.environ.get('EVENTS_POLL_TIMEOUT', 5))
+# Streams and long-polls held open at once per process; the rest of the server threads stay
+# free for other requests, and clients over the limit poll /check-status instead
+EVENTS_MAX_STREAMS = int(os.environ.get('EVENTS_MAX_STREAMS', 4))
+# Seconds between /check-status polls for clients over the limit
+EVENTS_BUSY_RETRY = float(os.environ.get('EVENTS_BUSY_RETRY', 3))
+# How often a waiting stream re-reads the database for jobs running in another worker process
+EVENTS_RECHECK_INTERVAL = float(os.environ.get('EVENTS_RECHECK_INTERVAL', 5))
+
+_event_slots = threading.BoundedSemaphore(EVENTS_MAX_STREAMS)
+
+# Image sets per dashboard page; further pages are loaded from /gallery as the user scrolls
+DASHBOARD_PAGE_SIZE = int(os.environ.get('DASHBOARD_PAGE_SIZE', 12))
+
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
@@ -40,7 +74,7 @@ class User(UserMixin):
 
 @login_manager.user_loader
 def load_user(user_id):
-    user_data = database.get_user_by_id(user_id)
+    user_data = user_cache.get(user_id)
     if user_data:
         return User(user_data['id'], user_data['username'])
     return None
@@ -72,8 +106,13 @@ def register():
             flash('Password must be at least 6 characters', 'error')
             return render_template('register.html')
         
-        user_id = database.create_user(username, password)
+        try:
+            user_id = database.create_user(username, password)
+        except password_hasher.PasswordHasherBusy:
+            flash('The server is busy right now. Please try again in a moment.', 'error')
+            return render_template('register.html'), 503
         if user_id:
+            user_cache.invalidate(user_id)
             flash('Registration successful! Please log in.', 'success')
             return redirect(url_for('login'))
         else:
@@ -92,7 +131,12 @@ def login():
             flash('Username and password are required', 'error')
             return render_template('login.html')
         
-        user_data = database.verify_user(username, password)
+        try:
+            user_data = database.verify_user(username, password)
+        except password_hasher.PasswordHasherBusy:
+            # Rejected straight away instead of queueing behind other logins
+            flash('The server is busy right now. Please try again in a moment.', 'error')
+            return render_template('login.html'), 503
         if user_data:
             user = User(user_data['id'], user_data['username'])
             login_user(user)
@@ -110,48 +154,190 @@ def logout():
     flash('You have been logged out', 'success')
     return redirect(url_for('index'))
 
+def gallery_page(user_id, before_id=None):
+    """One page of the user's gallery, newest first, plus the cursor for the next page (None at the end)"""
+    images = database.get_user_images(user_id, DASHBOARD_PAGE_SIZE + 1, before_id)
+    if len(images) > DASHBOARD_PAGE_SIZE:
+        images = images[:DASHBOARD_PAGE_SIZE]
+        return images, images[-1]['id']
+    return images, None
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    user_images = database.get_user_images(current_user.id)
-    return render_template('dashboard.html', images=user_images, username=current_user.username)
+    user_images, next_cursor = gallery_page(current_user.id)
+    return render_template('dashboard.html', images=user_images, next_cursor=next_cursor, username=current_user.username)
 
-def process_image_generation(filepath, filename, breed, user_id, timestamp, image_id):
-    """Background function to generate transformation images"""
-    try:
-        print(f"Background: Starting image generation for {filename}")
-        
-        # Generate transformation images using DALL-E 3
-        print("Background: Starting image generation with DALL-E 3...")
-        trans1_path, final_path, full_dog_path = openai_generator.generate_transformation_images(
-            filepath, breed, user_id, timestamp
+@app.route('/gallery')
+@login_required
+def gallery():
+    """Next page of the dashboard gallery (infinite scroll), as JSON"""
+    user_images, next_cursor = gallery_page(current_user.id, request.args.get('before', type=int))
+    
+    def frame_url(filename):
+        return url_for('serve_image', filename=filename) if filename else None
+    
+    return jsonify({
+        'success': True,
+        'images': [{
+            'id': image['id'],
+            'breed': image['dog_breed'],
+            'created_at': image['created_at'],
+            'images': {
+                'original': frame_url(image['original_image']),
+                'transition1': frame_url(image['transition1_image']),
+                'final': frame_url(image['final_dog_image']),
+                'full_dog': frame_url(image['transition2_image']),
+                'animation': frame_url(image['morph_image'])
+            }
+        } for image in user_images],
+        'next_cursor': next_cursor
+    })
+
+def start_job_analysis(job):
+    """
+    Stage 1 of a job: the analysis recorded by an earlier attempt, or None after marking
+    the set as analyzing and preparing the upload for the analysis call.
+    """
+    image = database.get_image_by_id(job['image_id'])
+    if image and image['analysis']:
+        return image['analysis']
+    database.set_image_status(job['image_id'], 'analyzing')
+    events.publish(job['image_id'])
+    
+    # Normalize and downscale once; every API call for this upload sends the derived copy
+    image_prep.prepare(job['image_path'])
+    print(f"Background: Analyzing breed for image: {job['image_path']}")
+    return None
+
+def record_job_analysis(job, analysis):
+    """Store the analysis of a job's upload on its image set"""
+    print(f"Background: Detected breed: {analysis['breed']}")
+    database.update_image_analysis(job['image_id'], analysis['breed'], analysis)
+    events.publish(job['image_id'])
+    return analysis
+
+def restore_job_frames(job, breed):
+    """
+    Reuse the frames of the same photo and breed generated before.
+    Returns (digest, base_path, paths), where paths is None if the frames have to be
+    generated (the set is then marked as generating).
+    """
+    digest = generation_cache.image_digest(job['image_path'])
+    base_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{job['user_id']}_{job['timestamp']}")
+    cached_paths = {
+        'trans1': f"{base_path}_transition1.png",
+        'final': f"{base_path}_final.png",
+        'full_dog': f"{base_path}_full_dog.png"
+    }
+    if generation_cache.restore(digest, breed, cached_paths):
+        return digest, base_path, tuple(cached_paths[stage] for stage in generation_cache.STAGES)
+    
+    database.set_image_status(job['image_id'], 'generating')
+    events.publish(job['image_id'])
+    print(f"Background: Starting image generation with DALL-E 3 ({GENERATION_ENGINE} engine)...")
+    return digest, base_path, None
+
+def frame_publisher(image_id):
+    """on_frame callback that makes each frame visible to /check-status as soon as its branch finishes"""
+    def publish_frame(stage, path):
+        database.update_image_frame(image_id, stage, os.path.basename(path))
+        events.publish(image_id)
+        print(f"Background: {stage} ready for image_id {image_id}")
+    return publish_frame
+
+def finish_image_set(job, breed, digest, base_path, paths, from_cache):
+    """Final stage of a job: check the frames, cache them, render the morph and mark the set complete"""
+    image_id = job['image_id']
+    trans1_path, final_path, full_dog_path = paths
+    print(f"Background: Generated images - Trans1: {trans1_path}, Final: {final_path}, Full Dog: {full_dog_path}")
+    
+    # Check if files actually exist
+    trans1_exists = trans1_path and os.path.exists(trans1_path)
+    final_exists = final_path and os.path.exists(final_path)
+    full_dog_exists = full_dog_path and os.path.exists(full_dog_path)
+    
+    print(f"Background: Files exist - Trans1: {trans1_exists}, Final: {final_exists}, Full Dog: {full_dog_exists}")
+    
+    # Update database with generated images
+    if not (trans1_exists and final_exists and full_dog_exists):
+        raise RuntimeError(
+            f"Not all images generated. Trans1: {trans1_exists}, Final: {final_exists}, Full Dog: {full_dog_exists}"
         )
+    
+    if not from_cache:
+        generation_cache.store(digest, breed, {'trans1': trans1_path, 'final': final_path, 'full_dog': full_dog_path})
+    
+    # Render the morph animation before the set is marked complete, so watchers still
+    # following it receive the animation; a failure here only loses the animation
+    database.set_image_status(image_id, 'animating')
+    events.publish(image_id)
+    morph_path = morph_sequence.create(job['image_path'], trans1_path, final_path, full_dog_path, morph_sequence.morph_path_for(base_path))
+    if morph_path:
+        database.update_image_morph(image_id, os.path.basename(morph_path))
+    
+    # Update the database record with the generated images and mark the set complete
+    database.update_image_set(
+        image_id,
+        os.path.basename(trans1_path),
+        os.path.basename(final_path),
+        os.path.basename(full_dog_path)
+    )
+    events.publish(image_id)
+    print(f"Background: Successfully updated database for image_id {image_id}")
+
+def process_image_generation(job):
+    """
+    Generate transformation images for a queued job (runs on a job_queue worker).
+    With the async engine the job is handed to the engine's event loop and the
+    returned future tells the queue when it has finished.
+    """
+    if GENERATION_ENGINE == 'async':
+        return async_generator.submit(process_image_generation_async(job))
+    
+    # One retry budget for the whole job: analysis and generation retries share it
+    with retry.job_budget():
+        filepath = job['image_path']
+        print(f"Background: Starting image generation for {filepath}")
+        
+        # Stage 1: breed detection. A retried job reuses the analysis recorded by its first attempt
+        analysis = start_job_analysis(job)
+        if not analysis:
+            # Analyze the image once using OpenAI GPT-4 Vision (breed, subject, pose, lighting, ...)
+            analysis = record_job_analysis(job, openai_generator.analyze_upload(filepath))
+        breed = analysis['breed']
         
-        print(f"Background: Generated images - Trans1: {trans1_path}, Final: {final_path}, Full Dog: {full_dog_path}")
+        # The same photo and breed generated before: reuse its frames instead of calling the API
+        digest, base_path, paths = restore_job_frames(job, breed)
+        from_cache = paths is not None
+        if not from_cache:
+            paths = openai_generator.generate_transformation_images(
+                filepath, breed, job['user_id'], job['timestamp'], analysis=analysis, on_frame=frame_publisher(job['image_id'])
+            )
         
-        # Check if files actually exist
-        trans1_exists = trans1_path and os.path.exists(trans1_path)
-        final_exists = final_path and os.path.exists(final_path)
-        full_dog_exists = full_dog_path and os.path.exists(full_dog_path)
+        finish_image_set(job, breed, digest, base_path, paths, from_cache)
+
+async def process_image_generation_async(job):
+    """process_image_generation on the async engine's loop; database and file work runs in threads"""
+    # One retry budget for the whole job, inherited by every task and thread started below
+    with retry.job_budget():
+        filepath = job['image_path']
+        print(f"Background: Starting image generation for {filepath}")
         
-        print(f"Background: Files exist - Trans1: {trans1_exists}, Final: {final_exists}, Full Dog: {full_dog_exists}")
+        analysis = await asyncio.to_thread(start_job_analysis, job)
+        if not analysis:
+            analysis = await async_generator.analyze_upload(filepath)
+            await asyncio.to_thread(record_job_analysis, job, analysis)
+        breed = analysis['breed']
         
-        # Update database with generated images
-        if trans1_exists and final_exists and full_dog_exists:
-            # Update the database record with the generated images
-            database.update_image_set(
-                image_id,
-                os.path.basename(trans1_path),
-                os.path.basename(final_path),
-                os.path.basename(full_dog_path)
+        digest, base_path, paths = await asyncio.to_thread(restore_job_frames, job, breed)
+        from_cache = paths is not None
+        if not from_cache:
+            paths = await async_generator.run_pipeline(
+                filepath, breed, job['user_id'], job['timestamp'], analysis=analysis, on_frame=frame_publisher(job['image_id'])
             )
-            print(f"Background: Successfully updated database for image_id {image_id}")
-        else:
-            print(f"Background: WARNING - Not all images generated. Trans1: {trans1_exists}, Final: {final_exists}, Full Dog: {full_dog_exists}")
-    except Exception as e:
-        print(f"Background: Error processing image generation: {e}")
-        import traceback
-        traceback.print_exc()
+        
+        await asyncio.to_thread(finish_image_set, job, breed, digest, base_path, paths, from_cache)
 
 @app.route('/upload', methods=['POST'])
 @login_required
@@ -176,34 +362,24 @@ def upload():
         # Save original image
         file.save(filepath)
         
-        # Analyze breed using OpenAI GPT-4 Vision (quick operation)
-        print(f"Analyzing breed for image: {filepath}")
-        breed = openai_generator.analyze_dog_breed(filepath)
-        print(f"Detected breed: {breed}")
-        
-        # Save initial record to database (without transformation images yet)
+        # Save initial record to database; breed detection is the first stage of the background job
         image_id = database.save_image_set(
             current_user.id,
             filename,
-            breed,
+            None,  # breed - detected by the job
             None,  # transition1 - will be updated later
             None,  # final - will be updated later
             None   # full_dog - will be updated later
         )
         
-        # Start background thread for image generation
-        thread = threading.Thread(
-            target=process_image_generation,
-            args=(filepath, filename, breed, current_user.id, timestamp, image_id),
-            daemon=True
-        )
-        thread.start()
+        # Queue the job; a job_queue worker picks it up in the background
+        job_queue.enqueue(image_id, current_user.id, filepath, timestamp)
         
         # Return immediately with original image and processing status
         return jsonify({
             'success': True,
             'image_id': image_id,
-            'breed': breed,
+            'breed': None,
             'status': 'processing',
             'images': {
                 'original': url_for('serve_image', filename=filename),
@@ -224,48 +400,74 @@ def upload():
             'error': f'Error processing image: {str(e)}'
         }), 500
 
+# Messages shown while an image set is in progress, by its stored status
+STATUS_MESSAGES = {
+    'queued': 'Waiting for a free worker...',
+    'analyzing': 'Detecting breed...',
+    'generating': 'Images are still being generated...',
+    'animating': 'Animating the transformation...',
+}
+
+def image_status(image_data):
+    """
+    Status payload for an image set, shared by /check-status and /events.
+    Built from the stored status and frame columns only: a frame column is written
+    once its file is on disk, so no filesystem checks are needed.
+    """
+    def frame_url(column):
+        filename = image_data.get(column)
+        return url_for('serve_image', filename=filename) if filename else None
+    
+    images = {
+        'original': frame_url('original_image'),
+        'transition1': frame_url('transition1_image'),
+        'final': frame_url('final_dog_image'),
+        'full_dog': frame_url('transition2_image'),
+        'animation': frame_url('morph_image')
+    }
+    status = image_data['status']
+    # None until the job's breed detection stage has finished
+    breed = image_data.get('dog_breed')
+    # Changes whenever the client has something new to show (used by the long-poll)
+    progress = f"{status}:{sum(1 for url in images.values() if url)}"
+    
+    if status == 'complete':
+        return {
+            'success': True,
+            'status': 'complete',
+            'breed': breed,
+            'progress': progress,
+            'images': images
+        }
+    if status == 'failed':
+        return {
+            'success': True,
+            'status': 'failed',
+            'error': image_data.get('error') or 'Generation failed',
+            'breed': breed,
+            'progress': progress,
+            'images': images
+        }
+    # Frames that are already done are returned so the client can show them right away
+    return {
+        'success': True,
+        'status': 'processing',
+        'message': STATUS_MESSAGES.get(status, 'Images are still being generated...'),
+        'breed': breed,
+        'progress': progress,
+        'images': images
+    }
+
 @app.route('/check-status/<int:image_id>')
 @login_required
 def check_status(image_id):
     """Check if images are ready for a given image_id"""
     try:
-        image_data = database.get_image_by_id(image_id)
-        if not image_data or image_data['user_id'] != current_user.id:
+        image_data = database.get_image_status(image_id, current_user.id)
+        if not image_data:
             return jsonify({'error': 'Image not found'}), 404
         
-        # Check if all images are ready
-        trans1_exists = image_data.get('transition1_image') and os.path.exists(
-            os.path.join(app.config['UPLOAD_FOLDER'], image_data['transition1_image'])
-        )
-        final_exists = image_data.get('final_dog_image') and os.path.exists(
-            os.path.join(app.config['UPLOAD_FOLDER'], image_data['final_dog_image'])
-        )
-        full_dog_exists = image_data.get('transition2_image') and os.path.exists(
-            os.path.join(app.config['UPLOAD_FOLDER'], image_data['transition2_image'])
-        )
-        original_exists = image_data.get('original_image') and os.path.exists(
-            os.path.join(app.config['UPLOAD_FOLDER'], image_data['original_image'])
-        )
-        
-        all_ready = original_exists and trans1_exists and final_exists and full_dog_exists
-        
-        if all_ready:
-            return jsonify({
-                'success': True,
-                'status': 'complete',
-                'images': {
-                    'original': url_for('serve_image', filename=image_data['original_image']),
-                    'transition1': url_for('serve_image', filename=image_data['transition1_image']),
-                    'final': url_for('serve_image', filename=image_data['final_dog_image']),
-                    'full_dog': url_for('serve_image', filename=image_data['transition2_image'])
-                }
-            })
-        else:
-            return jsonify({
-                'success': True,
-                'status': 'processing',
-                'message': 'Images are still being generated...'
-            })
+        return jsonify(image_status(image_data))
     except Exception as e:
         print(f"Error checking status: {e}")
         return jsonify({
@@ -273,11 +475,90 @@ def check_status(image_id):
             'error': str(e)
         }), 500
 
+def wait_for_status(image_id, user_id, last_status, timeout):
+    """
+    Return the image's status once it differs from last_status, or the current status
+    after timeout seconds. Wakes up as soon as this process publishes a change, and
+    re-reads the database every EVENTS_RECHECK_INTERVAL for changes made elsewhere.
+    """
+    deadline = time.time() + timeout
+    seen_version = events.version(image_id)
+    while True:
+        status = image_status(database.get_image_status(image_id, user_id))
+        remaining = deadline - time.time()
+        if status != last_status or status['status'] in ('complete', 'failed') or remaining <= 0:
+            return status
+        seen_version = events.wait(image_id, seen_version, min(EVENTS_RECHECK_INTERVAL, remaining))
+
+def busy_status(status):
+    """Status payload for a client over EVENTS_MAX_STREAMS: poll /check-status instead of waiting here"""
+    return dict(status, poll_interval=EVENTS_BUSY_RETRY)
+
+@app.route('/events/<int:image_id>')
+@login_required
+def image_events(image_id):
+    """
+    Server-Sent Events stream of status updates for an image set.
+    With ?poll=1 this is a long-poll instead: the request returns as soon as the status
+    differs from the one described by ?since=<progress>, or after EVENTS_POLL_TIMEOUT.
+    At most EVENTS_MAX_STREAMS streams and long-polls wait at once; beyond that the current
+    status is returned right away with a poll_interval telling the client to poll /check-status.
+    """
+    # Read the user id up front; the stream generator runs after the request handler returns
+    user_id = current_user.id
+    image_data = database.get_image_status(image_id, user_id)
+    if not image_data:
+        return jsonify({'error': 'Image not found'}), 404
+    
+    if request.args.get('poll'):
+        status = image_status(image_data)
+        if status['progress'] == request.args.get('since') and status['status'] == 'processing':
+            if not _event_slots.acquire(blocking=False):
+                return jsonify(busy_status(status))
+            try:
+                status = wait_for_status(image_id, user_id, status, EVENTS_POLL_TIMEOUT)
+            finally:
+                _event_slots.release()
+        return jsonify(status)
+    
+    def stream():
+        # The slot is taken inside the generator so that it is released however the stream ends
+        if not _event_slots.acquire(blocking=False):
+            yield f"retry: {int(EVENTS_BUSY_RETRY * 1000)}\n\n"
+            yield f"data: {json.dumps(busy_status(image_status(image_data)))}\n\n"
+            return
+        try:
+            deadline = time.time() + EVENTS_STREAM_TIMEOUT
+            # Tell EventSource to reconnect quickly when the stream ends
+            yield "retry: 1000\n\n"
+            status = None
+            while True:
+                status = wait_for_status(image_id, user_id, status, max(0, deadline - time.time()))
+                yield f"data: {json.dumps(status)}\n\n"
+                if status['status'] != 'processing' or time.time() >= deadline:
+                    return
+        finally:
+            _event_slots.release()
+    
+    return Response(
+        stream_with_context(stream()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/images/<filename>')
 def serve_image(filename):
     """Serve images from uploads directory"""
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
+@app.route('/health/models')
+@login_required
+def model_health():
+    """Circuit breaker state of each image edit model (as seen by this worker process)"""
+    return jsonify({'models': circuit_breaker.get_states()})
+
 if __name__ == '__main__':
+    # Generation workers run in the server process only (under gunicorn see gunicorn.conf.py)
+    job_queue.start_workers(process_image_generation)
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,523 @@
+"""
+Asyncio engine for the transformation pipeline.
+
+Runs the same three-branch pipeline and fallback chain as
+openai_generator.generate_transformation_images, but every branch is a
+coroutine on one shared event loop instead of an OS thread. Job workers hand
+each job to the loop with submit() and go back to the queue; the job queue
+acknowledges the job when its future finishes (see job_queue), so any number
+of jobs share one loop, one AsyncOpenAI client and its connection pool
+without holding a worker thread each. The synchronous
+generate_transformation_images() wrapper, which blocks until the pipeline
+finishes, remains for callers outside the job queue.
+"""
+import os
+import asyncio
+import threading
+import openai_client
+import openai_generator
+import breed_cache
+import image_prep
+import image_output
+import hedging
+import circuit_breaker
+import retry
+import dog_head_library
+from openai_generator import (
+    build_analysis_messages,
+    parse_analysis,
+    default_analysis,
+    describe_analysis,
+    analysis_style_context,
+    build_composite_prompt_from_analysis,
+    build_edit_prompt,
+    build_dog_head_context_messages,
+    build_dog_head_prompt,
+    build_composite_messages,
+    build_characteristics_messages,
+    build_transition_analysis_prompt,
+    build_transition_simple_prompt,
+    build_final_analysis_prompt,
+    build_final_simple_prompt,
+    build_full_dog_prompt,
+    build_full_dog_simple_prompt,
+    get_mime_type,
+    is_refusal,
+    DEFAULT_BREED,
+    DEFAULT_USER_CONTEXT,
+    DEFAULT_IMAGE_DESCRIPTION,
+    EDIT_MODELS,
+    MAX_EDIT_IMAGE_SIZE,
+)
+
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+def _run_loop(loop):
+    asyncio.set_event_loop(loop)
+    loop.run_forever()
+
+def get_loop():
+    """Return the engine's event loop, starting its thread on first use in this process"""
+    global _loop, _loop_pid
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            threading.Thread(target=_run_loop, args=(_loop,), name="async-generator-loop", daemon=True).start()
+            print(f"Async engine: Event loop started in process {_loop_pid}")
+        return _loop
+
+def submit(coro):
+    """Schedule a coroutine on the engine loop and return a concurrent.futures.Future of its result"""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+def run(coro):
+    """Run a coroutine on the engine loop from synchronous code and wait for its result"""
+    return submit(coro).result()
+
+async def image_to_base64(image_path):
+    """Read and encode an image without blocking the event loop"""
+    return await asyncio.to_thread(openai_generator.image_to_base64, image_path)
+
+async def analyze_upload(image_path):
+    """Async version of openai_generator.analyze_upload"""
+    try:
+        if not openai_generator.OPENAI_API_KEY:
+            print("OpenAI API key not found, using default analysis")
+            return default_analysis()
+
+        image_hash = await asyncio.to_thread(breed_cache.image_hash, image_path)
+        cached = await asyncio.to_thread(breed_cache.get, image_hash)
+        if cached and not cached.get('fallback', True):
+            return cached
+
+        image_base64 = await image_to_base64(image_path)
+        if not image_base64:
+            print("Failed to encode image, using default analysis")
+            return default_analysis()
+
+        client = openai_client.get_async_client('chat')
+        response = await retry.call_async(
+            client.chat.completions.create,
+            model="gpt-4o",
+            messages=build_analysis_messages(image_base64, get_mime_type(image_path)),
+            max_tokens=500,
+            response_format={"type": "json_object"}
+        )
+
+        analysis = parse_analysis(response.choices[0].message.content)
+        if not analysis:
+            print(f"GPT-4 refused, using default analysis with breed: {DEFAULT_BREED}")
+            return default_analysis()
+
+        if cached:
+            # A near-identical photo was seen before: keep its breed so re-uploads get the same dog
+            analysis['breed'] = cached['breed']
+        print(f"Detected breed: {analysis['breed']}")
+        await asyncio.to_thread(breed_cache.put, image_hash, analysis)
+        return analysis
+
+    except Exception as e:
+        print(f"Error analyzing image: {e}")
+        return default_analysis()
+
+async def analyze_dog_breed(image_path):
+    """Async version of openai_generator.analyze_dog_breed"""
+    return (await analyze_upload(image_path))['breed']
+
+async def generate_single_transformation_image(prompt, output_path):
+    """Async version of openai_generator.generate_single_transformation_image"""
+    try:
+        if not openai_generator.OPENAI_API_KEY:
+            print("ERROR: OPENAI_API_KEY not set in environment")
+            return None
+
+        print("Generating image with DALL-E 3...")
+        print(f"Prompt preview: {prompt[:100]}...")
+
+        client = openai_client.get_async_client('image')
+        response = await retry.call_async(
+            client.images.generate,
+            model="dall-e-3",
+            prompt=prompt,
+            size="1024x1024",
+            quality="standard",
+            n=1,
+            response_format="b64_json"
+        )
+
+        return await asyncio.to_thread(image_output.save_image_result, response, output_path, "DALL-E 3")
+
+    except Exception as e:
+        print(f"Error generating image: {e}")
+        return None
+
+def _read_upload(path):
+    path = image_prep.prepare(path)
+    with open(path, 'rb') as f:
+        return (os.path.basename(path), f.read(), get_mime_type(path))
+
+async def edit_image_with_dog_head(human_image_path, dog_head_image_path, breed, output_path, transformation_level=1.0):
+    """Async version of openai_generator.edit_image_with_dog_head"""
+    try:
+        if not openai_generator.OPENAI_API_KEY:
+            print("ERROR: OPENAI_API_KEY not set in environment")
+            return None
+
+        print(f"[GPT-Image-1] Editing image (transformation level: {transformation_level})...")
+        edit_prompt = build_edit_prompt(breed, transformation_level)
+
+        human_upload, dog_upload = await asyncio.gather(
+            asyncio.to_thread(_read_upload, human_image_path),
+            asyncio.to_thread(_read_upload, dog_head_image_path)
+        )
+        for label, upload in (("Human", human_upload), ("Dog", dog_upload)):
+            if len(upload[1]) > MAX_EDIT_IMAGE_SIZE:
+                print(f"[GPT-Image-1] ERROR: {label} image too large ({len(upload[1])} bytes > {MAX_EDIT_IMAGE_SIZE} bytes)")
+                return None
+
+        client = openai_client.get_async_client('image')
+        response = None
+        last_error = None
+
+        try:
+            for model_name in EDIT_MODELS:
+                if not await asyncio.to_thread(circuit_breaker.allow, model_name):
+                    print(f"[GPT-Image-1] Skipping {model_name} (circuit breaker open)")
+                    continue
+                try:
+                    print(f"Trying model: {model_name}...")
+                    response = await retry.call_async(
+                        client.images.edit,
+                        model=model_name,
+                        image=[human_upload, dog_upload],
+                        prompt=edit_prompt,
+                        size="1024x1024",
+                        input_fidelity="high",
+                        label=model_name
+                    )
+                    print(f"[GPT-Image-1] Successfully got response from {model_name}")
+                    await asyncio.to_thread(circuit_breaker.record_success, model_name)
+                    break
+                except Exception as model_error:
+                    print(f"[GPT-Image-1] Model {model_name} failed: {model_error}")
+                    await asyncio.to_thread(circuit_breaker.record_failure, model_name, model_error)
+                    last_error = model_error
+
+            if not response:
+                raise Exception(f"All models failed. Last error: {last_error}")
+
+            return await asyncio.to_thread(openai_generator.save_edit_response, response, output_path)
+
+        except Exception as e:
+            openai_generator.log_edit_error(e)
+            return None
+
+    except Exception as e:
+        print(f"Error editing image: {e}")
+        return None
+
+async def generate_dog_head_image(breed, user_image_path, output_path, analysis=None):
+    """Async version of openai_generator.generate_dog_head_image"""
+    try:
+        if not openai_generator.OPENAI_API_KEY:
+            print("ERROR: OPENAI_API_KEY not set in environment")
+            return None
+
+        if analysis is not None:
+            user_context = analysis_style_context(analysis)
+            print(f"User image context (from analysis): {user_context}")
+            print(f"Generating {breed} dog head image...")
+            return await generate_single_transformation_image(build_dog_head_prompt(breed, user_context), output_path)
+
+        print("Analyzing user image for dog head generation...")
+        image_base64 = await image_to_base64(user_image_path)
+        if not image_base64:
+            print("Failed to encode user image")
+            return None
+
+        client = openai_client.get_async_client('chat')
+        try:
+            response = await retry.call_async(
+                client.chat.completions.create,
+                model="gpt-4o",
+                messages=build_dog_head_context_messages(image_base64, get_mime_type(user_image_path)),
+                max_tokens=50
+            )
+            user_context = response.choices[0].message.content.strip()
+            if is_refusal(user_context, ("sorry", "can't")):
+                user_context = DEFAULT_USER_CONTEXT
+            print(f"User image context: {user_context}")
+        except Exception as e:
+            print(f"Could not analyze user image, using default context: {e}")
+            user_context = DEFAULT_USER_CONTEXT
+
+        print(f"Generating {breed} dog head image...")
+        return await generate_single_transformation_image(build_dog_head_prompt(breed, user_context), output_path)
+
+    except Exception as e:
+        print(f"Error generating dog head: {e}")
+        return None
+
+async def create_composite_prompt_from_images(human_image_path, dog_head_image_path, breed, transformation_level, analysis=None):
+    """Async version of openai_generator.create_composite_prompt_from_images"""
+    try:
+        if not openai_generator.OPENAI_API_KEY:
+            return None
+
+        if analysis is not None:
+            if analysis.get('fallback'):
+                return None
+            print(f"Building composite prompt from analysis (transformation level: {transformation_level})...")
+            return build_composite_prompt_from_analysis(breed, transformation_level, analysis)
+
+        print(f"Analyzing both images to create composite prompt (transformation level: {transformation_level})...")
+        human_base64, dog_base64 = await asyncio.gather(
+            image_to_base64(human_image_path),
+            image_to_base64(dog_head_image_path)
+        )
+        if not human_base64 or not dog_base64:
+            print("Failed to encode images")
+            return None
+
+        client = openai_client.get_async_client('chat')
+        response = await retry.call_async(
+            client.chat.completions.create,
+            model="gpt-4o",
+            messages=build_composite_messages(
+                breed, transformation_level,
+                human_base64, get_mime_type(human_image_path),
+                dog_base64, get_mime_type(dog_head_image_path)
+            ),
+            max_tokens=500
+        )
+        prompt = response.choices[0].message.content.strip()
+        if is_refusal(prompt):
+            print("GPT-4 refused, using fallback prompt")
+            return None
+        print(f"Generated composite prompt: {prompt[:150]}...")
+        return prompt
+
+    except Exception as e:
+        print(f"Could not create composite prompt: {e}")
+        return None
+
+async def analyze_image_characteristics(image_path, analysis=None):
+    """Async version of openai_generator.analyze_image_characteristics"""
+    try:
+        if not openai_generator.OPENAI_API_KEY:
+            return None
+
+        if analysis is not None:
+            if analysis.get('fallback'):
+                return DEFAULT_IMAGE_DESCRIPTION
+            return describe_analysis(analysis)
+
+        print("Analyzing image characteristics...")
+        image_base64 = await image_to_base64(image_path)
+        if not image_base64:
+            return None
+
+        client = openai_client.get_async_client('chat')
+        response = await retry.call_async(
+            client.chat.completions.create,
+            model="gpt-4o",
+            messages=build_characteristics_messages(image_base64, get_mime_type(image_path)),
+            max_tokens=300
+        )
+        description = response.choices[0].message.content.strip()
+        if is_refusal(description, ("sorry", "can't")):
+            description = DEFAULT_IMAGE_DESCRIPTION
+        print(f"Image analysis: {description[:150]}...")
+        return description
+
+    except Exception as e:
+        print(f"Could not analyze image, using default: {e}")
+        return DEFAULT_IMAGE_DESCRIPTION
+
+async def _generate_frame_from_prompts(image_path, dog_path, breed, output_path, level, analysis_prompt, simple_prompt, label, analysis=None):
+    """Prompt-based fallback: GPT-4 Vision composite prompt -> image analysis prompt -> simple prompt"""
+    print(f"[{label}] [METHOD 2] Trying GPT-4 Vision prompt generation...")
+    prompt = await create_composite_prompt_from_images(image_path, dog_path, breed, level, analysis)
+    if prompt:
+        result = await generate_single_transformation_image(prompt, output_path)
+        if result:
+            print(f"✓ [SUCCESS] {label} generated using GPT-4 Vision + DALL-E 3")
+        return result
+
+    print(f"[{label}] [METHOD 3] GPT-4 Vision refused, trying image analysis fallback...")
+    image_desc = await analyze_image_characteristics(image_path, analysis)
+    if image_desc:
+        result = await generate_single_transformation_image(analysis_prompt(breed, image_desc), output_path)
+        if result:
+            print(f"✓ [SUCCESS] {label} generated using Image Analysis + DALL-E 3")
+        return result
+
+    print(f"[{label}] [METHOD 4] Image analysis failed, using simple fallback prompt...")
+    result = await generate_single_transformation_image(simple_prompt(breed), output_path)
+    if result:
+        print(f"✓ [SUCCESS] {label} generated using Simple Fallback + DALL-E 3")
+    return result
+
+async def _generate_edited_frame(image_path, dog_path, breed, output_path, level, analysis_prompt, simple_prompt, label, analysis=None, outcome=None):
+    """
+    Fallback chain shared by the transition and final branches:
+    GPT-Image-1 edit -> prompt-based generation, optionally hedged (see hedging.py).
+    outcome, if given, gets 'edited' as in openai_generator.generate_edited_frame.
+    """
+    outcome = {} if outcome is None else outcome
+    async def edit(path):
+        return await edit_image_with_dog_head(image_path, dog_path, breed, path, transformation_level=level)
+
+    async def from_prompts(path):
+        return await _generate_frame_from_prompts(
+            image_path, dog_path, breed, path, level, analysis_prompt, simple_prompt, label, analysis
+        )
+
+    if hedging.HEDGE_ENABLED:
+        print(f"[{label}] Hedged generation (GPT-Image-1, then prompt-based after {hedging.HEDGE_DELAY:.0f}s)...")
+        hedge = {}
+        result = await hedging.run_hedged_async([edit, from_prompts], output_path, label=label, outcome=hedge)
+        outcome['edited'] = bool(result) and hedge.get('method') == 0
+        if result:
+            print(f"✓ [SUCCESS] {label} generated (hedged)")
+        return result
+
+    print(f"[{label}] [METHOD 1] Attempting GPT-Image-1 (direct image editing)...")
+    result = await edit(output_path)
+    if result:
+        outcome['edited'] = True
+        print(f"✓ [SUCCESS] {label} generated using GPT-Image-1")
+        return result
+
+    print(f"[{label}] GPT-Image-1 failed, falling back to prompt-based generation...")
+    outcome['edited'] = False
+    return await from_prompts(output_path)
+
+async def _generate_full_dog(image_path, dog_path, breed, output_path, analysis=None):
+    """Full dog branch: image analysis prompt, falling back to a simple prompt"""
+    print("[Full dog] [METHOD 1] Analyzing images to create full dog with matching head...")
+    human_desc = await analyze_image_characteristics(image_path, analysis)
+    # The dog head was generated from the same analysis record, so no vision call is needed for it
+    has_dog_head = os.path.exists(dog_path)
+
+    if human_desc:
+        result = await generate_single_transformation_image(build_full_dog_prompt(breed, has_dog_head), output_path)
+        if result:
+            print("✓ [SUCCESS] Full dog image generated using Image Analysis + DALL-E 3")
+        return result
+
+    print("[Full dog] [METHOD 2] Image analysis failed, using simple fallback prompt...")
+    result = await generate_single_transformation_image(build_full_dog_simple_prompt(breed), output_path)
+    if result:
+        print("✓ [SUCCESS] Full dog image generated using Simple Fallback + DALL-E 3")
+    return result
+
+async def _report_when_ready(stage, branch, on_frame):
+    """Await a branch and pass its frame to on_frame as soon as it is ready"""
+    result = await branch
+    if result and on_frame:
+        try:
+            await asyncio.to_thread(on_frame, stage, result)
+        except Exception as e:
+            print(f"Could not report {stage} frame: {e}")
+    return result
+
+async def _local_transition(image_path, final_branch, final_outcome, output_path, level, generate):
+    """
+    Blend a transition frame locally once the final frame is ready. If the final frame is
+    not a GPT-Image-1 edit of the upload, the transition is generated with generate() instead.
+    """
+    final_path = await final_branch
+    if not final_path:
+        print("Transition: Final image missing, cannot blend")
+        return None
+    if not final_outcome.get('edited'):
+        # A prompt-based final is a new composition; blending it with the upload would double-expose
+        print("Transition: Final image is not an edit of the upload, generating it with the API")
+        return await generate()
+    return await asyncio.to_thread(openai_generator.blend_transition_frame, image_path, final_path, output_path, level)
+
+async def run_pipeline(image_path, breed, user_id, timestamp, analysis=None, on_frame=None):
+    """
+    Coroutine version of openai_generator.generate_transformation_images.
+    Returns (transition1, final, full_dog) paths.
+    """
+    base_path = f"uploads/{user_id}_{timestamp}"
+    dog_head_path = f"{base_path}_dog_head.png"
+    trans1_path = f"{base_path}_transition1.png"
+    final_path = f"{base_path}_final.png"
+    full_dog_path = f"{base_path}_full_dog.png"
+
+    if analysis is None:
+        print("Step 0: Analyzing uploaded image...")
+        analysis = await analyze_upload(image_path)
+
+    print(f"Step 1: Generating {breed} dog head image...")
+    # From the pre-generated library if it has the breed (a file link, no API call), else live
+    dog_path = await asyncio.to_thread(dog_head_library.fetch, breed, analysis, dog_head_path)
+    if not dog_path:
+        dog_path = await generate_dog_head_image(breed, image_path, dog_head_path, analysis)
+    if not dog_path or not os.path.exists(dog_path):
+        print("ERROR: Failed to generate dog head image")
+        return (None, None, None)
+
+    print("Step 2: Dog head generated. Now creating transformations...")
+    # A task, so that a locally blended transition can wait for it as well
+    final_outcome = {}
+    final_branch = asyncio.ensure_future(_generate_edited_frame(
+        image_path, dog_path, breed, final_path, 1.0,
+        build_final_analysis_prompt, build_final_simple_prompt, "Final image", analysis, final_outcome
+    ))
+
+    def generate_trans1():
+        return _generate_edited_frame(
+            image_path, dog_path, breed, trans1_path, 0.3,
+            build_transition_analysis_prompt, build_transition_simple_prompt, "Transition 1", analysis
+        )
+
+    if openai_generator.LOCAL_TRANSITIONS:
+        trans1_branch = _local_transition(image_path, final_branch, final_outcome, trans1_path, 0.3, generate_trans1)
+    else:
+        trans1_branch = generate_trans1()
+    branches = {
+        'trans1': trans1_branch,
+        'final': final_branch,
+        'full_dog': _generate_full_dog(image_path, dog_path, breed, full_dog_path, analysis),
+    }
+    outcomes = await asyncio.gather(
+        *(_report_when_ready(name, branch, on_frame) for name, branch in branches.items()),
+        return_exceptions=True
+    )
+
+    results = {}
+    errors = {}
+    for name, outcome in zip(branches, outcomes):
+        if isinstance(outcome, BaseException):
+            errors[name] = str(outcome)
+            continue
+        results[name] = outcome
+        if not outcome:
+            errors[name] = f"Failed to generate {name} - all methods exhausted"
+
+    print("All image generation branches completed")
+    if errors:
+        print(f"Errors during generation: {errors}")
+
+    # Same contract as the threaded engine: a branch that raised falls back to its expected path
+    return (
+        results.get('trans1', trans1_path),
+        results.get('final', final_path),
+        results.get('full_dog', full_dog_path)
+    )
+
+async def _run_pipeline_with_budget(image_path, breed, user_id, timestamp, analysis, on_frame):
+    # The budget is set inside the loop so that every task of this run inherits it
+    with retry.job_budget():
+        return await run_pipeline(image_path, breed, user_id, timestamp, analysis, on_frame)
+
+def generate_transformation_images(image_path, breed, user_id, timestamp, analysis=None, on_frame=None):
+    """Synchronous entry point with the same signature as openai_generator.generate_transformation_images"""
+    return run(_run_pipeline_with_budget(image_path, breed, user_id, timestamp, analysis, on_frame))
@@ -0,0 +1,99 @@
+"""
+Persistent cache of upload analysis results.
+
+Uploads are keyed by a perceptual difference hash (dHash) of the normalized
+image, so re-uploads of the same photo - even re-encoded, resized or with
+different EXIF - map to the same or a nearby hash. Each entry holds the full
+structured analysis record (breed, subject, pose, lighting, ...). Only an
+exact hash match reuses the whole record and skips the GPT-4o call; a
+nearby hash is trusted for the breed alone, since the rest of the record
+describes another upload's photo.
+"""
+import os
+from PIL import Image, ImageOps
+import database
+
+BREED_CACHE_ENABLED = os.environ.get('BREED_CACHE_ENABLED', '1') == '1'
+# Entries older than this are treated as missing and evicted
+BREED_CACHE_TTL = int(os.environ.get('BREED_CACHE_TTL', 30 * 24 * 3600))
+# Least recently used entries beyond this count are evicted
+BREED_CACHE_MAX_ENTRIES = int(os.environ.get('BREED_CACHE_MAX_ENTRIES', 5000))
+# Maximum number of differing hash bits for two images to count as the same photo
+BREED_CACHE_MAX_DISTANCE = int(os.environ.get('BREED_CACHE_MAX_DISTANCE', 4))
+
+HASH_SIZE = 8
+
+def image_hash(image_path):
+    """
+    Compute a 64-bit difference hash of the image as a hex string.
+    Returns None if the image cannot be read.
+    """
+    try:
+        with Image.open(image_path) as img:
+            img.seek(0)  # First frame of animated images
+            img = ImageOps.exif_transpose(img)
+            # One extra column so each row yields HASH_SIZE left/right comparisons
+            gray = img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS)
+            pixels = list(gray.getdata())
+    except Exception as e:
+        print(f"Breed cache: Could not hash image {image_path}: {e}")
+        return None
+
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return f"{value:016x}"
+
+def hamming_distance(hash_a, hash_b):
+    """Number of differing bits between two hex hashes"""
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count('1')
+
+def get(phash):
+    """
+    Return the cached analysis record for this hash, or None. A near-identical hash,
+    and entries written before full records were cached, only yield a fallback record
+    with the breed, so the caller re-runs the analysis and keeps that breed.
+    """
+    if not BREED_CACHE_ENABLED or not phash:
+        return None
+
+    try:
+        # An exact match is a primary key lookup; only otherwise scan the hashes for a near one
+        distance, cached_hash = 0, phash
+        entry = database.get_cached_breed(phash, BREED_CACHE_TTL)
+        if entry is None:
+            best = None
+            for candidate in database.get_cached_breed_hashes(BREED_CACHE_TTL):
+                candidate_distance = hamming_distance(phash, candidate)
+                if candidate_distance <= BREED_CACHE_MAX_DISTANCE and (best is None or candidate_distance < best[0]):
+                    best = (candidate_distance, candidate)
+            if not best:
+                return None
+            # Only the closest entry's analysis record is loaded and decoded
+            distance, cached_hash = best
+            entry = database.get_cached_breed(cached_hash, BREED_CACHE_TTL)
+            if entry is None:
+                return None
+
+        breed, analysis = entry
+        if distance or not analysis:
+            # Subject, clothing, background, ... of a different upload must not describe this one
+            analysis = {'breed': breed, 'fallback': True}
+        database.touch_cached_breed(cached_hash)
+        print(f"Breed cache: Hit for {phash} (distance {distance}): {analysis['breed']}")
+        return analysis
+    except Exception as e:
+        print(f"Breed cache: Lookup failed: {e}")
+        return None
+
+def put(phash, analysis):
+    """Store an analysis record for an image hash"""
+    if not BREED_CACHE_ENABLED or not phash or not analysis or not analysis.get('breed'):
+        return
+    try:
+        database.save_cached_breed(phash, analysis['breed'], BREED_CACHE_TTL, BREED_CACHE_MAX_ENTRIES, analysis)
+    except Exception as e:
+        print(f"Breed cache: Could not store analysis: {e}")
@@ -0,0 +1,146 @@
+"""
+Per-model circuit breakers for the image edit models.
+
+Every job tries EDIT_MODELS in order, so when a model is down (outage,
+timeouts, ...) each branch of each job pays a full failed API round trip
+before moving on. A breaker opens after BREAKER_FAILURE_THRESHOLD
+consecutive failures and the model is skipped. After BREAKER_COOLDOWN seconds
+a single probe request is let through; success closes the breaker, failure
+re-opens it for another cooldown.
+
+State lives in memory for all threads of the process and is written through
+to the `model_breakers` table, so it survives restarts and is picked up by
+new gunicorn workers.
+"""
+import os
+import time
+import threading
+import openai
+import database
+
+BREAKER_ENABLED = os.environ.get('BREAKER_ENABLED', '1') == '1'
+# Consecutive failures that open a breaker
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 3))
+# Seconds an open breaker waits before letting a probe request through
+BREAKER_COOLDOWN = float(os.environ.get('BREAKER_COOLDOWN', 300))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+_breakers = None
+_lock = threading.Lock()
+
+def _load():
+    """Load persisted breaker state once per process (caller holds _lock)"""
+    global _breakers
+    if _breakers is None:
+        _breakers = {}
+        try:
+            for row in database.get_model_breakers():
+                # A probe in flight in a previous process never reported back
+                state = OPEN if row['state'] == HALF_OPEN else row['state']
+                _breakers[row['model']] = dict(row, state=state, probing=None)
+        except Exception as e:
+            print(f"Circuit breaker: Could not load state: {e}")
+    return _breakers
+
+def _get(model):
+    breakers = _load()
+    if model not in breakers:
+        breakers[model] = {
+            'model': model, 'state': CLOSED, 'failures': 0,
+            'opened_at': None, 'last_error': None, 'probing': None
+        }
+    return breakers[model]
+
+def _save(breaker):
+    try:
+        database.save_model_breaker(
+            breaker['model'], breaker['state'], breaker['failures'],
+            breaker['opened_at'], breaker['last_error']
+        )
+    except Exception as e:
+        print(f"Circuit breaker: Could not persist state for {breaker['model']}: {e}")
+
+def allow(model):
+    """Return True if a request to model should be attempted now"""
+    if not BREAKER_ENABLED:
+        return True
+    with _lock:
+        breaker = _get(model)
+        if breaker['state'] == CLOSED:
+            return True
+        now = time.time()
+        # A probe that never reported back (cancelled or abandoned) is replaced after a cooldown
+        if breaker['probing'] and now - breaker['probing'] < BREAKER_COOLDOWN:
+            return False
+        if breaker['state'] == OPEN and now - (breaker['opened_at'] or 0) < BREAKER_COOLDOWN:
+            return False
+        # Cooldown elapsed: let exactly one probe through
+        breaker['state'] = HALF_OPEN
+        breaker['probing'] = now
+        _save(breaker)
+    print(f"Circuit breaker: Probing {model}")
+    return True
+
+def record_success(model):
+    """Close the model's breaker after a successful request"""
+    if not BREAKER_ENABLED:
+        return
+    with _lock:
+        breaker = _get(model)
+        changed = breaker['state'] != CLOSED or breaker['failures']
+        breaker.update(state=CLOSED, failures=0, opened_at=None, probing=None)
+        if changed:
+            _save(breaker)
+            print(f"Circuit breaker: {model} closed")
+
+def is_model_failure(error):
+    """
+    Whether an error says something about the model's health: server errors (5xx),
+    timeouts and connection failures. 4xx responses (rate limits, exhausted quota,
+    moderation rejections, ...) are about this account or request, so they do not
+    count against the model.
+    """
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    status = getattr(error, 'status_code', None)
+    return status is not None and status >= 500
+
+def record_failure(model, error):
+    """Count a failed request; opens the breaker at the threshold or when a probe fails"""
+    if not BREAKER_ENABLED:
+        return
+    if not is_model_failure(error):
+        if getattr(error, 'status_code', None) is not None:
+            # The model answered, so it is up
+            record_success(model)
+        return
+    with _lock:
+        breaker = _get(model)
+        breaker['failures'] += 1
+        breaker['last_error'] = str(error)[:500]
+        if breaker['state'] == HALF_OPEN or breaker['failures'] >= BREAKER_FAILURE_THRESHOLD:
+            if breaker['state'] != OPEN:
+                print(f"Circuit breaker: {model} opened after {breaker['failures']} failure(s)")
+            breaker.update(state=OPEN, opened_at=time.time(), probing=None)
+        _save(breaker)
+
+def get_states():
+    """Snapshot of all breakers, for the health endpoint"""
+    with _lock:
+        now = time.time()
+        states = []
+        for breaker in _load().values():
+            retry_in = None
+            if breaker['state'] == OPEN and breaker['opened_at']:
+                retry_in = max(0, round(BREAKER_COOLDOWN - (now - breaker['opened_at'])))
+            states.append({
+                'model': breaker['model'],
+                'state': breaker['state'],
+                'failures': breaker['failures'],
+                'last_error': breaker['last_error'],
+                'retry_in_seconds': retry_in
+            })
+        return states
@@ -1,16 +1,83 @@
 import sqlite3
 import os
-from werkzeug.security import generate_password_hash, check_password_hash
+import json
+import threading
+import password_hasher
 from datetime import datetime
 
 DATABASE = 'shaggy_dog.db'
 
-def get_db_connection():
-    """Get database connection"""
-    conn = sqlite3.connect(DATABASE)
+# Milliseconds a connection waits for another writer before failing with "database is locked"
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+# Page cache per connection in KiB
+DB_CACHE_SIZE_KB = int(os.environ.get('DB_CACHE_SIZE_KB', 8192))
+# Prepared statements kept per connection (the helpers below use a few dozen distinct queries)
+DB_CACHED_STATEMENTS = int(os.environ.get('DB_CACHED_STATEMENTS', 256))
+
+class ThreadConnection(sqlite3.Connection):
+    """
+    Connection owned by a single thread and reused by every helper it calls.
+    close() only ends an unfinished transaction; release() really closes it.
+    """
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def release(self):
+        super().close()
+
+_local = threading.local()
+
+def _open_connection():
+    conn = sqlite3.connect(
+        DATABASE,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=DB_CACHED_STATEMENTS,
+        factory=ThreadConnection
+    )
     conn.row_factory = sqlite3.Row
+    # WAL lets readers run while a generation thread writes; NORMAL sync is safe under WAL
+    conn.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA cache_size = -{DB_CACHE_SIZE_KB}')
+    return conn
+
+def get_db_connection():
+    """Get this thread's database connection (opened on first use, then reused)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and (_local.pid != os.getpid() or _local.path != DATABASE):
+        # Inherited across fork (leave it to the parent) or pointing at another database file
+        if _local.pid == os.getpid():
+            conn.release()
+        conn = None
+    
+    if conn is None:
+        conn = _open_connection()
+        _local.conn, _local.pid, _local.path = conn, os.getpid(), DATABASE
+    elif conn.in_transaction:
+        # A previous helper raised before committing
+        conn.rollback()
     return conn
 
+def close_connection():
+    """Close this thread's connection, e.g. before deleting the database file"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid():
+        conn.release()
+    _local.conn = None
+
+def ensure_column(cursor, table, column, definition):
+    """
+    Add a column to an existing table if it is missing (for databases created by older versions).
+    Returns True if the column was added.
+    """
+    cursor.execute(f'PRAGMA table_info({table})')
+    if column not in [row['name'] for row in cursor.fetchall()]:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        return True
+    return False
+
 def init_db():
     """Initialize database with tables"""
     conn = get_db_connection()
@@ -36,22 +103,127 @@ def init_db():
             transition1_image TEXT,
             transition2_image TEXT,
             final_dog_image TEXT,
+            morph_image TEXT,
+            analysis TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            error TEXT,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (user_id) REFERENCES users(id)
         )
     ''')
+    ensure_column(cursor, 'images', 'analysis', 'TEXT')
+    status_added = ensure_column(cursor, 'images', 'status', "TEXT NOT NULL DEFAULT 'queued'")
+    ensure_column(cursor, 'images', 'error', 'TEXT')
+    ensure_column(cursor, 'images', 'started_at', 'TIMESTAMP')
+    ensure_column(cursor, 'images', 'finished_at', 'TIMESTAMP')
+    ensure_column(cursor, 'images', 'morph_image', 'TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_images_user_status ON images (user_id, status)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_images_user_created ON images (user_id, created_at DESC, id DESC)')
+    
+    # Create generation jobs table (durable queue consumed by job_queue workers)
+    # breed is no longer written (each job detects the breed itself); kept for existing databases
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            image_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            image_path TEXT NOT NULL,
+            breed TEXT,
+            timestamp TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker_id TEXT,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            claimed_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (image_id) REFERENCES images(id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)')
+    
+    if status_added:
+        # Existing sets predate the status column: derive it from their frames and jobs
+        cursor.execute('''
+            UPDATE images SET status = 'complete'
+            WHERE transition1_image IS NOT NULL AND transition2_image IS NOT NULL AND final_dog_image IS NOT NULL
+        ''')
+        # Anything else unfinished with no job left to run it will never finish: fail it
+        # with its last job's error, so it does not show as queued forever
+        cursor.execute('''
+            UPDATE images SET status = 'failed', error = COALESCE((
+                SELECT last_error FROM jobs WHERE jobs.image_id = images.id ORDER BY jobs.id DESC LIMIT 1
+            ), 'Generation did not finish')
+            WHERE status = 'queued'
+            AND NOT EXISTS (
+                SELECT 1 FROM jobs WHERE jobs.image_id = images.id AND jobs.status IN ('queued', 'running')
+            )
+        ''')
+    
+    # Create breed cache table (perceptual image hash -> detected breed)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS breed_cache (
+            phash TEXT PRIMARY KEY,
+            breed TEXT NOT NULL,
+            analysis TEXT,
+            hits INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    ensure_column(cursor, 'breed_cache', 'analysis', 'TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_breed_cache_last_used ON breed_cache (last_used_at)')
+    
+    # Create generation cache table (image digest + breed + stage -> generated frame, see generation_cache.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS generation_cache (
+            digest TEXT NOT NULL,
+            breed TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (digest, breed, stage)
+        )
+    ''')
+    
+    # Create model circuit breaker table (see circuit_breaker.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS model_breakers (
+            model TEXT PRIMARY KEY,
+            state TEXT NOT NULL DEFAULT 'closed',
+            failures INTEGER NOT NULL DEFAULT 0,
+            opened_at REAL,
+            last_error TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Create rate limit table (token buckets shared by all processes, see rate_limiter.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            bucket TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
     
     conn.commit()
     conn.close()
     print("Database initialized successfully")
 
 def create_user(username, password):
-    """Create a new user with hashed password"""
+    """Create a new user with hashed password (raises password_hasher.PasswordHasherBusy when saturated)"""
+    # Hash in the hashing pool before touching the database
+    password_hash = password_hasher.hash_password(password)
     conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
-        password_hash = generate_password_hash(password, method='pbkdf2:sha256')
         cursor.execute(
             'INSERT INTO users (username, password_hash) VALUES (?, ?)',
             (username, password_hash)
@@ -65,7 +237,7 @@ def create_user(username, password):
         return None
 
 def verify_user(username, password):
-    """Verify user credentials"""
+    """Verify user credentials (raises password_hasher.PasswordHasherBusy when saturated)"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
@@ -73,7 +245,7 @@ def verify_user(username, password):
     user = cursor.fetchone()
     conn.close()
     
-    if user and check_password_hash(user['password_hash'], password):
+    if user and password_hasher.check_password(user['password_hash'], password):
         return {'id': user['id'], 'username': user['username']}
     return None
 
@@ -90,33 +262,51 @@ def get_user_by_id(user_id):
         return {'id': user['id'], 'username': user['username']}
     return None
 
-def save_image_set(user_id, original_path, breed, trans1, final, full_dog):
-    """Save image transformation set to database"""
+def save_image_set(user_id, original_path, breed, trans1, final, full_dog, analysis=None):
+    """Save image transformation set to database, with the upload's analysis record if given"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
     # Use transition2_image column for full_dog (to maintain compatibility with existing schema)
+    status = 'complete' if trans1 and final and full_dog else 'queued'
     cursor.execute('''
-        INSERT INTO images (user_id, original_image, dog_breed, transition1_image, transition2_image, final_dog_image)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (user_id, original_path, breed, trans1, full_dog, final))
+        INSERT INTO images (user_id, original_image, dog_breed, transition1_image, transition2_image, final_dog_image, analysis, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, original_path, breed, trans1, full_dog, final, json.dumps(analysis) if analysis else None, status))
     
     conn.commit()
     image_id = cursor.lastrowid
     conn.close()
     return image_id
 
-def get_user_images(user_id):
-    """Get all images for a user"""
+def get_user_images(user_id, limit=-1, before_id=None):
+    """
+    Get a user's images, newest first. With limit, returns one page; pass the id of the
+    last image of the previous page as before_id to get the next one (keyset pagination,
+    so every page costs the same however long the history is).
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute('''
-        SELECT id, original_image, dog_breed, transition1_image, transition2_image, final_dog_image, created_at
-        FROM images
-        WHERE user_id = ?
-        ORDER BY created_at DESC
-    ''', (user_id,))
+    # (created_at, id) orders sets made within the same second; idx_images_user_created serves both filters and order
+    if before_id is None:
+        cursor.execute('''
+            SELECT id, original_image, dog_breed, transition1_image, transition2_image, final_dog_image, morph_image,
+                   status, created_at
+            FROM images
+            WHERE user_id = ?
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+        ''', (user_id, limit))
+    else:
+        cursor.execute('''
+            SELECT id, original_image, dog_breed, transition1_image, transition2_image, final_dog_image, morph_image,
+                   status, created_at
+            FROM images
+            WHERE user_id = ? AND (created_at, id) < (SELECT created_at, id FROM images WHERE id = ?)
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+        ''', (user_id, before_id, limit))
     # Note: transition2_image now contains full_dog image, final_dog_image contains final (dog head on human body)
     
     images = cursor.fetchall()
@@ -124,13 +314,31 @@ def get_user_images(user_id):
     
     return [dict(img) for img in images]
 
+def get_top_breeds(limit):
+    """Most frequently detected breeds across all image sets, most common first"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT dog_breed, COUNT(*) AS uses FROM images
+        WHERE dog_breed IS NOT NULL AND dog_breed != ''
+        GROUP BY dog_breed
+        ORDER BY uses DESC
+        LIMIT ?
+    ''', (limit,))
+    
+    breeds = cursor.fetchall()
+    conn.close()
+    return [row['dog_breed'] for row in breeds]
+
 def get_image_by_id(image_id):
     """Get image by ID"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
-        SELECT id, user_id, original_image, dog_breed, transition1_image, transition2_image, final_dog_image, created_at
+        SELECT id, user_id, original_image, dog_breed, transition1_image, transition2_image, final_dog_image, analysis,
+               status, error, started_at, finished_at, created_at
         FROM images
         WHERE id = ?
     ''', (image_id,))
@@ -139,9 +347,31 @@ def get_image_by_id(image_id):
     conn.close()
     
     if image:
-        return dict(image)
+        image = dict(image)
+        image['analysis'] = json.loads(image['analysis']) if image['analysis'] else None
+        return image
     return None
 
+def get_image_status(image_id, user_id):
+    """
+    Get the generation state of one of the user's image sets with a single primary key read
+    (no analysis blob, no filesystem checks). Returns None if the set does not exist or belongs
+    to someone else.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT id, user_id, original_image, dog_breed, transition1_image, transition2_image, final_dog_image,
+               morph_image, status, error
+        FROM images
+        WHERE id = ? AND user_id = ?
+    ''', (image_id, user_id))
+    
+    image = cursor.fetchone()
+    conn.close()
+    return dict(image) if image else None
+
 def update_image_set(image_id, trans1, final, full_dog):
     """Update image transformation set in database"""
     conn = get_db_connection()
@@ -150,10 +380,443 @@ def update_image_set(image_id, trans1, final, full_dog):
     # Use transition2_image column for full_dog (to maintain compatibility with existing schema)
     cursor.execute('''
         UPDATE images 
-        SET transition1_image = ?, transition2_image = ?, final_dog_image = ?
+        SET transition1_image = ?, transition2_image = ?, final_dog_image = ?,
+            status = 'complete', error = NULL, finished_at = CURRENT_TIMESTAMP
         WHERE id = ?
     ''', (trans1, full_dog, final, image_id))
     
     conn.commit()
     conn.close()
     return True
+
+def update_image_morph(image_id, filename):
+    """Record the morph animation of an image set (see morph_sequence.py)"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('UPDATE images SET morph_image = ? WHERE id = ?', (filename, image_id))
+    
+    conn.commit()
+    conn.close()
+    return True
+
+# Column holding each generated frame (transition2_image holds full_dog, see save_image_set)
+FRAME_COLUMNS = {
+    'trans1': 'transition1_image',
+    'final': 'final_dog_image',
+    'full_dog': 'transition2_image',
+}
+
+def update_image_frame(image_id, stage, filename):
+    """Record a single generated frame as soon as it is ready"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(f'UPDATE images SET {FRAME_COLUMNS[stage]} = ? WHERE id = ?', (filename, image_id))
+    
+    conn.commit()
+    conn.close()
+    return True
+
+# Generation states of an image set: queued -> analyzing -> generating -> animating -> complete, or failed
+IMAGE_STATUSES = ('queued', 'analyzing', 'generating', 'animating', 'complete', 'failed')
+
+def set_image_status(image_id, status, error=None):
+    """Record the generation state of an image set, stamping when work started and finished"""
+    if status not in IMAGE_STATUSES:
+        raise ValueError(f"Unknown image status: {status}")
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        UPDATE images
+        SET status = ?, error = ?,
+            started_at = CASE WHEN ? IN ('analyzing', 'generating', 'animating') THEN COALESCE(started_at, CURRENT_TIMESTAMP) ELSE started_at END,
+            finished_at = CASE WHEN ? IN ('complete', 'failed') THEN CURRENT_TIMESTAMP ELSE NULL END
+        WHERE id = ?
+    ''', (status, error, status, status, image_id))
+    
+    conn.commit()
+    conn.close()
+    return True
+
+def update_image_analysis(image_id, breed, analysis):
+    """Record the detected breed and upload analysis once the pipeline has produced them"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        UPDATE images SET dog_breed = ?, analysis = ? WHERE id = ?
+    ''', (breed, json.dumps(analysis) if analysis else None, image_id))
+    
+    conn.commit()
+    conn.close()
+    return True
+
+def enqueue_job(image_id, user_id, image_path, timestamp):
+    """Add a generation job to the queue"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        INSERT INTO jobs (image_id, user_id, image_path, timestamp)
+        VALUES (?, ?, ?, ?)
+    ''', (image_id, user_id, image_path, timestamp))
+    
+    conn.commit()
+    job_id = cursor.lastrowid
+    conn.close()
+    return job_id
+
+def claim_next_job(worker_id):
+    """
+    Atomically claim the oldest queued job for a worker.
+    Returns the claimed job as a dict, or None if the queue is empty.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        # BEGIN IMMEDIATE takes the write lock up front so two workers
+        # (in this process or another gunicorn worker) never claim the same job
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            SELECT id FROM jobs
+            WHERE status = 'queued'
+            ORDER BY id
+            LIMIT 1
+        ''')
+        row = cursor.fetchone()
+        if not row:
+            conn.commit()
+            return None
+        
+        cursor.execute('''
+            UPDATE jobs
+            SET status = 'running', worker_id = ?, attempts = attempts + 1, claimed_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (worker_id, row['id']))
+        cursor.execute('SELECT * FROM jobs WHERE id = ?', (row['id'],))
+        job = dict(cursor.fetchone())
+        conn.commit()
+        return job
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def complete_job(job_id):
+    """Mark a job as finished successfully"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        UPDATE jobs
+        SET status = 'done', last_error = NULL, finished_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (job_id,))
+    
+    conn.commit()
+    conn.close()
+    return True
+
+def fail_job(job_id, error):
+    """Mark a job as failed with the given error message"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        UPDATE jobs
+        SET status = 'failed', last_error = ?, finished_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (error, job_id))
+    cursor.execute('''
+        UPDATE images
+        SET status = 'failed', error = ?, finished_at = CURRENT_TIMESTAMP
+        WHERE id = (SELECT image_id FROM jobs WHERE id = ?)
+    ''', (error, job_id))
+    
+    conn.commit()
+    conn.close()
+    return True
+
+def requeue_stale_jobs(lease_seconds, max_attempts):
+    """
+    Return jobs whose worker died mid-run (lease not renewed for lease_seconds)
+    to the queue, or fail them once they have used up max_attempts.
+    Returns the number of jobs touched.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cutoff = f'-{int(lease_seconds)} seconds'
+    cursor.execute('''
+        UPDATE images
+        SET status = 'failed', error = 'Worker lease expired too many times', finished_at = CURRENT_TIMESTAMP
+        WHERE id IN (
+            SELECT image_id FROM jobs
+            WHERE status = 'running' AND claimed_at < datetime('now', ?) AND attempts >= ?
+        )
+    ''', (cutoff, max_attempts))
+    cursor.execute('''
+        UPDATE jobs
+        SET status = 'failed', last_error = 'Worker lease expired too many times', finished_at = CURRENT_TIMESTAMP
+        WHERE status = 'running' AND claimed_at < datetime('now', ?) AND attempts >= ?
+    ''', (cutoff, max_attempts))
+    touched = cursor.rowcount
+    cursor.execute('''
+        UPDATE jobs
+        SET status = 'queued', worker_id = NULL
+        WHERE status = 'running' AND claimed_at < datetime('now', ?)
+    ''', (cutoff,))
+    touched += cursor.rowcount
+    
+    conn.commit()
+    conn.close()
+    return touched
+
+def renew_job_leases(worker_ids):
+    """Extend the lease of every job the given workers are running (the workers' heartbeat)"""
+    if not worker_ids:
+        return 0
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    placeholders = ', '.join('?' for _ in worker_ids)
+    cursor.execute(f'''
+        UPDATE jobs
+        SET claimed_at = CURRENT_TIMESTAMP
+        WHERE status = 'running' AND worker_id IN ({placeholders})
+    ''', list(worker_ids))
+    renewed = cursor.rowcount
+    
+    conn.commit()
+    conn.close()
+    return renewed
+
+def release_jobs(worker_ids):
+    """Put jobs still held by the given workers back on the queue (used on shutdown)"""
+    if not worker_ids:
+        return 0
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    placeholders = ', '.join('?' for _ in worker_ids)
+    cursor.execute(f'''
+        UPDATE jobs
+        SET status = 'queued', worker_id = NULL, attempts = MAX(attempts - 1, 0)
+        WHERE status = 'running' AND worker_id IN ({placeholders})
+    ''', list(worker_ids))
+    released = cursor.rowcount
+    
+    conn.commit()
+    conn.close()
+    return released
+
+def get_cached_breed(phash, ttl_seconds):
+    """Get the breed cache entry for exactly this hash as (breed, analysis), or None if missing or expired"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT breed, analysis FROM breed_cache
+        WHERE phash = ? AND created_at >= datetime('now', ?)
+    ''', (phash, f'-{int(ttl_seconds)} seconds'))
+    
+    entry = cursor.fetchone()
+    conn.close()
+    if not entry:
+        return None
+    return entry['breed'], json.loads(entry['analysis']) if entry['analysis'] else None
+
+def get_cached_breed_hashes(ttl_seconds):
+    """Get the hashes of all breed cache entries younger than ttl_seconds (without their analysis records)"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT phash FROM breed_cache
+        WHERE created_at >= datetime('now', ?)
+    ''', (f'-{int(ttl_seconds)} seconds',))
+    
+    hashes = [entry['phash'] for entry in cursor.fetchall()]
+    conn.close()
+    return hashes
+
+def touch_cached_breed(phash):
+    """Record a cache hit so the entry is kept by LRU eviction"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        UPDATE breed_cache
+        SET hits = hits + 1, last_used_at = CURRENT_TIMESTAMP
+        WHERE phash = ?
+    ''', (phash,))
+    
+    conn.commit()
+    conn.close()
+    return True
+
+def save_cached_breed(phash, breed, ttl_seconds, max_entries, analysis=None):
+    """Store a breed (and its analysis record) for an image hash, then evict expired and least recently used entries"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        INSERT OR REPLACE INTO breed_cache (phash, breed, analysis)
+        VALUES (?, ?, ?)
+    ''', (phash, breed, json.dumps(analysis) if analysis else None))
+    cursor.execute('''
+        DELETE FROM breed_cache
+        WHERE created_at < datetime('now', ?)
+    ''', (f'-{int(ttl_seconds)} seconds',))
+    cursor.execute('''
+        DELETE FROM breed_cache
+        WHERE phash IN (
+            SELECT phash FROM breed_cache
+            ORDER BY last_used_at DESC
+            LIMIT -1 OFFSET ?
+        )
+    ''', (max_entries,))
+    
+    conn.commit()
+    conn.close()
+    return True
+
+def get_generation_cache_entries(digest, breed, ttl_seconds):
+    """Get cached frames younger than ttl_seconds for an image digest and breed as a {stage: path} dict"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT stage, path FROM generation_cache
+        WHERE digest = ? AND breed = ? AND created_at >= datetime('now', ?)
+    ''', (digest, breed, f'-{int(ttl_seconds)} seconds'))
+    
+    entries = cursor.fetchall()
+    conn.close()
+    return {entry['stage']: entry['path'] for entry in entries}
+
+def touch_generation_cache_entries(digest, breed):
+    """Record a cache hit so the frames are kept by LRU eviction"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        UPDATE generation_cache
+        SET hits = hits + 1, last_used_at = CURRENT_TIMESTAMP
+        WHERE digest = ? AND breed = ?
+    ''', (digest, breed))
+    
+    conn.commit()
+    conn.close()
+    return True
+
+def save_generation_cache_entry(digest, breed, stage, path, size):
+    """Store a generated frame for an image digest, breed and stage"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        INSERT OR REPLACE INTO generation_cache (digest, breed, stage, path, size)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (digest, breed, stage, path, size))
+    
+    conn.commit()
+    conn.close()
+    return True
+
+def evict_generation_cache(ttl_seconds, max_bytes):
+    """
+    Remove cached frames older than ttl_seconds, then least recently used ones until
+    the total size is at most max_bytes. Returns the paths of the removed files.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('''
+            SELECT rowid, path FROM generation_cache
+            WHERE created_at < datetime('now', ?)
+            UNION ALL
+            SELECT rowid, path FROM (
+                SELECT rowid, path, created_at,
+                       SUM(size) OVER (ORDER BY last_used_at DESC, rowid DESC) AS running_size
+                FROM generation_cache
+                WHERE created_at >= datetime('now', ?)
+            )
+            WHERE running_size > ?
+        ''', (f'-{int(ttl_seconds)} seconds', f'-{int(ttl_seconds)} seconds', max_bytes))
+        evicted = cursor.fetchall()
+        cursor.executemany('DELETE FROM generation_cache WHERE rowid = ?', [(entry['rowid'],) for entry in evicted])
+        conn.commit()
+        return [entry['path'] for entry in evicted]
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def get_model_breakers():
+    """Get the persisted state of all model circuit breakers"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('SELECT model, state, failures, opened_at, last_error FROM model_breakers')
+    breakers = cursor.fetchall()
+    conn.close()
+    return [dict(breaker) for breaker in breakers]
+
+def save_model_breaker(model, state, failures, opened_at, last_error):
+    """Persist the state of one model circuit breaker"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        INSERT OR REPLACE INTO model_breakers (model, state, failures, opened_at, last_error, updated_at)
+        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ''', (model, state, failures, opened_at, last_error))
+    
+    conn.commit()
+    conn.close()
+    return True
+
+def take_rate_limit_token(bucket, rate, capacity, now):
+    """
+    Take one token from a shared token bucket refilled at `rate` tokens per second.
+    Returns 0 if a token was taken, otherwise the seconds to wait until one is available.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        # BEGIN IMMEDIATE serializes token accounting across threads and gunicorn workers
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('SELECT tokens, updated_at FROM rate_limits WHERE bucket = ?', (bucket,))
+        row = cursor.fetchone()
+        if row:
+            tokens = min(capacity, row['tokens'] + max(0.0, now - row['updated_at']) * rate)
+        else:
+            tokens = capacity
+        
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        cursor.execute('''
+            INSERT OR REPLACE INTO rate_limits (bucket, tokens, updated_at)
+            VALUES (?, ?, ?)
+        ''', (bucket, tokens, now))
+        conn.commit()
+        return wait
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
@@ -0,0 +1,137 @@
+"""
+Library of pre-generated dog head images per breed.
+
+Step 1 of the pipeline (a DALL-E 3 dog head portrait) runs before every other
+branch can start. In library mode the head is taken from a store of images
+generated ahead of time instead, and live generation only runs when the
+breed is not in the store. Each breed has one image per coarse style bucket
+(lighting x expression, derived from the upload's analysis record), with the
+'soft-neutral' image as the breed's fallback.
+
+Fill the store offline with the warm-up command, e.g.
+
+    python dog_head_library.py warm --top 30
+    python dog_head_library.py warm --breeds "Golden Retriever,Beagle"
+
+Assets live under DOG_HEAD_LIBRARY_DIR/v<LIBRARY_VERSION>/<breed>/<bucket>.png;
+bump LIBRARY_VERSION when the dog head prompt changes so old assets are ignored.
+"""
+import os
+import re
+import sys
+import argparse
+import generation_cache
+
+DOG_HEAD_LIBRARY_ENABLED = os.environ.get('DOG_HEAD_LIBRARY_ENABLED', '0') == '1'
+DOG_HEAD_LIBRARY_DIR = os.environ.get('DOG_HEAD_LIBRARY_DIR', 'dog_head_library')
+
+LIBRARY_VERSION = 1
+DEFAULT_BUCKET = 'soft-neutral'
+
+# Style phrase used for each bucket's dog head prompt (see openai_generator.build_dog_head_prompt)
+BUCKET_CONTEXTS = {
+    'soft-neutral': "soft studio lighting, front-facing, neutral expression",
+    'soft-smiling': "soft studio lighting, front-facing, warm smiling expression",
+    'bright-neutral': "bright even daylight, front-facing, neutral expression",
+    'bright-smiling': "bright even daylight, front-facing, cheerful smiling expression",
+    'dramatic-neutral': "dramatic low-key lighting, front-facing, serious expression",
+    'dramatic-smiling': "dramatic low-key lighting, front-facing, confident smiling expression",
+}
+
+BRIGHT_WORDS = ('bright', 'daylight', 'sunny', 'sunlight', 'outdoor', 'natural light', 'high-key')
+DRAMATIC_WORDS = ('dramatic', 'low-key', 'dark', 'moody', 'contrast', 'shadow', 'night')
+SMILING_WORDS = ('smil', 'laugh', 'grin', 'happy', 'cheerful', 'joy')
+
+def breed_slug(breed):
+    """Directory name for a breed ('Golden Retriever' -> 'golden-retriever')"""
+    return re.sub(r'[^a-z0-9]+', '-', (breed or '').strip().lower()).strip('-')
+
+def style_bucket(analysis):
+    """Coarse style bucket of an upload's analysis record (lighting x expression)"""
+    analysis = analysis or {}
+    lighting = f"{analysis.get('lighting') or ''} {analysis.get('mood') or ''}".lower()
+    expression = str((analysis.get('subject') or {}).get('expression') or '').lower()
+    if any(word in lighting for word in DRAMATIC_WORDS):
+        light = 'dramatic'
+    elif any(word in lighting for word in BRIGHT_WORDS):
+        light = 'bright'
+    else:
+        light = 'soft'
+    mood = 'smiling' if any(word in expression for word in SMILING_WORDS) else 'neutral'
+    return f"{light}-{mood}"
+
+def asset_path(breed, bucket):
+    """Where the dog head of a breed and style bucket is stored"""
+    return os.path.join(DOG_HEAD_LIBRARY_DIR, f"v{LIBRARY_VERSION}", breed_slug(breed), f"{bucket}.png")
+
+def fetch(breed, analysis, output_path):
+    """
+    Put the library's dog head for breed at output_path and return output_path,
+    or None if library mode is off or the breed is not in the library.
+    """
+    if not DOG_HEAD_LIBRARY_ENABLED or not breed_slug(breed):
+        return None
+    bucket = style_bucket(analysis)
+    for candidate in (bucket, DEFAULT_BUCKET):
+        path = asset_path(breed, candidate)
+        if os.path.exists(path):
+            try:
+                generation_cache.link_or_copy(path, output_path)
+            except OSError as e:
+                print(f"Dog head library: Could not use {path}: {e}")
+                return None
+            print(f"Dog head library: Using {breed} ({candidate}) for bucket {bucket}")
+            return output_path
+    print(f"Dog head library: No asset for {breed}, generating live")
+    return None
+
+def warm(breeds, buckets=None, overwrite=False):
+    """Generate missing library assets for breeds; returns the number of images generated"""
+    import openai_generator
+
+    generated = 0
+    for breed in breeds:
+        for bucket in buckets or BUCKET_CONTEXTS:
+            path = asset_path(breed, bucket)
+            if os.path.exists(path) and not overwrite:
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp.png"
+            prompt = openai_generator.build_dog_head_prompt(breed, BUCKET_CONTEXTS[bucket])
+            print(f"Dog head library: Generating {breed} ({bucket})...")
+            if openai_generator.generate_single_transformation_image(prompt, tmp_path):
+                os.replace(tmp_path, path)
+                generated += 1
+            else:
+                print(f"Dog head library: Failed to generate {breed} ({bucket})")
+    return generated
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the per-breed dog head library")
+    commands = parser.add_subparsers(dest='command', required=True)
+    warm_parser = commands.add_parser('warm', help="Generate missing dog head assets")
+    warm_parser.add_argument('--breeds', help="Comma-separated breed names")
+    warm_parser.add_argument('--top', type=int, default=30, help="Use the N most common breeds in the database (default 30)")
+    warm_parser.add_argument('--buckets', help=f"Comma-separated style buckets (default all: {', '.join(BUCKET_CONTEXTS)})")
+    warm_parser.add_argument('--overwrite', action='store_true', help="Regenerate assets that already exist")
+    args = parser.parse_args(argv)
+
+    if args.breeds:
+        breeds = [breed.strip() for breed in args.breeds.split(',') if breed.strip()]
+    else:
+        import database
+        breeds = database.get_top_breeds(args.top)
+    buckets = [bucket.strip() for bucket in args.buckets.split(',')] if args.buckets else None
+    unknown = [bucket for bucket in buckets or [] if bucket not in BUCKET_CONTEXTS]
+    if unknown:
+        parser.error(f"Unknown bucket(s): {', '.join(unknown)}")
+    if not breeds:
+        print("Dog head library: No breeds to warm")
+        return 0
+
+    generated = warm(breeds, buckets, args.overwrite)
+    print(f"Dog head library: Generated {generated} image(s) for {len(breeds)} breed(s)")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
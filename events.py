@@ -0,0 +1,35 @@
+"""
+In-process notifications of image status changes.
+
+The generation pipeline calls publish(image_id) whenever a frame or the whole
+job finishes; /events/<image_id> streams block in wait() and wake up
+immediately instead of re-reading the database on a timer. A job can run in
+a different gunicorn worker than the one serving the stream, so waiters also
+wake up after a timeout and re-check the database themselves.
+"""
+import threading
+
+# Versions kept for this many images; older entries are dropped first
+MAX_TRACKED_IMAGES = 10000
+
+_versions = {}
+_condition = threading.Condition()
+
+def publish(image_id):
+    """Signal that the status of image_id has changed"""
+    with _condition:
+        _versions[image_id] = _versions.pop(image_id, 0) + 1
+        while len(_versions) > MAX_TRACKED_IMAGES:
+            del _versions[next(iter(_versions))]
+        _condition.notify_all()
+
+def version(image_id):
+    """Current change counter of image_id in this process"""
+    with _condition:
+        return _versions.get(image_id, 0)
+
+def wait(image_id, seen_version, timeout):
+    """Block until image_id changes past seen_version or timeout expires; returns the new version"""
+    with _condition:
+        _condition.wait_for(lambda: _versions.get(image_id, 0) != seen_version, timeout)
+        return _versions.get(image_id, 0)
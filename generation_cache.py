@@ -0,0 +1,107 @@
+"""
+Content-addressed cache of generated frames.
+
+Frames are keyed by the SHA-256 digest of the normalized upload (see
+image_prep), the detected breed and the stage ('trans1', 'final',
+'full_dog'). The digest is an exact content hash, so only byte-identical
+uploads hit the cache: the same photo re-encoded, resized or with different
+EXIF is a miss (unlike the perceptual hash of breed_cache). When a job's
+upload and breed have all three frames cached, the
+job finishes by hard-linking (or copying) them into its output paths instead
+of calling the API again. Entries expire after GENERATION_CACHE_TTL seconds,
+and least recently used ones are evicted once the cache holds more than
+GENERATION_CACHE_MAX_BYTES.
+"""
+import os
+import re
+import shutil
+import hashlib
+import image_prep
+import database
+import image_output
+
+GENERATION_CACHE_ENABLED = os.environ.get('GENERATION_CACHE_ENABLED', '1') == '1'
+# Directory holding cached frames (same filesystem as uploads/ so they can be hard-linked)
+GENERATION_CACHE_DIR = os.environ.get('GENERATION_CACHE_DIR', 'generation_cache')
+# Entries older than this are treated as missing and evicted
+GENERATION_CACHE_TTL = int(os.environ.get('GENERATION_CACHE_TTL', 7 * 24 * 3600))
+# Least recently used entries are evicted once the cache is larger than this
+GENERATION_CACHE_MAX_BYTES = int(os.environ.get('GENERATION_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+
+# Bump when prompts or models change so frames made by the old pipeline are no longer reused
+CACHE_VERSION = 1
+STAGES = ('trans1', 'final', 'full_dog')
+
+def image_digest(image_path):
+    """
+    Exact digest of the normalized upload, or None if it cannot be read. Only
+    byte-identical uploads share a digest; a re-encoded copy of the photo does not.
+    """
+    try:
+        digest = hashlib.sha256(f"v{CACHE_VERSION}:".encode())
+        with open(image_prep.prepare(image_path), 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    except OSError as e:
+        print(f"Generation cache: Could not hash {image_path}: {e}")
+        return None
+
+def _breed_key(breed):
+    return (breed or '').strip().lower()
+
+def link_or_copy(source, destination):
+    """Place source at destination atomically, sharing the file when the filesystem allows it"""
+    tmp_path = image_output.temp_path(destination)
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, destination)
+
+def restore(digest, breed, output_paths):
+    """
+    Put cached frames at output_paths ({stage: path}) if every stage is cached.
+    Returns True on a full hit, False otherwise (nothing usable is left behind).
+    """
+    if not GENERATION_CACHE_ENABLED or not digest:
+        return False
+    try:
+        entries = database.get_generation_cache_entries(digest, _breed_key(breed), GENERATION_CACHE_TTL)
+        if not all(stage in entries for stage in output_paths):
+            return False
+        for stage, output_path in output_paths.items():
+            link_or_copy(entries[stage], output_path)
+        database.touch_generation_cache_entries(digest, _breed_key(breed))
+        print(f"Generation cache: Hit for {digest[:12]} ({breed})")
+        return True
+    except Exception as e:
+        # e.g. a cached file was evicted between the lookup and the link
+        print(f"Generation cache: Could not restore {digest[:12]} ({breed}): {e}")
+        return False
+
+def store(digest, breed, frame_paths):
+    """Cache the generated frames ({stage: path}) of an image digest and breed, then evict"""
+    if not GENERATION_CACHE_ENABLED or not digest:
+        return
+    try:
+        os.makedirs(GENERATION_CACHE_DIR, exist_ok=True)
+        breed_slug = re.sub(r'[^a-z0-9]+', '-', _breed_key(breed)).strip('-') or 'unknown'
+        for stage, path in frame_paths.items():
+            cache_path = os.path.join(GENERATION_CACHE_DIR, f"{digest}_{breed_slug}_{stage}{os.path.splitext(path)[1]}")
+            link_or_copy(path, cache_path)
+            database.save_generation_cache_entry(digest, _breed_key(breed), stage, cache_path, os.path.getsize(cache_path))
+        evict()
+    except Exception as e:
+        print(f"Generation cache: Could not store {digest[:12]} ({breed}): {e}")
+
+def evict():
+    """Delete expired and least recently used frames beyond the size limit"""
+    removed = database.evict_generation_cache(GENERATION_CACHE_TTL, GENERATION_CACHE_MAX_BYTES)
+    for path in removed:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    if removed:
+        print(f"Generation cache: Evicted {len(removed)} frame(s)")
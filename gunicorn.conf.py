@@ -0,0 +1,12 @@
+"""
+Gunicorn settings, loaded from the working directory (see render.yaml).
+
+The generation job workers (see job_queue) are started in each web process
+once it has loaded the app, rather than as a side effect of importing app.
+"""
+import job_queue
+
+def post_worker_init(worker):
+    """Start this worker process's generation job workers"""
+    from app import process_image_generation
+    job_queue.start_workers(process_image_generation)
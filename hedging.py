@@ -0,0 +1,150 @@
+"""
+Hedged execution of alternative generation methods.
+
+A frame can be produced by several methods in order of preference (e.g. a
+GPT-Image-1 edit, then prompt-based DALL-E 3 generation). Normally the next
+method only starts after the previous one has failed, so a slow failure
+stacks its full latency on top of the fallback. In hedged mode, if the
+current method has not finished within HEDGE_DELAY seconds, the next one is
+started in parallel and whichever succeeds first wins; the others are
+cancelled (async engine) or abandoned and their output discarded (threads).
+
+Each method writes to its own attempt file, and only the winner's file is
+renamed to the frame's output path, so a late loser can never overwrite it.
+"""
+import os
+import queue
+import asyncio
+import threading
+import retry
+
+HEDGE_ENABLED = os.environ.get('HEDGE_ENABLED', '0') == '1'
+# Seconds to wait for a method before starting the next one in parallel
+HEDGE_DELAY = float(os.environ.get('HEDGE_DELAY', 45))
+
+def attempt_path(output_path, index):
+    """Private output path for one method of a hedged frame"""
+    root, ext = os.path.splitext(output_path)
+    return f"{root}_attempt{index}{ext}"
+
+def _discard(path):
+    try:
+        if path and os.path.exists(path):
+            os.remove(path)
+    except OSError:
+        pass
+
+def run_hedged(methods, output_path, delay=None, label="Hedge", outcome=None):
+    """
+    Run methods (callables taking an output path, returning it or None) with hedging.
+    Returns output_path holding the first successful result, or None if all methods fail.
+    If outcome (a dict) is given, outcome['method'] is set to the index of the winning method.
+    """
+    delay = HEDGE_DELAY if delay is None else delay
+    results = queue.Queue()
+    lock = threading.Lock()
+    state = {'winner': None}
+    pending = set()
+
+    def run_method(index):
+        try:
+            result = methods[index](attempt_path(output_path, index))
+        except Exception as e:
+            print(f"[{label}] Method {index + 1} raised: {e}")
+            result = None
+        with lock:
+            if state['winner'] is not None:
+                # Lost the race after the winner was chosen
+                _discard(result)
+                return
+            results.put((index, result))
+
+    def start(index):
+        print(f"[{label}] Starting method {index + 1} of {len(methods)}")
+        pending.add(index)
+        threading.Thread(
+            target=retry.run_in_context(run_method), args=(index,), name=f"hedge-{label}-{index}", daemon=True
+        ).start()
+
+    started = 1
+    start(0)
+    while pending:
+        try:
+            index, result = results.get(timeout=delay if started < len(methods) else None)
+        except queue.Empty:
+            print(f"[{label}] No result after {delay:g}s, hedging with the next method")
+            start(started)
+            started += 1
+            continue
+
+        pending.discard(index)
+        if result:
+            with lock:
+                state['winner'] = index
+                # Results that arrived while this one was being handled lost the race
+                while not results.empty():
+                    _discard(results.get_nowait()[1])
+            os.replace(result, output_path)
+            if outcome is not None:
+                outcome['method'] = index
+            if pending:
+                print(f"[{label}] Method {index + 1} won, abandoning {len(pending)} slower method(s)")
+            return output_path
+
+        if not pending and started < len(methods):
+            # Failed with nothing else in flight: fall back immediately
+            start(started)
+            started += 1
+
+    return None
+
+async def run_hedged_async(methods, output_path, delay=None, label="Hedge", outcome=None):
+    """
+    Coroutine version of run_hedged: methods are coroutine functions taking an output path.
+    Losing methods are cancelled.
+    """
+    delay = HEDGE_DELAY if delay is None else delay
+    tasks = {}
+
+    def start(index):
+        print(f"[{label}] Starting method {index + 1} of {len(methods)}")
+        task = asyncio.ensure_future(methods[index](attempt_path(output_path, index)))
+        tasks[task] = index
+
+    started = 1
+    start(0)
+    try:
+        while tasks:
+            timeout = delay if started < len(methods) else None
+            done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                print(f"[{label}] No result after {delay:g}s, hedging with the next method")
+                start(started)
+                started += 1
+                continue
+
+            for task in done:
+                index = tasks.pop(task)
+                result = None if task.exception() else task.result()
+                if task.exception():
+                    print(f"[{label}] Method {index + 1} raised: {task.exception()}")
+                if result:
+                    await asyncio.to_thread(os.replace, result, output_path)
+                    if outcome is not None:
+                        outcome['method'] = index
+                    if tasks:
+                        print(f"[{label}] Method {index + 1} won, cancelling {len(tasks)} slower method(s)")
+                    return output_path
+
+            if not tasks and started < len(methods):
+                start(started)
+                started += 1
+        return None
+    finally:
+        losers = list(tasks.items())
+        for task, _ in losers:
+            task.cancel()
+        if losers:
+            await asyncio.gather(*(task for task, _ in losers), return_exceptions=True)
+            for _, index in losers:
+                _discard(attempt_path(output_path, index))
@@ -2,10 +2,11 @@ import os
 import openai
 import replicate
 import threading
-from PIL import Image, ImageDraw, ImageFilter
 import time
 import urllib.request
 import base64
+import face_blend
+import image_pool
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -186,62 +187,12 @@ def generate_dog_image(breed, user_image_path, output_path):
 
 def blend_faces_manually(source_image_path, target_image_path, output_path, blend_factor=0.5):
     """
-    Manually blend the dog face into the human image using PIL.
+    Manually blend the dog face into the human image (see face_blend).
     blend_factor: 0.0 = all human, 1.0 = all dog, 0.5 = 50/50
     """
     try:
-        from PIL import Image, ImageFilter, ImageDraw
-        
-        # Open both images
-        human_img = Image.open(target_image_path).convert('RGBA')
-        dog_img = Image.open(source_image_path).convert('RGBA')
-        
-        # Resize dog image to match human image
-        dog_img = dog_img.resize(human_img.size, Image.Resampling.LANCZOS)
-        
-        # Estimate face region (upper center portion)
-        width, height = human_img.size
-        face_width = int(width * 0.6)
-        face_height = int(height * 0.4)
-        face_x = (width - face_width) // 2
-        face_y = int(height * 0.1)
-        
-        # Create a mask for the face region with feathered edges
-        mask = Image.new('L', human_img.size, 0)
-        draw = ImageDraw.Draw(mask)
-        padding = int(min(face_width, face_height) * 0.1)
-        draw.ellipse(
-            [face_x - padding, face_y - padding, face_x + face_width + padding, face_y + face_height + padding],
-            fill=255
-        )
-        mask = mask.filter(ImageFilter.GaussianBlur(radius=15))
-        
-        # Blend only the face region
-        # Create a copy of human image
-        result = human_img.copy()
-        
-        # Extract face regions
-        human_face = human_img.crop((face_x, face_y, face_x + face_width, face_y + face_height))
-        dog_face = dog_img.crop((face_x, face_y, face_x + face_width, face_y + face_height))
-        
-        # Blend the faces
-        blended_face = Image.blend(human_face, dog_face, blend_factor)
-        
-        # Create temp image with blended face
-        temp_img = Image.new('RGBA', human_img.size, (0, 0, 0, 0))
-        temp_img.paste(blended_face, (face_x, face_y))
-        
-        # Composite using the mask
-        result = Image.composite(temp_img, result, mask)
-        
-        # Save
-        if output_path.endswith('.png'):
-            result = result.convert('RGBA')
-            result.save(output_path, 'PNG')
-        else:
-            result = result.convert('RGB')
-            result.save(output_path, 'JPEG', quality=95)
-        
+        # In the image pool, so the pixel work does not hold this process's GIL
+        image_pool.run(face_blend.blend_to_files, source_image_path, target_image_path, [(blend_factor, output_path)])
         print(f"Blended face saved to: {output_path}")
         return output_path
         
@@ -251,6 +202,22 @@ def blend_faces_manually(source_image_path, target_image_path, output_path, blen
         traceback.print_exc()
         return None
 
+def blend_faces_at_levels(source_image_path, target_image_path, outputs):
+    """
+    Blend the dog face into the human image at several levels in one pass.
+    outputs: list of (blend_factor, output_path). Returns the saved paths, or None on error.
+    """
+    try:
+        paths = image_pool.run(face_blend.blend_to_files, source_image_path, target_image_path, outputs)
+        print(f"Blended faces saved to: {', '.join(paths)}")
+        return paths
+        
+    except Exception as e:
+        print(f"Error blending faces: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
 def swap_face_using_replicate(source_image_path, target_image_path, output_path):
     """
     Use Replicate's face swap model to swap the dog face into the human image.
@@ -339,20 +306,6 @@ def generate_transformation_images(image_path, breed, user_id, timestamp):
     results = {}
     errors = {}
     
-    def generate_trans1():
-        try:
-            results['trans1'] = generate_transition1(image_path, breed, dog_path, trans1_path)
-        except Exception as e:
-            errors['trans1'] = str(e)
-            print(f"Error in transition 1: {e}")
-    
-    def generate_trans2():
-        try:
-            results['trans2'] = generate_transition2(image_path, breed, dog_path, trans2_path)
-        except Exception as e:
-            errors['trans2'] = str(e)
-            print(f"Error in transition 2: {e}")
-    
     def generate_final_img():
         try:
             results['final'] = generate_final(image_path, breed, dog_path, final_path)
@@ -360,12 +313,14 @@ def generate_transformation_images(image_path, breed, user_id, timestamp):
             errors['final'] = str(e)
             print(f"Error in final image: {e}")
     
-    # Generate composited images sequentially (faster than threading for image processing)
-    print("Generating transition 1 (30% dog)...")
-    generate_trans1()
-    
-    print("Generating transition 2 (70% dog)...")
-    generate_trans2()
+    # Both transitions come from one blending pass (the images and mask are prepared once)
+    print("Generating transitions 1 and 2 (30% and 70% dog)...")
+    blended = blend_faces_at_levels(dog_path, image_path, [(0.3, trans1_path), (0.7, trans2_path)])
+    if blended:
+        results['trans1'], results['trans2'] = blended
+    else:
+        results['trans1'] = results['trans2'] = None
+        errors['trans1'] = errors['trans2'] = "Blending failed"
     
     print("Generating final image (95% dog)...")
     generate_final_img()
@@ -0,0 +1,103 @@
+"""
+Writing generated images to disk.
+
+Image calls request inline base64 results (b64_json), which are decoded in
+chunks straight into a temporary file and renamed into place, so there is no
+second network round trip and no reader ever sees a half-written frame. When
+an API returns a URL instead, it is fetched through a pooled HTTP client with
+connect/read timeouts, so a stalled download cannot hang a worker thread.
+"""
+import os
+import base64
+import threading
+import httpx
+
+# Timeouts for fetching a result image by URL (seconds)
+IMAGE_DOWNLOAD_TIMEOUT = float(os.environ.get('IMAGE_DOWNLOAD_TIMEOUT', 60))
+IMAGE_DOWNLOAD_CONNECT_TIMEOUT = float(os.environ.get('IMAGE_DOWNLOAD_CONNECT_TIMEOUT', 10))
+
+# Base64 characters decoded per chunk (a multiple of 4 so chunks decode independently)
+DECODE_CHUNK_SIZE = 4 * 64 * 1024
+
+_http_client = None
+_http_client_pid = None
+_http_client_lock = threading.Lock()
+
+def _get_http_client():
+    """Shared download client for this process (keep-alive connections are reused)"""
+    global _http_client, _http_client_pid
+    with _http_client_lock:
+        if _http_client is None or _http_client_pid != os.getpid():
+            _http_client = httpx.Client(
+                timeout=httpx.Timeout(IMAGE_DOWNLOAD_TIMEOUT, connect=IMAGE_DOWNLOAD_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+                follow_redirects=True
+            )
+            _http_client_pid = os.getpid()
+        return _http_client
+
+def temp_path(output_path):
+    """Temporary path next to output_path, unique to this process and thread, to write and rename into place"""
+    return f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+def _discard(tmp_path):
+    try:
+        os.remove(tmp_path)
+    except OSError:
+        pass
+
+def write_base64(b64_data, output_path):
+    """Decode a base64 image into output_path via a temporary file and an atomic rename"""
+    tmp_path = temp_path(output_path)
+    try:
+        with open(tmp_path, 'wb') as f:
+            for start in range(0, len(b64_data), DECODE_CHUNK_SIZE):
+                f.write(base64.b64decode(b64_data[start:start + DECODE_CHUNK_SIZE]))
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        _discard(tmp_path)
+        raise
+    return output_path
+
+def download(url, output_path):
+    """Stream an image URL into output_path via a temporary file and an atomic rename"""
+    tmp_path = temp_path(output_path)
+    try:
+        with _get_http_client().stream('GET', url) as response:
+            response.raise_for_status()
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_bytes():
+                    f.write(chunk)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        _discard(tmp_path)
+        raise
+    return output_path
+
+def save_image_result(response, output_path, label="Image"):
+    """
+    Save the first image of an images.generate()/images.edit() response to output_path.
+    Prefers inline base64 data and only downloads when the response carries a URL.
+    Returns output_path, or None if the response has no image.
+    """
+    data = getattr(response, 'data', None)
+    if not data:
+        print(f"[{label}] ERROR: Response has no data or data is empty")
+        return None
+
+    first_item = data[0]
+    b64_data = getattr(first_item, 'b64_json', None)
+    if b64_data:
+        write_base64(b64_data, output_path)
+        print(f"[{label}] Image saved to: {output_path}")
+        return output_path
+
+    image_url = getattr(first_item, 'url', None)
+    if image_url:
+        print(f"[{label}] Got image URL, downloading...")
+        download(image_url, output_path)
+        print(f"[{label}] Image downloaded and saved to: {output_path}")
+        return output_path
+
+    print(f"[{label}] ERROR: Response item has neither b64_json nor url")
+    return None
@@ -0,0 +1,113 @@
+"""
+Shared process pool for CPU-bound image work.
+
+Pillow and NumPy work (decoding, resizing, blurring, blending, encoding)
+holds the GIL for much of its run, so on the threads of a gthread gunicorn
+worker it slows down request handling in the same process. Image transforms
+are run in one bounded pool of separate processes per web process instead,
+so they scale with cores and request threads only wait on a future.
+
+At most IMAGE_POOL_MAX_PENDING tasks may be queued or running; further
+callers block until a slot frees up. Tasks exchange file paths where they
+can. Pixel buffers that have to cross the process boundary go through
+shared memory (see shared_array) instead of being pickled.
+
+The pool is a spawn-context process pool (see process_pool).
+"""
+import os
+import threading
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import process_pool
+
+IMAGE_POOL_ENABLED = os.environ.get('IMAGE_POOL_ENABLED', '1') == '1'
+# Image processes per web process
+IMAGE_POOL_WORKERS = int(os.environ.get('IMAGE_POOL_WORKERS', 2))
+# Tasks allowed to be queued or running at once; further callers wait for a slot
+IMAGE_POOL_MAX_PENDING = int(os.environ.get('IMAGE_POOL_MAX_PENDING', 32))
+
+_slots = threading.BoundedSemaphore(IMAGE_POOL_MAX_PENDING)
+# Set in pool processes, so tasks that call run() themselves do not start a pool of their own
+_in_worker = False
+
+def _init_worker():
+    global _in_worker
+    _in_worker = True
+
+_pool = process_pool.SpawnPool(IMAGE_POOL_WORKERS, initializer=_init_worker)
+
+def in_worker():
+    """Whether this is one of the pool's processes (each runs one task at a time)"""
+    return _in_worker
+
+def enabled():
+    """Whether tasks go to the pool (False inside pool processes and when disabled)"""
+    return IMAGE_POOL_ENABLED and IMAGE_POOL_WORKERS > 0 and not _in_worker
+
+def submit(fn, *args):
+    """
+    Schedule fn(*args) in the pool (blocking while IMAGE_POOL_MAX_PENDING tasks are pending)
+    and return its future. fn and its arguments must be picklable.
+    """
+    _slots.acquire()
+    try:
+        future = _pool.get().submit(fn, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+def result(future, fn, *args):
+    """Result of a future from submit(fn, *args); if the pool broke, fn is run inline instead"""
+    try:
+        return future.result()
+    except BrokenProcessPool as e:
+        # An image process died (e.g. killed for memory); start a fresh pool next time
+        print(f"Image pool: Pool broken ({e}), running {fn.__name__} inline")
+        _pool.discard()
+        return fn(*args)
+
+def run(fn, *args):
+    """Run fn(*args) in the pool and return its result (inline when the pool is disabled)"""
+    if not enabled():
+        return fn(*args)
+    return result(submit(fn, *args), fn, *args)
+
+@contextmanager
+def shared_array(shape, dtype=np.uint8):
+    """
+    Allocate a zeroed NumPy array in shared memory for the duration of the block and
+    yield its handle. Pool tasks fill it with write_shared(handle, ...) and the caller
+    reads it back with read_shared(handle) before the block exits.
+    """
+    shape = tuple(int(n) for n in shape)
+    dtype = np.dtype(dtype)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+    try:
+        yield (shm.name, shape, dtype.str)
+    finally:
+        shm.close()
+        shm.unlink()
+
+def _open(handle):
+    name, shape, dtype = handle
+    return shared_memory.SharedMemory(name=name), shape, np.dtype(dtype)
+
+def write_shared(handle, values):
+    """Copy values into the shared array behind handle"""
+    shm, shape, dtype = _open(handle)
+    try:
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf)[...] = values
+    finally:
+        shm.close()
+
+def read_shared(handle):
+    """Copy of the shared array behind handle"""
+    shm, shape, dtype = _open(handle)
+    try:
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf).copy()
+    finally:
+        shm.close()
@@ -0,0 +1,101 @@
+"""
+Image preprocessing for API payloads.
+
+Uploads can be up to 10 MB, but GPT-4o and GPT-Image-1 work at ~1-1.5k pixels
+per side. Each source image is normalized once - EXIF orientation applied,
+first frame of animated images, downscaled, re-encoded as JPEG - and the
+derived file is stored next to the source. Every API call then sends the
+derived file, and its base64 string is kept in memory so repeated vision
+calls on the same image do not re-read and re-encode it.
+"""
+import os
+import base64
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageOps
+import image_pool
+import image_output
+
+IMAGE_PREP_ENABLED = os.environ.get('IMAGE_PREP_ENABLED', '1') == '1'
+# Longest side of the derived image in pixels
+IMAGE_PREP_MAX_SIDE = int(os.environ.get('IMAGE_PREP_MAX_SIDE', 1536))
+# JPEG quality of the derived image
+IMAGE_PREP_QUALITY = int(os.environ.get('IMAGE_PREP_QUALITY', 90))
+# Number of base64 strings kept in memory per process
+IMAGE_PREP_CACHE_ENTRIES = int(os.environ.get('IMAGE_PREP_CACHE_ENTRIES', 32))
+
+PREPARED_SUFFIX = '_prepared.jpg'
+
+_base64_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def prepared_path_for(image_path):
+    """Path of the derived file for a source image"""
+    return os.path.splitext(image_path)[0] + PREPARED_SUFFIX
+
+def _is_fresh(derived_path, image_path):
+    try:
+        return os.path.getmtime(derived_path) >= os.path.getmtime(image_path)
+    except OSError:
+        return False
+
+def _normalize(image_path, derived_path, max_side, quality):
+    """Write the normalized copy of image_path (runs in the image pool, so settings are passed in)"""
+    with Image.open(image_path) as img:
+        img.seek(0)  # First frame of animated GIFs
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ('RGBA', 'LA', 'P'):
+            # JPEG has no alpha channel, so flatten transparency onto white
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel('A'))
+            img = background
+        else:
+            img = img.convert('RGB')
+        img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+        # Write to a temporary file and rename so concurrent readers never see a partial image
+        tmp_path = image_output.temp_path(derived_path)
+        img.save(tmp_path, 'JPEG', quality=quality, optimize=True)
+        os.replace(tmp_path, derived_path)
+
+def prepare(image_path):
+    """
+    Return the path of the normalized, downscaled copy of image_path, creating it if needed.
+    Falls back to the original path if preprocessing is disabled or fails.
+    """
+    if not IMAGE_PREP_ENABLED or image_path.endswith(PREPARED_SUFFIX):
+        return image_path
+
+    derived_path = prepared_path_for(image_path)
+    if _is_fresh(derived_path, image_path):
+        return derived_path
+
+    try:
+        image_pool.run(_normalize, image_path, derived_path, IMAGE_PREP_MAX_SIDE, IMAGE_PREP_QUALITY)
+        original_size = os.path.getsize(image_path)
+        derived_size = os.path.getsize(derived_path)
+        print(f"Image prep: {image_path} ({original_size} bytes) -> {derived_path} ({derived_size} bytes)")
+        return derived_path
+    except Exception as e:
+        print(f"Image prep: Could not prepare {image_path}, sending original: {e}")
+        return image_path
+
+def get_base64(image_path):
+    """Return the base64 string of the prepared image, cached in memory"""
+    path = prepare(image_path)
+    key = (path, os.path.getmtime(path))
+
+    with _cache_lock:
+        if key in _base64_cache:
+            _base64_cache.move_to_end(key)
+            return _base64_cache[key]
+
+    with open(path, 'rb') as image_file:
+        image_base64 = base64.b64encode(image_file.read()).decode('utf-8')
+
+    with _cache_lock:
+        _base64_cache[key] = image_base64
+        while len(_base64_cache) > IMAGE_PREP_CACHE_ENTRIES:
+            _base64_cache.popitem(last=False)
+    return image_base64
@@ -0,0 +1,169 @@
+"""
+Durable job queue for background image generation.
+
+Jobs are stored in the SQLite `jobs` table so they survive gunicorn worker
+recycling. Each process runs a fixed-size pool of worker threads that claim
+jobs in FIFO order and hand them to a handler function.
+
+A handler may also start the job elsewhere and return a
+concurrent.futures.Future (the async generation engine does); the job is then
+acknowledged or failed when the future finishes and the worker goes straight
+back to the queue. JOB_MAX_IN_FLIGHT caps the jobs a process runs at once
+either way.
+
+A maintenance thread renews the lease of every job the process is running
+every JOB_HEARTBEAT_INTERVAL seconds and returns jobs whose lease has run
+out (their process died) to the queue. Workers are not started on import:
+the server entry point starts them (`python app.py`, or the gunicorn
+post_worker_init hook in gunicorn.conf.py).
+"""
+import os
+import time
+import atexit
+import socket
+import threading
+import traceback
+from concurrent.futures import Future, CancelledError
+import database
+import events
+
+# Number of generation workers per process (caps concurrent OpenAI fan-out per node)
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+# Jobs running at once per process, including those handed off by their handler as a future
+JOB_MAX_IN_FLIGHT = int(os.environ.get('JOB_MAX_IN_FLIGHT', 8))
+# How long an idle worker waits before checking the queue again
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 2.0))
+# A running job whose lease has not been renewed for this long is considered lost
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 120))
+# How often running jobs renew their lease and expired leases are looked for
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get('JOB_HEARTBEAT_INTERVAL', 30))
+# How many times a lost job is retried before it is marked failed
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 2))
+
+_wakeup = threading.Event()
+_in_flight = threading.BoundedSemaphore(JOB_MAX_IN_FLIGHT)
+_workers_lock = threading.Lock()
+_workers = []
+_workers_pid = None
+
+def enqueue(image_id, user_id, image_path, timestamp):
+    """Persist a generation job and wake up an idle worker"""
+    job_id = database.enqueue_job(image_id, user_id, image_path, timestamp)
+    print(f"Queue: Enqueued job {job_id} for image_id {image_id}")
+    _wakeup.set()
+    return job_id
+
+def _worker_ids():
+    return [worker.name for worker in _workers]
+
+def _release_claimed_jobs():
+    """Hand jobs held by this process back to the queue when it exits"""
+    if _workers_pid != os.getpid():
+        return
+    try:
+        released = database.release_jobs(_worker_ids())
+        if released:
+            print(f"Queue: Released {released} unfinished job(s) back to the queue")
+    except Exception as e:
+        print(f"Queue: Could not release jobs on shutdown: {e}")
+
+def _finish_job(job, error):
+    """Acknowledge or fail a job and free its in-flight slot"""
+    try:
+        if error is None:
+            database.complete_job(job['id'])
+            print(f"Queue: Job {job['id']} completed")
+        else:
+            print(f"Queue: Job {job['id']} failed: {error}")
+            traceback.print_exception(error)
+            database.fail_job(job['id'], str(error) or type(error).__name__)
+            # Wake up status streams now rather than on their next database recheck
+            events.publish(job['image_id'])
+    except Exception as e:
+        print(f"Queue: Could not record the outcome of job {job['id']}: {e}")
+    finally:
+        _in_flight.release()
+
+def _future_error(future):
+    try:
+        return future.exception()
+    except CancelledError as e:
+        return e
+
+def _run_job(job, handler):
+    print(f"Queue: {job['worker_id']} running job {job['id']} (attempt {job['attempts']})")
+    try:
+        result = handler(job)
+    except Exception as e:
+        _finish_job(job, e)
+        return
+    if isinstance(result, Future):
+        # Runs elsewhere; finished from whichever thread completes the future
+        result.add_done_callback(lambda future: _finish_job(job, _future_error(future)))
+    else:
+        _finish_job(job, None)
+
+def _worker_loop(handler):
+    worker_id = threading.current_thread().name
+    while True:
+        # Only claim a job once this process has room to run it
+        _in_flight.acquire()
+        try:
+            job = database.claim_next_job(worker_id)
+        except Exception as e:
+            print(f"Queue: {worker_id} could not claim a job: {e}")
+            job = None
+
+        if not job:
+            _in_flight.release()
+            # Sleep until a new job is enqueued in this process, or poll again
+            # to pick up jobs enqueued by other gunicorn workers
+            _wakeup.wait(JOB_POLL_INTERVAL)
+            _wakeup.clear()
+            continue
+
+        _run_job(job, handler)
+
+def _maintenance_loop():
+    while True:
+        try:
+            # Heartbeat for jobs still running here, whether on a worker or handed off
+            database.renew_job_leases(_worker_ids())
+            requeued = database.requeue_stale_jobs(JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS)
+            if requeued:
+                print(f"Queue: Recovered {requeued} job(s) with an expired lease")
+        except Exception as e:
+            print(f"Queue: Lease maintenance failed: {e}")
+        time.sleep(JOB_HEARTBEAT_INTERVAL)
+
+def start_workers(handler, num_workers=None):
+    """
+    Start the worker pool for this process (idempotent).
+    handler is called with the claimed job dict; raising marks the job failed. It may
+    instead return a concurrent.futures.Future, which finishes the job when it is done.
+    """
+    global _workers, _workers_pid
+    num_workers = num_workers or JOB_WORKERS
+
+    with _workers_lock:
+        # Threads do not survive fork, so a new process always gets a new pool
+        if _workers_pid == os.getpid() and _workers:
+            return _workers
+
+        _workers = []
+        _workers_pid = os.getpid()
+        host = socket.gethostname()
+        for n in range(num_workers):
+            worker = threading.Thread(
+                target=_worker_loop,
+                args=(handler,),
+                name=f"{host}:{_workers_pid}:worker-{n}",
+                daemon=True
+            )
+            worker.start()
+            _workers.append(worker)
+        threading.Thread(target=_maintenance_loop, name=f"{host}:{_workers_pid}:maintenance", daemon=True).start()
+
+        atexit.register(_release_claimed_jobs)
+        print(f"Queue: Started {num_workers} generation worker(s) in process {_workers_pid}")
+        return _workers
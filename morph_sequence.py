@@ -0,0 +1,193 @@
+"""
+Animated human -> dog morph of a finished image set.
+
+Once all frames of a set exist (before it is marked complete), the original,
+transition, final and full dog frames are used as keyframes and MORPH_FRAMES
+frames are interpolated between them (an eased cross-dissolve per segment)
+and encoded as an animated GIF or WebP.
+Frames are rendered in batches of MORPH_BATCH_SIZE in the shared image pool
+(see image_pool), each batch written straight into a shared memory buffer,
+and are handed to the encoder as batches arrive; at most a few batches are
+in flight at a time. GIF frames are written to the file one by one as they
+arrive; Pillow's WebP encoder needs every frame up front, so 'webp' holds
+the whole animation in memory while it is encoded.
+
+The animation is cached per image set: it is written next to the set's
+frames and reused as long as it is newer than all of them.
+"""
+import os
+import contextlib
+from collections import deque
+import numpy as np
+from PIL import Image, ImageOps, GifImagePlugin
+import image_prep
+import image_pool
+import image_output
+
+MORPH_ENABLED = os.environ.get('MORPH_ENABLED', '1') == '1'
+# Frames in the whole animation (keyframes included)
+MORPH_FRAMES = int(os.environ.get('MORPH_FRAMES', 36))
+# 'gif' (written frame by frame) or 'webp' (smaller, but buffers every frame while encoding)
+MORPH_FORMAT = os.environ.get('MORPH_FORMAT', 'gif')
+# Milliseconds each frame is shown
+MORPH_FRAME_DURATION = int(os.environ.get('MORPH_FRAME_DURATION', 80))
+# Longest side of the animation in pixels
+MORPH_MAX_SIDE = int(os.environ.get('MORPH_MAX_SIDE', 512))
+MORPH_BATCH_SIZE = int(os.environ.get('MORPH_BATCH_SIZE', 6))
+
+# Keyframes decoded by this pool process, reused across the batches of one animation.
+# Only used in pool processes, which run one task at a time; job threads never share it
+_keyframes = (None, None)
+
+def animation_size(frame_path):
+    """Size of the animation: the final frame's aspect ratio, scaled down to MORPH_MAX_SIDE"""
+    with Image.open(frame_path) as img:
+        width, height = img.size
+    scale = min(1.0, MORPH_MAX_SIDE / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def decode_keyframes(keyframe_paths, size):
+    """Keyframes as one float32 array (keyframes, height, width, 3), each cropped and scaled to size"""
+    frames = []
+    for path in keyframe_paths:
+        with Image.open(path) as img:
+            frames.append(np.asarray(ImageOps.fit(img.convert('RGB'), size, Image.Resampling.LANCZOS)))
+    return np.stack(frames).astype(np.float32)
+
+def load_keyframes(keyframe_paths, size):
+    """decode_keyframes, cached between batches in pool processes (decoded afresh anywhere else)"""
+    global _keyframes
+    if not image_pool.in_worker():
+        return decode_keyframes(keyframe_paths, size)
+    key = (tuple(keyframe_paths), tuple(size))
+    if _keyframes[0] != key:
+        _keyframes = (key, decode_keyframes(keyframe_paths, size))
+    return _keyframes[1]
+
+def positions(frame_count, keyframe_count):
+    """Position of every frame along the keyframes (0.0 = first keyframe, keyframe_count - 1 = last)"""
+    return np.linspace(0, keyframe_count - 1, max(frame_count, keyframe_count), dtype=np.float32)
+
+def render_batch(keyframes, batch_positions):
+    """Render the frames at batch_positions from decoded keyframes as a uint8 array (frames, height, width, 3)"""
+    batch_positions = np.asarray(batch_positions, dtype=np.float32)
+    segment = np.minimum(batch_positions.astype(np.int64), len(keyframes) - 2)
+    t = batch_positions - segment
+    # Smoothstep, so each keyframe is held briefly instead of passed through at full speed
+    t = (t * t * (3 - 2 * t)).reshape(-1, 1, 1, 1)
+    start = keyframes[segment]
+    frames = start + t * (keyframes[segment + 1] - start)
+    return np.clip(frames + 0.5, 0, 255).astype(np.uint8)
+
+def render_batch_shared(keyframe_paths, size, batch_positions, handle):
+    """Pool task: render a batch into the shared array behind handle instead of returning it"""
+    image_pool.write_shared(handle, render_batch(load_keyframes(keyframe_paths, size), batch_positions))
+
+def _rendered_frames(keyframe_paths, size, frame_positions):
+    """Yield the animation's frames in order, rendering batches ahead in the image pool"""
+    batches = [frame_positions[i:i + MORPH_BATCH_SIZE] for i in range(0, len(frame_positions), MORPH_BATCH_SIZE)]
+    if not image_pool.enabled():
+        # Decoded once for the whole animation, by the thread rendering it
+        keyframes = decode_keyframes(keyframe_paths, size)
+        for batch in batches:
+            yield from (Image.fromarray(frame) for frame in render_batch(keyframes, batch))
+        return
+
+    width, height = size
+    in_flight = max(2, image_pool.IMAGE_POOL_WORKERS * 2)
+    pending = deque()
+    try:
+        for batch in batches:
+            pending.append(_submit_batch(keyframe_paths, size, batch, (len(batch), height, width, 3)))
+            if len(pending) >= in_flight:
+                yield from _collect(pending.popleft())
+        while pending:
+            yield from _collect(pending.popleft())
+    finally:
+        for future, _, buffer in pending:
+            future.cancel()
+            buffer.close()
+
+def _submit_batch(keyframe_paths, size, batch, shape):
+    """Start rendering a batch into a new shared buffer; returns (future, args, buffer)"""
+    buffer = contextlib.ExitStack()
+    handle = buffer.enter_context(image_pool.shared_array(shape))
+    args = (keyframe_paths, size, batch, handle)
+    try:
+        return image_pool.submit(render_batch_shared, *args), args, buffer
+    except BaseException:
+        buffer.close()
+        raise
+
+def _collect(batch):
+    """Frames of a submitted batch, copied out of its shared buffer, which is then released"""
+    future, args, buffer = batch
+    try:
+        image_pool.result(future, render_batch_shared, *args)
+        return [Image.fromarray(frame) for frame in image_pool.read_shared(args[-1])]
+    finally:
+        buffer.close()
+
+def write_gif(frames, fp):
+    """Write frames (an iterator of images) to fp as a looping GIF, one frame at a time"""
+    for index, frame in enumerate(frames):
+        # Each frame gets its own palette, as Pillow's own GIF writer does
+        frame = frame.convert('P', palette=Image.Palette.ADAPTIVE)
+        if index == 0:
+            header, _ = GifImagePlugin.getheader(frame, info={'loop': 0})
+            fp.write(b''.join(header))
+        fp.write(b''.join(GifImagePlugin.getdata(frame, duration=MORPH_FRAME_DURATION, include_color_table=True)))
+    fp.write(b';')
+
+def encode(frames, output_path):
+    """Encode frames (an iterator of images) as an animated GIF or WebP via a temporary file"""
+    tmp_path = image_output.temp_path(output_path)
+    try:
+        if MORPH_FORMAT == 'gif':
+            with open(tmp_path, 'wb') as fp:
+                write_gif(frames, fp)
+        else:
+            first = next(frames)
+            first.save(tmp_path, 'WEBP', save_all=True, append_images=frames,
+                       duration=MORPH_FRAME_DURATION, loop=0, quality=80, method=4)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return output_path
+
+def morph_path_for(base_path):
+    """Animation path of the image set whose frames start with base_path"""
+    extension = 'gif' if MORPH_FORMAT == 'gif' else 'webp'
+    return f"{base_path}_morph.{extension}"
+
+def _is_fresh(output_path, keyframe_paths):
+    try:
+        built = os.path.getmtime(output_path)
+        return all(os.path.getmtime(path) <= built for path in keyframe_paths)
+    except OSError:
+        return False
+
+def create(original_path, trans1_path, final_path, full_dog_path, output_path):
+    """
+    Render the morph animation of an image set to output_path (reused if it is
+    already up to date). Returns output_path, or None if disabled or rendering failed.
+    """
+    if not MORPH_ENABLED:
+        return None
+    try:
+        keyframe_paths = [image_prep.prepare(original_path), trans1_path, final_path, full_dog_path]
+        if _is_fresh(output_path, keyframe_paths):
+            print(f"Morph: Reusing {output_path}")
+            return output_path
+        size = animation_size(final_path)
+        frame_positions = positions(MORPH_FRAMES, len(keyframe_paths)).tolist()
+        encode(_rendered_frames(keyframe_paths, size, frame_positions), output_path)
+        print(f"Morph: Rendered {len(frame_positions)} frames to {output_path}")
+        return output_path
+    except Exception as e:
+        print(f"Morph: Could not render {output_path}: {e}")
+        return None
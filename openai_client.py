@@ -0,0 +1,114 @@
+"""
+Process-wide OpenAI client.
+
+Every generator thread shares one client, and with it one HTTP connection
+pool, so the 6-10 API calls of a job reuse warm keep-alive connections
+instead of opening a new pool (and TLS handshake) per call. The async engine
+gets the same treatment through get_async_client().
+
+Both clients pass every outgoing request through the shared rate limiter.
+"""
+import os
+import asyncio
+import threading
+import httpx
+import openai
+import rate_limiter
+
+# Connection pool sizing (shared by all threads in the process)
+OPENAI_MAX_CONNECTIONS = int(os.environ.get('OPENAI_MAX_CONNECTIONS', 20))
+OPENAI_MAX_KEEPALIVE = int(os.environ.get('OPENAI_MAX_KEEPALIVE', 10))
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get('OPENAI_KEEPALIVE_EXPIRY', 60))
+
+# Per-call timeouts in seconds
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get('OPENAI_CONNECT_TIMEOUT', 10))
+OPENAI_CHAT_TIMEOUT = float(os.environ.get('OPENAI_CHAT_TIMEOUT', 60))
+OPENAI_IMAGE_TIMEOUT = float(os.environ.get('OPENAI_IMAGE_TIMEOUT', 120))
+
+_TIMEOUTS = {
+    'chat': OPENAI_CHAT_TIMEOUT,
+    'image': OPENAI_IMAGE_TIMEOUT,
+}
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+_async_clients = {}
+
+def _timeout(kind):
+    return httpx.Timeout(_TIMEOUTS[kind], connect=OPENAI_CONNECT_TIMEOUT)
+
+def _limits():
+    return httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+        keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+    )
+
+def _limit_request(request):
+    """httpx request hook: wait for a rate limit token for this endpoint"""
+    rate_limiter.acquire(rate_limiter.bucket_for(request.url.path))
+
+async def _limit_request_async(request):
+    await rate_limiter.acquire_async(rate_limiter.bucket_for(request.url.path))
+
+def _create_client():
+    http_client = openai.DefaultHttpxClient(
+        limits=_limits(),
+        timeout=_timeout('chat'),
+        event_hooks={'request': [_limit_request]}
+    )
+    print(f"OpenAI client created (max connections: {OPENAI_MAX_CONNECTIONS}, keep-alive: {OPENAI_MAX_KEEPALIVE})")
+    return openai.OpenAI(
+        api_key=os.environ.get('OPENAI_API_KEY'),
+        http_client=http_client,
+        timeout=_timeout('chat'),
+        max_retries=0  # Retries are handled by retry.py
+    )
+
+def get_client(kind=None):
+    """
+    Return the shared OpenAI client.
+    kind: 'chat' or 'image' - applies that call type's timeout to the returned client.
+    """
+    global _client, _client_pid
+    with _client_lock:
+        # Connection pools must not be shared across fork, so each process gets its own
+        if _client is None or _client_pid != os.getpid():
+            _client = _create_client()
+            _client_pid = os.getpid()
+        client = _client
+
+    if kind:
+        # with_options returns a lightweight copy that reuses the same connection pool
+        return client.with_options(timeout=_timeout(kind))
+    return client
+
+def get_async_client(kind=None):
+    """
+    Return the shared AsyncOpenAI client for the running event loop.
+    An async connection pool is bound to the loop it was created on, so there is
+    one client per loop (the async engine runs a single loop per process).
+    """
+    loop = asyncio.get_running_loop()
+    key = (os.getpid(), id(loop))
+    client = _async_clients.get(key)
+    if client is None:
+        http_client = openai.DefaultAsyncHttpxClient(
+            limits=_limits(),
+            timeout=_timeout('chat'),
+            event_hooks={'request': [_limit_request_async]}
+        )
+        client = openai.AsyncOpenAI(
+            api_key=os.environ.get('OPENAI_API_KEY'),
+            http_client=http_client,
+            timeout=_timeout('chat'),
+            max_retries=0
+        )
+        _async_clients[key] = client
+        print(f"Async OpenAI client created (max connections: {OPENAI_MAX_CONNECTIONS}, keep-alive: {OPENAI_MAX_KEEPALIVE})")
+
+    if kind:
+        return client.with_options(timeout=_timeout(kind))
+    return client
@@ -1,10 +1,17 @@
 import os
-import openai
+import json
 import threading
-import urllib.request
-import base64
-from PIL import Image, ImageDraw, ImageFilter
 from dotenv import load_dotenv
+import openai_client
+import breed_cache
+import image_prep
+import image_output
+import hedging
+import circuit_breaker
+import retry
+import dog_head_library
+import face_blend
+import image_pool
 
 # Load environment variables from .env file
 load_dotenv()
@@ -16,13 +23,41 @@ if OPENAI_API_KEY:
 else:
     print("WARNING: OPENAI_API_KEY not found in environment!")
 
+# Image editing models, tried in order
+EDIT_MODELS = ["gpt-image-1", "gpt-image-1-mini"]
+
+# API limit for each image sent to images.edit()
+MAX_EDIT_IMAGE_SIZE = 50 * 1024 * 1024  # 50MB in bytes
+
+# Blend transition 1 on the CPU from the upload and the final frame instead of an API edit
+LOCAL_TRANSITIONS = os.environ.get('LOCAL_TRANSITIONS', '0') == '1'
+
+DEFAULT_BREED = "Golden Retriever"
+
+DEFAULT_USER_CONTEXT = "professional portrait, front-facing, neutral expression"
+
+# Used when GPT-4 refuses to describe the image
+DEFAULT_IMAGE_DESCRIPTION = """Subject:
+- Person, front-facing portrait
+- Neutral expression
+
+Body:
+- Professional clothing
+- Standing straight
+
+Lighting:
+- Soft studio lighting
+
+Background:
+- Clean background
+
+Camera:
+- Front-facing"""
+
 def image_to_base64(image_path):
-    """Convert image file to base64 encoded string"""
+    """Convert image file to base64 encoded string (of its normalized, downscaled copy, cached)"""
     try:
-        with open(image_path, 'rb') as image_file:
-            image_data = image_file.read()
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
-            return image_base64
+        return image_prep.get_base64(image_path)
     except Exception as e:
         print(f"Error converting image to base64: {e}")
         return None
@@ -30,78 +65,469 @@ def image_to_base64(image_path):
 def download_image(url, save_path):
     """Download image from URL and save locally"""
     try:
-        urllib.request.urlretrieve(url, save_path)
+        image_output.download(url, save_path)
         print(f"Image downloaded and saved to: {save_path}")
         return save_path
     except Exception as e:
         print(f"Error downloading image: {e}")
         return None
 
-def analyze_dog_breed(image_path):
+def get_mime_type(image_path):
+    """Guess the MIME type to send along with image_to_base64(image_path)"""
+    ext = os.path.splitext(image_prep.prepare(image_path))[1].lower()
+    return "image/jpeg" if ext in ['.jpg', '.jpeg'] else "image/png" if ext == '.png' else "image/jpeg"
+
+def is_refusal(text, words=("sorry", "can't", "cannot")):
+    """Check whether a GPT-4 answer is a refusal instead of the requested content"""
+    text = text.lower()
+    return any(word in text for word in words)
+
+# Prompt builders - shared by the threaded pipeline in this module and the
+# asyncio pipeline in async_generator so both engines send identical requests
+
+def build_edit_prompt(breed, transformation_level):
+    """GPT-Image-1 edit prompt for a transformation level (0.3, 0.7 or 1.0)"""
+    if transformation_level == 0.3:
+        return f"Take the dog head from the second image and use it to replace the human head in the first image, showing subtle transformation (about 30%). The face structure remains mostly human but starting to show canine characteristics from the dog head - slight furry texture appearing on skin around face, ears just beginning to shift toward {breed} dog ears, eyes showing hints of canine characteristics while remaining mostly human-shaped. Keep everything else from the first image exactly the same (body, clothing, pose, background, lighting). Match the dog's expression from the second image to the human's original expression from the first image."
+    elif transformation_level == 0.7:
+        return f"Take the dog head from the second image and use it to replace the human head in the first image, showing significant transformation (about 70%). The dog head from the second image should be prominently featured with fully formed {breed} ears, significant fur coverage, developing snout, and canine eye structure. The dog's expression from the second image should match the human's original expression from the first image. Keep everything else from the first image exactly the same (body, clothing, pose, background, lighting). Make the transition from dog head to human neck look natural and anatomically correct."
+    else:  # 1.0
+        return f"Take the {breed} dog head from the second image and use it to completely replace the human head in the first image. The dog head should be fully formed, expressive, and intelligent-looking with detailed {breed} characteristics as shown in the second image. The dog's expression from the second image should match the human's original expression from the first image. Keep everything else from the first image exactly the same (body, clothing, pose, background, lighting). Make the transition from dog head to human neck look completely natural and anatomically correct. Match the lighting on the dog head to the lighting in the first image."
+
+def build_dog_head_context_messages(image_base64, mime_type):
+    """Chat messages asking GPT-4o to describe the portrait style the dog head should match"""
+    return [
+        {
+            "role": "system",
+            "content": "You are a helpful assistant that describes portrait photos for creative image generation."
+        },
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": "Describe this portrait in 2-3 short phrases focusing on: lighting (bright, soft, dramatic), angle (front-facing, side, etc.), expression (serious, smiling, neutral), and overall mood. Keep it brief."
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{mime_type};base64,{image_base64}"
+                    }
+                }
+            ]
+        }
+    ]
+
+def build_dog_head_prompt(breed, user_context):
+    """DALL-E 3 prompt for the dog head portrait"""
+    return f"""A photorealistic close-up portrait of a {breed} dog's head and upper neck, looking directly at the camera. The dog should have an expressive, intelligent look. Match the style: {user_context}. Professional pet photography, studio lighting, high quality, detailed fur texture, clear background, headshot composition."""
+
+def describe_transformation_level(transformation_level):
+    """Plain-language description of a transformation level (0.3, 0.7 or 1.0)"""
+    if transformation_level == 0.3:
+        return "Beginning to show subtle dog features (about 30% transformation). Face structure remains mostly human but starting to show canine characteristics. Slight furry texture appearing on skin around face. Ears just beginning to shift toward dog ears. Eyes showing hints of canine characteristics while remaining mostly human-shaped."
+    elif transformation_level == 0.7:
+        return "Significant transformation (about 70%). Dog head prominently featured with fully formed dog ears. Significant fur coverage, developing snout. Canine eye structure and expression."
+    else:  # 1.0
+        return "Complete transformation (100%). Fully formed dog head replacing the human head."
+
+def build_composite_messages(breed, transformation_level, human_base64, mime_human, dog_base64, mime_dog):
+    """Chat messages asking GPT-4o to write a DALL-E 3 prompt that combines both images"""
+    trans_desc = describe_transformation_level(transformation_level)
+
+    return [
+        {
+            "role": "system",
+            "content": "You are a helpful assistant that analyzes images and creates detailed prompts for image generation. You will see two images: a human portrait and a dog head. Your task is to create a detailed prompt that tells an image generator how to place the dog head on the human body while keeping everything else exactly the same."
+        },
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": f"""I have two images:
+- Image 1: A human portrait photo
+- Image 2: A {breed} dog head portrait
+
+I want to create a new image where the dog head from Image 2 replaces the human head in Image 1, but everything else (body, clothing, pose, background, lighting) stays exactly the same from Image 1.
+
+Transformation level: {trans_desc}
+
+Please create a detailed, specific prompt for an image generator (DALL-E 3) that will:
+1. Take the dog head characteristics from Image 2 (the {breed} dog head)
+2. Place it on the human body from Image 1
+3. Keep the human's body, clothing, pose, background, and lighting exactly as they appear in Image 1
+4. Make the transition from dog head to human neck look natural and anatomically correct
+5. Match the lighting on the dog head to the lighting in the human image
+6. Ensure the dog's expression matches the human's original expression
+
+Format your response as a clear, detailed prompt that can be used directly with DALL-E 3. Be very specific about:
+- The dog head characteristics (from Image 2)
+- The human body, clothing, pose details (from Image 1)
+- The background and lighting (from Image 1)
+- How the dog head should be positioned and integrated
+- The natural transition at the neck
+
+Start your response with "Photorealistic studio portrait." and structure it clearly."""
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{mime_human};base64,{human_base64}"
+                    }
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{mime_dog};base64,{dog_base64}"
+                    }
+                }
+            ]
+        }
+    ]
+
+def build_analysis_messages(image_base64, mime_type):
+    """Chat messages for the single structured analysis of an upload (JSON output)"""
+    return [
+        {
+            "role": "system",
+            "content": "You are a helpful assistant that analyzes portrait photos for a lighthearted app that creates fun human-to-dog transformations. You describe visual characteristics only and never identify people. You always answer with a JSON object."
+        },
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": """Analyze this portrait photo and return a JSON object with exactly these keys:
+
+- "breed": the single dog breed that best matches this person's general appearance, expression, and vibe. Breed name only, like "Golden Retriever" or "German Shepherd".
+- "subject": an object with
+  - "gender_age": gender and approximate age (e.g., "male, early-to-mid 30s")
+  - "face_shape": e.g., "oval", "round", "angular", "narrow"
+  - "hair": e.g., "short dark brown hair", "long blonde hair", "bald"
+  - "expression": e.g., "friendly, confident smile", "serious professional", "calm and neutral"
+  - "eyes": e.g., "bright eyes", "warm expression", "alert gaze"
+  - "facial_features": e.g., "strong jawline", "soft features", "prominent cheekbones"
+- "body": an object with
+  - "clothing": clothing with colors and details (e.g., "navy blue business suit, white shirt and patterned tie")
+  - "pose": pose and posture (e.g., "arms crossed", "standing straight")
+- "lighting": lighting style and direction if visible (e.g., "soft studio lighting from the left")
+- "background": e.g., "clean white background", "blurred office setting"
+- "camera": camera angle (e.g., "front-facing", "slight side angle")
+- "mood": overall mood in a few words
+
+Be specific about colors, textures, and details. Pay special attention to facial expression and eye characteristics as these will be important for matching."""
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{mime_type};base64,{image_base64}"
+                    }
+                }
+            ]
+        }
+    ]
+
+def default_analysis(breed=DEFAULT_BREED):
     """
-    Analyze the uploaded image to determine the closest dog breed.
-    Uses OpenAI GPT-4 Vision to analyze facial features.
+    Analysis record used when the vision call is refused or fails.
+    Marked as a fallback so prompt builders behave as if image analysis was unavailable.
+    """
+    return {
+        "breed": breed,
+        "subject": {"gender_age": "Person, front-facing portrait", "expression": "Neutral expression"},
+        "body": {"clothing": "Professional clothing", "pose": "Standing straight"},
+        "lighting": "Soft studio lighting",
+        "background": "Clean background",
+        "camera": "Front-facing",
+        "mood": "",
+        "fallback": True
+    }
+
+def parse_analysis(content):
+    """Validate the JSON answer of the analysis call; returns a record dict or None"""
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    breed = str(data.get("breed") or "").strip()
+    if not breed or is_refusal(breed):
+        return None
+
+    def section(value):
+        return {k: str(v).strip() for k, v in value.items() if v} if isinstance(value, dict) else {}
+
+    def text(value):
+        return str(value).strip() if value else ""
+
+    return {
+        "breed": breed,
+        "subject": section(data.get("subject")),
+        "body": section(data.get("body")),
+        "lighting": text(data.get("lighting")),
+        "background": text(data.get("background")),
+        "camera": text(data.get("camera")),
+        "mood": text(data.get("mood")),
+        "fallback": False
+    }
+
+def describe_analysis(analysis):
+    """Structured text description of an analysis record (same layout as analyze_image_characteristics)"""
+    subject = analysis.get("subject") or {}
+    body = analysis.get("body") or {}
+    sections = [
+        ("Subject", [subject.get("gender_age"), subject.get("face_shape") and f"{subject['face_shape']} face",
+                     subject.get("hair"), subject.get("expression"), subject.get("eyes"), subject.get("facial_features")]),
+        ("Body", [body.get("clothing"), body.get("pose")]),
+        ("Lighting", [analysis.get("lighting")]),
+        ("Background", [analysis.get("background")]),
+        ("Camera", [analysis.get("camera")]),
+    ]
+    blocks = []
+    for title, items in sections:
+        lines = [f"- {item}" for item in items if item]
+        if lines:
+            blocks.append(f"{title}:\n" + "\n".join(lines))
+    return "\n\n".join(blocks) or DEFAULT_IMAGE_DESCRIPTION
+
+def analysis_style_context(analysis):
+    """Short style phrase for the dog head prompt (lighting, angle, expression, mood)"""
+    subject = analysis.get("subject") or {}
+    parts = [analysis.get("lighting"), analysis.get("camera"), subject.get("expression"), analysis.get("mood")]
+    context = ", ".join(part for part in parts if part)
+    return context or DEFAULT_USER_CONTEXT
+
+def build_composite_prompt_from_analysis(breed, transformation_level, analysis):
+    """DALL-E 3 prompt placing the dog head on the human body, built from the analysis record"""
+    return f"""Photorealistic studio portrait.
+
+{describe_analysis(analysis)}
+
+Head:
+- {breed} dog head replacing the human head: {describe_transformation_level(transformation_level)}
+- The dog's expression matches the human's original expression
+- Lighting on the dog head matches the lighting of the portrait
+
+Keep the human's body, clothing, pose, background, and lighting exactly as described above. The transition from dog head to human neck looks natural and anatomically correct.
+
+Style:
+- Ultra-realistic photography
+- Shallow depth of field
+- No illustration or cartoon
+- High detail, seamless transformation"""
+
+def build_characteristics_messages(image_base64, mime_type):
+    """Chat messages asking GPT-4o for a structured description of the portrait"""
+    return [
+        {
+            "role": "system",
+            "content": "You are a helpful assistant that analyzes portrait photos to extract visual characteristics for photorealistic image generation. Provide structured, specific details."
+        },
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": """Analyze this portrait photo and provide a structured description. Format your response with these sections:
+
+Subject:
+- Gender and approximate age (e.g., "male, early-to-mid 30s" or "female, mid-20s")
+- Face shape (e.g., "oval", "round", "angular", "narrow")
+- Hair description (e.g., "short dark brown hair", "long blonde hair", "bald")
+- Facial expression (e.g., "friendly, confident smile", "serious professional", "calm and neutral")
+- Eye characteristics (e.g., "bright eyes", "warm expression", "alert gaze", "kind eyes")
+- Facial features (e.g., "strong jawline", "soft features", "prominent cheekbones", "gentle expression")
+
+Body:
+- Clothing description with colors and details (e.g., "wearing a navy blue business suit, white shirt and patterned tie" or "casual t-shirt and jeans")
+- Pose and posture (e.g., "arms crossed", "standing straight", "leaning slightly", "hands in pockets")
+
+Lighting:
+- Lighting style (e.g., "soft studio lighting", "bright natural light", "dramatic shadows", "even studio illumination")
+- Light direction if visible
+
+Background:
+- Background description (e.g., "clean white background", "blurred office setting", "outdoor scene", "neutral gray background")
+
+Camera:
+- Camera angle (e.g., "front-facing", "slight side angle", "head-on portrait")
+
+Be specific about colors, textures, and details. Do not identify the person, only describe visual characteristics. Pay special attention to facial expression and eye characteristics as these will be important for matching."""
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{mime_type};base64,{image_base64}"
+                    }
+                }
+            ]
+        }
+    ]
+
+def build_transition_analysis_prompt(breed, image_desc):
+    """DALL-E 3 prompt for the 30% transition, built from an image analysis"""
+    return f"""Photorealistic studio portrait.
+
+Subject:
+{image_desc}
+
+Body:
+- Human body with visible human shoulders, neck, and clothing
+- Posture and clothing remain completely human and unchanged
+
+Head:
+- {breed} dog head somewhat integrated (about 30% transformation)
+- Face structure remains mostly human but starting to show canine characteristics
+- Slight furry texture appearing on skin around face
+- Ears just beginning to shift toward {breed} dog ears
+- Eyes showing hints of canine characteristics while remaining mostly human-shaped
+- Dog head is beginning to replace the human head but not fully integrated yet
+- Natural transition beginning from dog head to human neck
+
+Style:
+- Ultra-realistic photography
+- Shallow depth of field
+- No illustration or cartoon
+- High detail, seamless transformation"""
+
+def build_transition_simple_prompt(breed):
+    """DALL-E 3 prompt for the 30% transition without image analysis"""
+    return f"""Photorealistic studio portrait of a {breed} dog head somewhat integrated on a human body (about 30% transformation). The dog head is beginning to replace the human head but not fully integrated yet - face structure remains mostly human but starting to show subtle canine characteristics, slight furry texture appearing on skin around face, ears just beginning to shift toward {breed} dog ears, eyes showing hints of canine characteristics while remaining mostly human-shaped. The human body, clothing, pose, and background remain completely unchanged. Natural transition beginning from dog head to human neck. Ultra-realistic photography style, shallow depth of field, high detail, seamless transformation."""
+
+def build_final_analysis_prompt(breed, image_desc):
+    """DALL-E 3 prompt for the final image, built from an image analysis"""
+    return f"""Photorealistic studio portrait.
+
+Subject:
+{image_desc}
+
+Body:
+- Human body with visible human shoulders, neck, and clothing
+- Posture and clothing remain completely human and unchanged
+
+Head:
+- Realistic {breed} dog head
+- Fully formed, expressive, and intelligent-looking
+- Detailed {breed} characteristics and natural fur texture
+- Natural neck anatomy
+- Fur lighting matched to studio light
+- Transition from dog head to human neck looks completely natural and anatomically correct
+
+Style:
+- Ultra-realistic photography
+- Shallow depth of field
+- No illustration or cartoon
+- High detail, seamless anatomical integration
+- 85mm lens
+- Realistic shadows"""
+
+def build_final_simple_prompt(breed):
+    """DALL-E 3 prompt for the final image without image analysis"""
+    return f"""Photorealistic studio portrait of a {breed} dog head on a human body. The {breed} dog head is fully formed, expressive, and intelligent-looking with detailed {breed} characteristics and natural fur texture. The human body, clothing, pose, and background remain completely unchanged. Natural neck anatomy with seamless transition from dog head to human neck. Fur lighting matched to studio lighting. Ultra-realistic photography style, shallow depth of field, high detail, seamless anatomical integration."""
+
+def build_full_dog_prompt(breed, has_dog_head):
+    """DALL-E 3 prompt for the full dog image, built from an image analysis"""
+    # Build prompt that references the dog head but creates a complete dog body
+    head_description = f" The dog's head should match the {breed} dog head characteristics from the generated dog head image" if has_dog_head else f" The dog's head should be a {breed} dog head"
+
+    return f"""Photorealistic studio portrait of a complete {breed} dog with full body visible (all four legs, torso, tail, complete dog anatomy - NO human body visible).
+
+Dog:
+- Complete {breed} dog body with all four legs clearly visible
+- Full dog torso, chest, and body (no human body parts)
+- Dog head positioned in the same location and angle as the human head was in the original image
+- {head_description}
+- Dog's body positioned naturally - if the human was standing, the dog is standing on all four legs; if human was sitting, the dog is sitting naturally
+- Natural, realistic {breed} dog anatomy and proportions throughout the entire body
+- Dog's expression and gaze direction match the human's original expression from the original image
+- The human has completely disappeared - only the dog remains
+
+Background and Lighting:
+- Professional studio portrait background (can be different from original, but should be appropriate for a dog portrait)
+- Studio lighting appropriate for a dog portrait
+- Same camera angle and framing as the original image (portrait orientation)
+- The background can be different from the original image
+
+Style:
+- Ultra-realistic photography
+- Shallow depth of field
+- No illustration or cartoon
+- High detail, natural dog pose
+- Same camera angle and framing as original
+- 85mm lens
+- Realistic shadows
+- Professional studio portrait quality
+- The dog should look natural and complete, as if it was always a dog in this portrait"""
+
+def build_full_dog_simple_prompt(breed):
+    """DALL-E 3 prompt for the full dog image without image analysis"""
+    return f"""Photorealistic studio portrait of a complete {breed} dog with full body visible (all four legs, torso, tail - NO human body visible). The dog's head is positioned in the same location where a human head would be in a portrait photo. The dog has a complete, natural {breed} dog body - no human body parts. The human has completely disappeared. Professional studio portrait background (can be different from original). Natural, realistic {breed} dog anatomy throughout. Ultra-realistic photography style, shallow depth of field, high detail, professional studio portrait quality."""
+
+def analyze_upload(image_path):
+    """
+    Run the single structured vision analysis for an uploaded image.
+    Returns a record with breed, subject (facial features), body (clothing, pose),
+    lighting, background, camera and mood. Every downstream prompt builder reads
+    this record instead of sending the image to GPT-4o again.
     """
     try:
         if not OPENAI_API_KEY:
-            print("OpenAI API key not found, using default breed")
-            return "Golden Retriever"
+            print("OpenAI API key not found, using default analysis")
+            return default_analysis()
+        
+        # Re-uploads of the same photo reuse the stored analysis (a near-identical one only its breed)
+        image_hash = breed_cache.image_hash(image_path)
+        cached = breed_cache.get(image_hash)
+        if cached and not cached.get('fallback', True):
+            return cached
         
         # Read the image and encode it
         image_base64 = image_to_base64(image_path)
         if not image_base64:
-            print("Failed to encode image, using default breed")
-            return "Golden Retriever"
+            print("Failed to encode image, using default analysis")
+            return default_analysis()
         
         # Use GPT-4 Vision to analyze the image
-        client = openai.OpenAI(api_key=OPENAI_API_KEY)
-        
-        # Determine image MIME type
-        ext = os.path.splitext(image_path)[1].lower()
-        mime_type = "image/jpeg" if ext in ['.jpg', '.jpeg'] else "image/png" if ext == '.png' else "image/jpeg"
+        client = openai_client.get_client('chat')
         
-        response = client.chat.completions.create(
+        response = retry.call(
+            client.chat.completions.create,
             model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a helpful assistant that matches people to dog breeds in a fun, creative way. This is for a lighthearted app that creates fun transformations."
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Look at this portrait photo. If you had to match this person to a dog breed based on their general appearance, expression, and vibe, which single dog breed would you choose? This is for a fun creative app. Just return the breed name only, like 'Golden Retriever' or 'German Shepherd'. No explanation needed."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:{mime_type};base64,{image_base64}"
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=30
+            messages=build_analysis_messages(image_base64, get_mime_type(image_path)),
+            max_tokens=500,
+            response_format={"type": "json_object"}
         )
         
-        breed = response.choices[0].message.content.strip()
-        print(f"Detected breed: {breed}")
+        analysis = parse_analysis(response.choices[0].message.content)
         
-        # If GPT-4 refuses or returns an error message, use a default breed
-        if "sorry" in breed.lower() or "can't" in breed.lower() or "cannot" in breed.lower():
-            print("GPT-4 refused, using default breed: Golden Retriever")
-            return "Golden Retriever"
+        # If GPT-4 refuses or returns something that is not a usable record, use the default
+        if not analysis:
+            print(f"GPT-4 refused, using default analysis with breed: {DEFAULT_BREED}")
+            return default_analysis()
         
-        return breed
+        if cached:
+            # A near-identical photo was seen before: keep its breed so re-uploads get the same dog
+            analysis['breed'] = cached['breed']
+        print(f"Detected breed: {analysis['breed']}")
+        breed_cache.put(image_hash, analysis)
+        return analysis
         
     except Exception as e:
-        print(f"Error analyzing breed: {e}")
+        print(f"Error analyzing image: {e}")
         import traceback
         traceback.print_exc()
-        # Return a default breed if analysis fails
-        return "Golden Retriever"
+        # Return a default record if analysis fails
+        return default_analysis()
+
+def analyze_dog_breed(image_path):
+    """
+    Analyze the uploaded image to determine the closest dog breed.
+    Uses the structured upload analysis (GPT-4 Vision), so the breed comes for free with it.
+    """
+    return analyze_upload(image_path)['breed']
 
 def generate_single_transformation_image(prompt, output_path):
     """
@@ -117,26 +543,19 @@ def generate_single_transformation_image(prompt, output_path):
         print(f"Prompt preview: {prompt[:100]}...")
         
         # Use OpenAI DALL-E 3 to generate the image
-        client = openai.OpenAI(api_key=OPENAI_API_KEY)
+        client = openai_client.get_client('image')
         
-        response = client.images.generate(
+        response = retry.call(
+            client.images.generate,
             model="dall-e-3",
             prompt=prompt,
             size="1024x1024",
             quality="standard",
             n=1,
+            response_format="b64_json"  # Image data inline, no second download round trip
         )
         
-        # Get the image URL from the response
-        image_url = response.data[0].url
-        
-        if image_url:
-            print(f"Downloading image from: {image_url}")
-            download_image(image_url, output_path)
-            return output_path
-        else:
-            print("ERROR: No image URL returned from OpenAI")
-            return None
+        return image_output.save_image_result(response, output_path, "DALL-E 3")
             
     except Exception as e:
         print(f"Error generating image: {e}")
@@ -144,6 +563,27 @@ def generate_single_transformation_image(prompt, output_path):
         traceback.print_exc()
         return None
 
+def save_edit_response(response, output_path):
+    """Save the image returned by images.edit() (base64 or URL) to output_path"""
+    print(f"[GPT-Image-1] Response received. Type: {type(response)}")
+    return image_output.save_image_result(response, output_path, "GPT-Image-1")
+
+def log_edit_error(e):
+    """Explain a GPT-Image-1 failure before the caller falls back to prompt-based generation"""
+    error_type = type(e).__name__
+    error_msg = str(e)
+    print(f"[GPT-Image-1] API error: {error_type}: {error_msg}")
+    
+    # Check if it's a model availability issue
+    if "model" in error_msg.lower() or "not found" in error_msg.lower() or "not available" in error_msg.lower():
+        print("[GPT-Image-1] Model may not be available in your account yet.")
+        print("[GPT-Image-1] This model was released in April 2025. You may need to:")
+        print("[GPT-Image-1] 1. Check if your OpenAI account has access to GPT-Image-1")
+        print("[GPT-Image-1] 2. Try using 'gpt-image-1-mini' instead")
+        print("[GPT-Image-1] 3. Or wait for model availability")
+    
+    print("[GPT-Image-1] Will fall back to prompt-based generation...")
+
 def edit_image_with_dog_head(human_image_path, dog_head_image_path, breed, output_path, transformation_level=1.0):
     """
     Use GPT-Image-1 to edit the human image by replacing the head with the dog head.
@@ -157,19 +597,14 @@ def edit_image_with_dog_head(human_image_path, dog_head_image_path, breed, outpu
         print(f"[GPT-Image-1] Editing image (transformation level: {transformation_level})...")
         print(f"[GPT-Image-1] Sending both images: human image and dog head image")
         
-        client = openai.OpenAI(api_key=OPENAI_API_KEY)
+        client = openai_client.get_client('image')
         
         # Create edit prompt based on transformation level
-        if transformation_level == 0.3:
-            edit_prompt = f"Take the dog head from the second image and use it to replace the human head in the first image, showing subtle transformation (about 30%). The face structure remains mostly human but starting to show canine characteristics from the dog head - slight furry texture appearing on skin around face, ears just beginning to shift toward {breed} dog ears, eyes showing hints of canine characteristics while remaining mostly human-shaped. Keep everything else from the first image exactly the same (body, clothing, pose, background, lighting). Match the dog's expression from the second image to the human's original expression from the first image."
-        elif transformation_level == 0.7:
-            edit_prompt = f"Take the dog head from the second image and use it to replace the human head in the first image, showing significant transformation (about 70%). The dog head from the second image should be prominently featured with fully formed {breed} ears, significant fur coverage, developing snout, and canine eye structure. The dog's expression from the second image should match the human's original expression from the first image. Keep everything else from the first image exactly the same (body, clothing, pose, background, lighting). Make the transition from dog head to human neck look natural and anatomically correct."
-        else:  # 1.0
-            edit_prompt = f"Take the {breed} dog head from the second image and use it to completely replace the human head in the first image. The dog head should be fully formed, expressive, and intelligent-looking with detailed {breed} characteristics as shown in the second image. The dog's expression from the second image should match the human's original expression from the first image. Keep everything else from the first image exactly the same (body, clothing, pose, background, lighting). Make the transition from dog head to human neck look completely natural and anatomically correct. Match the lighting on the dog head to the lighting in the first image."
+        edit_prompt = build_edit_prompt(breed, transformation_level)
         
-        # Open image files as file objects (required by API)
-        human_image_file = open(human_image_path, 'rb')
-        dog_image_file = open(dog_head_image_path, 'rb')
+        # Open the normalized, downscaled copies as file objects (required by API)
+        human_image_file = open(image_prep.prepare(human_image_path), 'rb')
+        dog_image_file = open(image_prep.prepare(dog_head_image_path), 'rb')
         
         try:
             # Get file sizes for logging and validation
@@ -182,12 +617,11 @@ def edit_image_with_dog_head(human_image_path, dog_head_image_path, breed, outpu
             dog_image_file.seek(0)  # Reset to beginning
             
             # Validate file sizes (API limit: 50MB per image)
-            MAX_SIZE = 50 * 1024 * 1024  # 50MB in bytes
-            if human_size > MAX_SIZE:
-                print(f"[GPT-Image-1] ERROR: Human image too large ({human_size} bytes > {MAX_SIZE} bytes)")
+            if human_size > MAX_EDIT_IMAGE_SIZE:
+                print(f"[GPT-Image-1] ERROR: Human image too large ({human_size} bytes > {MAX_EDIT_IMAGE_SIZE} bytes)")
                 return None
-            if dog_size > MAX_SIZE:
-                print(f"[GPT-Image-1] ERROR: Dog image too large ({dog_size} bytes > {MAX_SIZE} bytes)")
+            if dog_size > MAX_EDIT_IMAGE_SIZE:
+                print(f"[GPT-Image-1] ERROR: Dog image too large ({dog_size} bytes > {MAX_EDIT_IMAGE_SIZE} bytes)")
                 return None
             
             print("Attempting GPT-Image-1 with file objects...")
@@ -196,27 +630,37 @@ def edit_image_with_dog_head(human_image_path, dog_head_image_path, breed, outpu
             print(f"Prompt length: {len(edit_prompt)} chars")
             
             # Try GPT-Image-1 first, if it fails try gpt-image-1-mini
-            models_to_try = ["gpt-image-1", "gpt-image-1-mini"]
             response = None
             last_error = None
             
-            for model_name in models_to_try:
+            for model_name in EDIT_MODELS:
+                if not circuit_breaker.allow(model_name):
+                    print(f"[GPT-Image-1] Skipping {model_name} (circuit breaker open)")
+                    continue
                 try:
                     print(f"Trying model: {model_name}...")
-                    # API expects a list of file objects opened in binary mode
-                    response = client.images.edit(
-                        model=model_name,
-                        image=[human_image_file, dog_image_file],  # List of file objects
-                        prompt=edit_prompt,
-                        size="1024x1024",
-                        input_fidelity="high"
-                        # Note: response_format parameter is not supported for images.edit()
-                        # The API returns URLs by default in the response.data[0].url field
-                    )
+                    
+                    def send_edit():
+                        # Rewind the files so a retry uploads them again from the start
+                        human_image_file.seek(0)
+                        dog_image_file.seek(0)
+                        # API expects a list of file objects opened in binary mode
+                        return client.images.edit(
+                            model=model_name,
+                            image=[human_image_file, dog_image_file],  # List of file objects
+                            prompt=edit_prompt,
+                            size="1024x1024",
+                            input_fidelity="high"
+                            # Note: response_format parameter is not supported for images.edit()
+                            # The API returns base64 image data in the response.data[0].b64_json field
+                        )
+                    response = retry.call(send_edit, label=model_name)
                     print(f"[GPT-Image-1] Successfully got response from {model_name}")
+                    circuit_breaker.record_success(model_name)
                     break
                 except Exception as model_error:
                     print(f"[GPT-Image-1] Model {model_name} failed: {model_error}")
+                    circuit_breaker.record_failure(model_name, model_error)
                     last_error = model_error
                     # Reset file pointers for next attempt
                     human_image_file.seek(0)
@@ -226,61 +670,11 @@ def edit_image_with_dog_head(human_image_path, dog_head_image_path, breed, outpu
             if not response:
                 raise Exception(f"All models failed. Last error: {last_error}")
             
-            # Debug: print response structure
-            print(f"[GPT-Image-1] Response received. Type: {type(response)}")
-            
-            # Get the image from the response
-            # Response structure: response.data[0].url or response.data[0].b64_json
-            if hasattr(response, 'data') and response.data and len(response.data) > 0:
-                first_item = response.data[0]
-                
-                # Check for URL first
-                if hasattr(first_item, 'url'):
-                    image_url = first_item.url
-                    if image_url:
-                        print(f"[GPT-Image-1] Got image URL, downloading...")
-                        download_image(image_url, output_path)
-                        print(f"[GPT-Image-1] Image saved to: {output_path}")
-                        return output_path
-                    else:
-                        print("[GPT-Image-1] URL field exists but is None")
-                
-                # Check for base64 JSON
-                if hasattr(first_item, 'b64_json'):
-                    b64_data = first_item.b64_json
-                    if b64_data:
-                        print("[GPT-Image-1] Got base64 image data, saving directly...")
-                        import base64
-                        image_data = base64.b64decode(b64_data)
-                        with open(output_path, 'wb') as f:
-                            f.write(image_data)
-                        print(f"[GPT-Image-1] Image saved to: {output_path}")
-                        return output_path
-                    else:
-                        print("[GPT-Image-1] b64_json field exists but is None")
-                
-                # If we get here, neither url nor b64_json has a value
-                print(f"[GPT-Image-1] ERROR: Response item has url={getattr(first_item, 'url', 'N/A')} and b64_json={getattr(first_item, 'b64_json', 'N/A')}")
-                return None
-            else:
-                print(f"[GPT-Image-1] ERROR: Response has no data or data is empty")
-                return None
+            return save_edit_response(response, output_path)
                 
         except Exception as e:
             # If GPT-Image-1 is not available, fall back to prompt-based generation
-            error_type = type(e).__name__
-            error_msg = str(e)
-            print(f"[GPT-Image-1] API error: {error_type}: {error_msg}")
-            
-            # Check if it's a model availability issue
-            if "model" in error_msg.lower() or "not found" in error_msg.lower() or "not available" in error_msg.lower():
-                print("[GPT-Image-1] Model may not be available in your account yet.")
-                print("[GPT-Image-1] This model was released in April 2025. You may need to:")
-                print("[GPT-Image-1] 1. Check if your OpenAI account has access to GPT-Image-1")
-                print("[GPT-Image-1] 2. Try using 'gpt-image-1-mini' instead")
-                print("[GPT-Image-1] 3. Or wait for model availability")
-            
-            print("[GPT-Image-1] Will fall back to prompt-based generation...")
+            log_edit_error(e)
             return None
         finally:
             # Always close the file objects
@@ -293,15 +687,22 @@ def edit_image_with_dog_head(human_image_path, dog_head_image_path, breed, outpu
         traceback.print_exc()
         return None
 
-def generate_dog_head_image(breed, user_image_path, output_path):
+def generate_dog_head_image(breed, user_image_path, output_path, analysis=None):
     """
     Generate a dog head image using DALL-E 3 that matches the user's image characteristics.
+    If the upload's analysis record is given, its style details are used instead of a new vision call.
     """
     try:
         if not OPENAI_API_KEY:
             print("ERROR: OPENAI_API_KEY not set in environment")
             return None
         
+        if analysis is not None:
+            user_context = analysis_style_context(analysis)
+            print(f"User image context (from analysis): {user_context}")
+            print(f"Generating {breed} dog head image...")
+            return generate_single_transformation_image(build_dog_head_prompt(breed, user_context), output_path)
+        
         # First, analyze the user's image to get characteristics
         print("Analyzing user image for dog head generation...")
         image_base64 = image_to_base64(user_image_path)
@@ -309,47 +710,26 @@ def generate_dog_head_image(breed, user_image_path, output_path):
             print("Failed to encode user image")
             return None
         
-        client = openai.OpenAI(api_key=OPENAI_API_KEY)
-        ext = os.path.splitext(user_image_path)[1].lower()
-        mime_type = "image/jpeg" if ext in ['.jpg', '.jpeg'] else "image/png" if ext == '.png' else "image/jpeg"
+        client = openai_client.get_client('chat')
         
         # Get description of user's features for better matching
         try:
-            response = client.chat.completions.create(
+            response = retry.call(
+                client.chat.completions.create,
                 model="gpt-4o",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a helpful assistant that describes portrait photos for creative image generation."
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": "Describe this portrait in 2-3 short phrases focusing on: lighting (bright, soft, dramatic), angle (front-facing, side, etc.), expression (serious, smiling, neutral), and overall mood. Keep it brief."
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:{mime_type};base64,{image_base64}"
-                                }
-                            }
-                        ]
-                    }
-                ],
+                messages=build_dog_head_context_messages(image_base64, get_mime_type(user_image_path)),
                 max_tokens=50
             )
             user_context = response.choices[0].message.content.strip()
-            if "sorry" in user_context.lower() or "can't" in user_context.lower():
-                user_context = "professional portrait, front-facing, neutral expression"
+            if is_refusal(user_context, ("sorry", "can't")):
+                user_context = DEFAULT_USER_CONTEXT
             print(f"User image context: {user_context}")
         except Exception as e:
             print(f"Could not analyze user image, using default context: {e}")
-            user_context = "professional portrait, front-facing, neutral expression"
+            user_context = DEFAULT_USER_CONTEXT
         
         # Generate dog head with matching characteristics
-        prompt = f"""A photorealistic close-up portrait of a {breed} dog's head and upper neck, looking directly at the camera. The dog should have an expressive, intelligent look. Match the style: {user_context}. Professional pet photography, studio lighting, high quality, detailed fur texture, clear background, headshot composition."""
+        prompt = build_dog_head_prompt(breed, user_context)
         
         print(f"Generating {breed} dog head image...")
         dog_head_path = generate_single_transformation_image(prompt, output_path)
@@ -361,15 +741,23 @@ def generate_dog_head_image(breed, user_image_path, output_path):
         traceback.print_exc()
         return None
 
-def create_composite_prompt_from_images(human_image_path, dog_head_image_path, breed, transformation_level):
+def create_composite_prompt_from_images(human_image_path, dog_head_image_path, breed, transformation_level, analysis=None):
     """
     Use GPT-4 Vision to analyze both images and create a detailed prompt for DALL-E 3
     that will place the dog head on the human body.
+    If the upload's analysis record is given, the prompt is built from it without a vision call.
     """
     try:
         if not OPENAI_API_KEY:
             return None
         
+        if analysis is not None:
+            if analysis.get('fallback'):
+                # The upload could not be analyzed, same as GPT-4 Vision refusing here
+                return None
+            print(f"Building composite prompt from analysis (transformation level: {transformation_level})...")
+            return build_composite_prompt_from_analysis(breed, transformation_level, analysis)
+        
         print(f"Analyzing both images to create composite prompt (transformation level: {transformation_level})...")
         
         human_base64 = image_to_base64(human_image_path)
@@ -379,77 +767,21 @@ def create_composite_prompt_from_images(human_image_path, dog_head_image_path, b
             print("Failed to encode images")
             return None
         
-        client = openai.OpenAI(api_key=OPENAI_API_KEY)
-        ext_human = os.path.splitext(human_image_path)[1].lower()
-        ext_dog = os.path.splitext(dog_head_image_path)[1].lower()
-        mime_human = "image/jpeg" if ext_human in ['.jpg', '.jpeg'] else "image/png" if ext_human == '.png' else "image/jpeg"
-        mime_dog = "image/jpeg" if ext_dog in ['.jpg', '.jpeg'] else "image/png" if ext_dog == '.png' else "image/jpeg"
-        
-        # Determine transformation description based on level
-        if transformation_level == 0.3:
-            trans_desc = "Beginning to show subtle dog features (about 30% transformation). Face structure remains mostly human but starting to show canine characteristics. Slight furry texture appearing on skin around face. Ears just beginning to shift toward dog ears. Eyes showing hints of canine characteristics while remaining mostly human-shaped."
-        elif transformation_level == 0.7:
-            trans_desc = "Significant transformation (about 70%). Dog head prominently featured with fully formed dog ears. Significant fur coverage, developing snout. Canine eye structure and expression."
-        else:  # 1.0
-            trans_desc = "Complete transformation (100%). Fully formed dog head replacing the human head."
+        client = openai_client.get_client('chat')
         
         try:
-            response = client.chat.completions.create(
+            response = retry.call(
+                client.chat.completions.create,
                 model="gpt-4o",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a helpful assistant that analyzes images and creates detailed prompts for image generation. You will see two images: a human portrait and a dog head. Your task is to create a detailed prompt that tells an image generator how to place the dog head on the human body while keeping everything else exactly the same."
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": f"""I have two images:
-- Image 1: A human portrait photo
-- Image 2: A {breed} dog head portrait
-
-I want to create a new image where the dog head from Image 2 replaces the human head in Image 1, but everything else (body, clothing, pose, background, lighting) stays exactly the same from Image 1.
-
-Transformation level: {trans_desc}
-
-Please create a detailed, specific prompt for an image generator (DALL-E 3) that will:
-1. Take the dog head characteristics from Image 2 (the {breed} dog head)
-2. Place it on the human body from Image 1
-3. Keep the human's body, clothing, pose, background, and lighting exactly as they appear in Image 1
-4. Make the transition from dog head to human neck look natural and anatomically correct
-5. Match the lighting on the dog head to the lighting in the human image
-6. Ensure the dog's expression matches the human's original expression
-
-Format your response as a clear, detailed prompt that can be used directly with DALL-E 3. Be very specific about:
-- The dog head characteristics (from Image 2)
-- The human body, clothing, pose details (from Image 1)
-- The background and lighting (from Image 1)
-- How the dog head should be positioned and integrated
-- The natural transition at the neck
-
-Start your response with "Photorealistic studio portrait." and structure it clearly."""
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:{mime_human};base64,{human_base64}"
-                                }
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:{mime_dog};base64,{dog_base64}"
-                                }
-                            }
-                        ]
-                    }
-                ],
+                messages=build_composite_messages(
+                    breed, transformation_level,
+                    human_base64, get_mime_type(human_image_path),
+                    dog_base64, get_mime_type(dog_head_image_path)
+                ),
                 max_tokens=500
             )
             prompt = response.choices[0].message.content.strip()
-            if "sorry" in prompt.lower() or "can't" in prompt.lower() or "cannot" in prompt.lower():
+            if is_refusal(prompt):
                 print("GPT-4 refused, using fallback prompt")
                 return None
             print(f"Generated composite prompt: {prompt[:150]}...")
@@ -464,153 +796,173 @@ Start your response with "Photorealistic studio portrait." and structure it clea
         traceback.print_exc()
         return None
 
-def analyze_image_characteristics(image_path):
+def analyze_image_characteristics(image_path, analysis=None):
     """
     Analyze the human image to extract detailed descriptive traits for regeneration.
     Returns a structured description with subject, body, lighting, and style details.
+    If the upload's analysis record is given, the description is formatted from it.
     """
     try:
         if not OPENAI_API_KEY:
             return None
         
+        if analysis is not None:
+            if analysis.get('fallback'):
+                return DEFAULT_IMAGE_DESCRIPTION
+            return describe_analysis(analysis)
+        
         print("Analyzing image characteristics...")
         image_base64 = image_to_base64(image_path)
         if not image_base64:
             return None
         
-        client = openai.OpenAI(api_key=OPENAI_API_KEY)
-        ext = os.path.splitext(image_path)[1].lower()
-        mime_type = "image/jpeg" if ext in ['.jpg', '.jpeg'] else "image/png" if ext == '.png' else "image/jpeg"
+        client = openai_client.get_client('chat')
         
         try:
-            response = client.chat.completions.create(
+            response = retry.call(
+                client.chat.completions.create,
                 model="gpt-4o",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a helpful assistant that analyzes portrait photos to extract visual characteristics for photorealistic image generation. Provide structured, specific details."
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": """Analyze this portrait photo and provide a structured description. Format your response with these sections:
-
-Subject:
-- Gender and approximate age (e.g., "male, early-to-mid 30s" or "female, mid-20s")
-- Face shape (e.g., "oval", "round", "angular", "narrow")
-- Hair description (e.g., "short dark brown hair", "long blonde hair", "bald")
-- Facial expression (e.g., "friendly, confident smile", "serious professional", "calm and neutral")
-- Eye characteristics (e.g., "bright eyes", "warm expression", "alert gaze", "kind eyes")
-- Facial features (e.g., "strong jawline", "soft features", "prominent cheekbones", "gentle expression")
-
-Body:
-- Clothing description with colors and details (e.g., "wearing a navy blue business suit, white shirt and patterned tie" or "casual t-shirt and jeans")
-- Pose and posture (e.g., "arms crossed", "standing straight", "leaning slightly", "hands in pockets")
-
-Lighting:
-- Lighting style (e.g., "soft studio lighting", "bright natural light", "dramatic shadows", "even studio illumination")
-- Light direction if visible
-
-Background:
-- Background description (e.g., "clean white background", "blurred office setting", "outdoor scene", "neutral gray background")
-
-Camera:
-- Camera angle (e.g., "front-facing", "slight side angle", "head-on portrait")
-
-Be specific about colors, textures, and details. Do not identify the person, only describe visual characteristics. Pay special attention to facial expression and eye characteristics as these will be important for matching."""
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:{mime_type};base64,{image_base64}"
-                                }
-                            }
-                        ]
-                    }
-                ],
+                messages=build_characteristics_messages(image_base64, get_mime_type(image_path)),
                 max_tokens=300
             )
             description = response.choices[0].message.content.strip()
-            if "sorry" in description.lower() or "can't" in description.lower():
-                description = """Subject:
-- Person, front-facing portrait
-- Neutral expression
-
-Body:
-- Professional clothing
-- Standing straight
-
-Lighting:
-- Soft studio lighting
-
-Background:
-- Clean background
-
-Camera:
-- Front-facing"""
+            if is_refusal(description, ("sorry", "can't")):
+                description = DEFAULT_IMAGE_DESCRIPTION
             print(f"Image analysis: {description[:150]}...")
             return description
         except Exception as e:
             print(f"Could not analyze image, using default: {e}")
-            return """Subject:
-- Person, front-facing portrait
-- Neutral expression
-
-Body:
-- Professional clothing
-- Standing straight
-
-Lighting:
-- Soft studio lighting
-
-Background:
-- Clean background
-
-Camera:
-- Front-facing"""
+            return DEFAULT_IMAGE_DESCRIPTION
         
     except Exception as e:
         print(f"Error analyzing image: {e}")
-        return """Subject:
-- Person, front-facing portrait
-- Neutral expression
-
-Body:
-- Professional clothing
-- Standing straight
+        return DEFAULT_IMAGE_DESCRIPTION
 
-Lighting:
-- Soft studio lighting
 
-Background:
-- Clean background
+def generate_frame_from_prompts(image_path, dog_path, breed, output_path, level, analysis, analysis_prompt, simple_prompt, label):
+    """
+    Prompt-based generation of an edited frame with DALL-E 3 (METHODS 2-4):
+    GPT-4 Vision composite prompt -> image analysis prompt -> simple prompt
+    """
+    # Fall back to prompt-based generation using GPT-4 Vision
+    print(f"[{label}] [METHOD 2] Trying GPT-4 Vision prompt generation...")
+    prompt = create_composite_prompt_from_images(image_path, dog_path, breed, level, analysis)
+    if prompt:
+        print(f"[{label}] [METHOD 2] Using GPT-4 Vision generated prompt with DALL-E 3...")
+        result = generate_single_transformation_image(prompt, output_path)
+        if result:
+            print(f"✓ [SUCCESS] {label} generated using GPT-4 Vision + DALL-E 3")
+        return result
+    
+    # If GPT-4 Vision refused, use analyze_image_characteristics as fallback
+    print(f"[{label}] [METHOD 3] GPT-4 Vision refused, trying image analysis fallback...")
+    image_desc = analyze_image_characteristics(image_path, analysis)
+    if image_desc:
+        print(f"[{label}] [METHOD 3] Using image analysis with DALL-E 3...")
+        result = generate_single_transformation_image(analysis_prompt(breed, image_desc), output_path)
+        if result:
+            print(f"✓ [SUCCESS] {label} generated using Image Analysis + DALL-E 3")
+        return result
+    
+    # Final fallback: simple prompt without image analysis
+    print(f"[{label}] [METHOD 4] Image analysis failed, using simple fallback prompt...")
+    result = generate_single_transformation_image(simple_prompt(breed), output_path)
+    if result:
+        print(f"✓ [SUCCESS] {label} generated using Simple Fallback + DALL-E 3")
+    return result
 
-Camera:
-- Front-facing"""
+def generate_edited_frame(image_path, dog_path, breed, output_path, level, analysis, analysis_prompt, simple_prompt, label, outcome=None):
+    """
+    Generate a frame with the dog head on the human body: GPT-Image-1 edit first, then
+    prompt-based generation. In hedged mode (HEDGE_ENABLED) the prompt-based methods start
+    in parallel if the edit has not finished within HEDGE_DELAY, and the first result wins.
+    If outcome (a dict) is given, outcome['edited'] tells whether the frame is a GPT-Image-1
+    edit of the upload (True) or a new prompt-based composition (False).
+    """
+    outcome = {} if outcome is None else outcome
+    def edit(path):
+        return edit_image_with_dog_head(image_path, dog_path, breed, path, transformation_level=level)
+    
+    def from_prompts(path):
+        return generate_frame_from_prompts(image_path, dog_path, breed, path, level, analysis, analysis_prompt, simple_prompt, label)
+    
+    if hedging.HEDGE_ENABLED:
+        print(f"[{label}] Hedged generation (GPT-Image-1, then prompt-based after {hedging.HEDGE_DELAY:.0f}s)...")
+        hedge = {}
+        result = hedging.run_hedged([edit, from_prompts], output_path, label=label, outcome=hedge)
+        outcome['edited'] = bool(result) and hedge.get('method') == 0
+        if result:
+            print(f"✓ [SUCCESS] {label} generated (hedged)")
+        return result
+    
+    # Try GPT-Image-1 first
+    print(f"[{label}] [METHOD 1] Attempting GPT-Image-1 (direct image editing)...")
+    result = edit(output_path)
+    if result:
+        outcome['edited'] = True
+        print(f"✓ [SUCCESS] {label} generated using GPT-Image-1")
+        return result
+    
+    print(f"[{label}] GPT-Image-1 failed, falling back to prompt-based generation...")
+    outcome['edited'] = False
+    return from_prompts(output_path)
 
+def blend_transition_frame(image_path, final_path, output_path, level):
+    """
+    Derive a transition frame locally: the face region of the final frame is blended
+    into the (normalized) upload at level (see face_blend), in the image pool. No API call is made.
+    """
+    try:
+        image_pool.run(face_blend.blend_to_files, final_path, image_prep.prepare(image_path), [(level, output_path)])
+        print(f"✓ [SUCCESS] Transition blended locally at {level:.0%}")
+        return output_path
+    except Exception as e:
+        print(f"Error blending transition frame: {e}")
+        return None
 
-def generate_transformation_images(image_path, breed, user_id, timestamp):
+def generate_transformation_images(image_path, breed, user_id, timestamp, analysis=None, on_frame=None):
     """
     Generate 3 transformation images using a hybrid approach:
     1. Generate a dog head image with DALL-E 3
     2. Use GPT-Image-1 (if available) to edit the human image by replacing the head
     3. If GPT-Image-1 is not available, use GPT-4 Vision to create detailed prompts for DALL-E 3
     
+    With LOCAL_TRANSITIONS the transition is instead blended on the CPU from the upload and
+    the final frame once that is ready, so each job makes one image call less. This only
+    happens when the final frame is a GPT-Image-1 edit of the upload; otherwise the
+    transition is generated with the API after all.
+    
     1. Transition (30% transformation - dog head somewhat integrated on human body)
     2. Final (100% transformation - dog head fully integrated on human body)
     3. Full Dog (complete dog body, no human in picture)
+    
+    analysis is the upload's structured analysis record (see analyze_upload). It is computed
+    here if not given, and every prompt in the pipeline is built from it.
+    All API retries of the run share one retry budget (see retry.py).
+    
+    on_frame(stage, path), if given, is called as soon as each frame ('trans1', 'final',
+    'full_dog') is ready, so the caller can publish it before the slower branches finish.
     """
+    with retry.job_budget():
+        return _generate_transformation_images(image_path, breed, user_id, timestamp, analysis, on_frame)
+
+def _generate_transformation_images(image_path, breed, user_id, timestamp, analysis=None, on_frame=None):
+    """Body of generate_transformation_images, run inside the retry budget"""
     base_path = f"uploads/{user_id}_{timestamp}"
     dog_head_path = f"{base_path}_dog_head.png"
     trans1_path = f"{base_path}_transition1.png"
     final_path = f"{base_path}_final.png"
     full_dog_path = f"{base_path}_full_dog.png"
     
+    if analysis is None:
+        print("Step 0: Analyzing uploaded image...")
+        analysis = analyze_upload(image_path)
+    
     print(f"Step 1: Generating {breed} dog head image...")
-    # First, generate the dog head image
-    dog_path = generate_dog_head_image(breed, image_path, dog_head_path)
+    # First, get the dog head image: from the pre-generated library if it has the breed, else live
+    dog_path = dog_head_library.fetch(breed, analysis, dog_head_path)
+    if not dog_path:
+        dog_path = generate_dog_head_image(breed, image_path, dog_head_path, analysis)
     
     if not dog_path or not os.path.exists(dog_path):
         print("ERROR: Failed to generate dog head image")
@@ -623,68 +975,28 @@ def generate_transformation_images(image_path, breed, user_id, timestamp):
     results = {}
     errors = {}
     
+    def report_frame(stage, path):
+        """Hand a finished frame to the caller right away"""
+        if on_frame:
+            try:
+                on_frame(stage, path)
+            except Exception as e:
+                print(f"Could not report {stage} frame: {e}")
+    
     def generate_trans1():
         """Generate transition 1 (30% transformation)"""
         try:
             print("=" * 60)
             print("Thread 1: Generating transition 1 (30% transformation)")
             print("=" * 60)
-            # Try GPT-Image-1 first
-            print("[METHOD 1] Attempting GPT-Image-1 (direct image editing)...")
-            result = edit_image_with_dog_head(image_path, dog_path, breed, trans1_path, transformation_level=0.3)
-            if result:
-                print("✓ [SUCCESS] Transition 1 generated using GPT-Image-1")
-            else:
-                # Fall back to prompt-based generation using GPT-4 Vision
-                print("[METHOD 2] GPT-Image-1 failed, trying GPT-4 Vision prompt generation...")
-                prompt = create_composite_prompt_from_images(image_path, dog_path, breed, 0.3)
-                if prompt:
-                    print("[METHOD 2] Using GPT-4 Vision generated prompt with DALL-E 3...")
-                    result = generate_single_transformation_image(prompt, trans1_path)
-                    if result:
-                        print("✓ [SUCCESS] Transition 1 generated using GPT-4 Vision + DALL-E 3")
-                else:
-                    # If GPT-4 Vision refused, use analyze_image_characteristics as fallback
-                    print("[METHOD 3] GPT-4 Vision refused, trying image analysis fallback...")
-                    image_desc = analyze_image_characteristics(image_path)
-                    if image_desc:
-                        print("[METHOD 3] Using image analysis with DALL-E 3...")
-                        prompt = f"""Photorealistic studio portrait.
-
-Subject:
-{image_desc}
-
-Body:
-- Human body with visible human shoulders, neck, and clothing
-- Posture and clothing remain completely human and unchanged
-
-Head:
-- {breed} dog head somewhat integrated (about 30% transformation)
-- Face structure remains mostly human but starting to show canine characteristics
-- Slight furry texture appearing on skin around face
-- Ears just beginning to shift toward {breed} dog ears
-- Eyes showing hints of canine characteristics while remaining mostly human-shaped
-- Dog head is beginning to replace the human head but not fully integrated yet
-- Natural transition beginning from dog head to human neck
-
-Style:
-- Ultra-realistic photography
-- Shallow depth of field
-- No illustration or cartoon
-- High detail, seamless transformation"""
-                        result = generate_single_transformation_image(prompt, trans1_path)
-                        if result:
-                            print("✓ [SUCCESS] Transition 1 generated using Image Analysis + DALL-E 3")
-                    else:
-                        # Final fallback: simple prompt without image analysis
-                        print("[METHOD 4] Image analysis failed, using simple fallback prompt...")
-                        prompt = f"""Photorealistic studio portrait of a {breed} dog head somewhat integrated on a human body (about 30% transformation). The dog head is beginning to replace the human head but not fully integrated yet - face structure remains mostly human but starting to show subtle canine characteristics, slight furry texture appearing on skin around face, ears just beginning to shift toward {breed} dog ears, eyes showing hints of canine characteristics while remaining mostly human-shaped. The human body, clothing, pose, and background remain completely unchanged. Natural transition beginning from dog head to human neck. Ultra-realistic photography style, shallow depth of field, high detail, seamless transformation."""
-                        result = generate_single_transformation_image(prompt, trans1_path)
-                        if result:
-                            print("✓ [SUCCESS] Transition 1 generated using Simple Fallback + DALL-E 3")
+            result = generate_edited_frame(
+                image_path, dog_path, breed, trans1_path, 0.3, analysis,
+                build_transition_analysis_prompt, build_transition_simple_prompt, "Transition 1"
+            )
             results['trans1'] = result
             if result:
                 print("✓ Thread 1: Transition 1 completed successfully")
+                report_frame('trans1', result)
             else:
                 errors['trans1'] = "Failed to generate transition 1"
                 print("✗ Thread 1: Transition 1 FAILED - all methods exhausted")
@@ -703,65 +1015,29 @@ Style:
             print("[METHOD 1] Analyzing images to create full dog with matching head...")
             
             # Get description of the human image for pose/position reference
-            human_desc = analyze_image_characteristics(image_path)
+            human_desc = analyze_image_characteristics(image_path, analysis)
             
-            # Get description of the dog head for head characteristics
-            dog_head_desc = None
-            try:
-                if os.path.exists(dog_path):
-                    print("[METHOD 1] Analyzing generated dog head image...")
-                    dog_head_desc = analyze_image_characteristics(dog_path)
-            except Exception as e:
-                print(f"[METHOD 1] Could not analyze dog head: {e}")
+            # The dog head was generated from the same analysis record, so the prompt can
+            # reference it directly instead of sending it to GPT-4 Vision
+            has_dog_head = os.path.exists(dog_path)
             
             if human_desc:
                 print("[METHOD 1] Using image analysis with DALL-E 3...")
-                
-                # Build prompt that references the dog head but creates a complete dog body
-                head_description = f" The dog's head should match the {breed} dog head characteristics from the generated dog head image" if dog_head_desc else f" The dog's head should be a {breed} dog head"
-                
-                prompt = f"""Photorealistic studio portrait of a complete {breed} dog with full body visible (all four legs, torso, tail, complete dog anatomy - NO human body visible).
-
-Dog:
-- Complete {breed} dog body with all four legs clearly visible
-- Full dog torso, chest, and body (no human body parts)
-- Dog head positioned in the same location and angle as the human head was in the original image
-- {head_description}
-- Dog's body positioned naturally - if the human was standing, the dog is standing on all four legs; if human was sitting, the dog is sitting naturally
-- Natural, realistic {breed} dog anatomy and proportions throughout the entire body
-- Dog's expression and gaze direction match the human's original expression from the original image
-- The human has completely disappeared - only the dog remains
-
-Background and Lighting:
-- Professional studio portrait background (can be different from original, but should be appropriate for a dog portrait)
-- Studio lighting appropriate for a dog portrait
-- Same camera angle and framing as the original image (portrait orientation)
-- The background can be different from the original image
-
-Style:
-- Ultra-realistic photography
-- Shallow depth of field
-- No illustration or cartoon
-- High detail, natural dog pose
-- Same camera angle and framing as original
-- 85mm lens
-- Realistic shadows
-- Professional studio portrait quality
-- The dog should look natural and complete, as if it was always a dog in this portrait"""
-                
+                prompt = build_full_dog_prompt(breed, has_dog_head)
                 result = generate_single_transformation_image(prompt, full_dog_path)
                 if result:
                     print("✓ [SUCCESS] Full dog image generated using Image Analysis + DALL-E 3")
             else:
                 # Fallback: simple prompt
                 print("[METHOD 2] Image analysis failed, using simple fallback prompt...")
-                prompt = f"""Photorealistic studio portrait of a complete {breed} dog with full body visible (all four legs, torso, tail - NO human body visible). The dog's head is positioned in the same location where a human head would be in a portrait photo. The dog has a complete, natural {breed} dog body - no human body parts. The human has completely disappeared. Professional studio portrait background (can be different from original). Natural, realistic {breed} dog anatomy throughout. Ultra-realistic photography style, shallow depth of field, high detail, professional studio portrait quality."""
+                prompt = build_full_dog_simple_prompt(breed)
                 result = generate_single_transformation_image(prompt, full_dog_path)
                 if result:
                     print("✓ [SUCCESS] Full dog image generated using Simple Fallback + DALL-E 3")
             results['full_dog'] = result
             if result:
                 print("✓ Thread 2: Full dog image completed successfully")
+                report_frame('full_dog', result)
             else:
                 errors['full_dog'] = "Failed to generate full dog image"
                 print("✗ Thread 2: Full dog image FAILED - all methods exhausted")
@@ -769,69 +1045,23 @@ Style:
             errors['full_dog'] = str(e)
             print(f"Thread 2: Error generating full dog image: {e}")
     
+    # Whether the final frame is a GPT-Image-1 edit of the upload (see generate_edited_frame)
+    final_outcome = {}
+    
     def generate_final_img():
         """Generate final image (100% transformation - dog head fully integrated on human body)"""
         try:
             print("=" * 60)
             print("Thread 3: Generating final image (100% transformation - dog head on human body)")
             print("=" * 60)
-            # Try GPT-Image-1 first
-            print("[METHOD 1] Attempting GPT-Image-1 (direct image editing)...")
-            result = edit_image_with_dog_head(image_path, dog_path, breed, final_path, transformation_level=1.0)
-            if result:
-                print("✓ [SUCCESS] Final image generated using GPT-Image-1")
-            else:
-                # Fall back to prompt-based generation using GPT-4 Vision
-                print("[METHOD 2] GPT-Image-1 failed, trying GPT-4 Vision prompt generation...")
-                prompt = create_composite_prompt_from_images(image_path, dog_path, breed, 1.0)
-                if prompt:
-                    print("[METHOD 2] Using GPT-4 Vision generated prompt with DALL-E 3...")
-                    result = generate_single_transformation_image(prompt, final_path)
-                    if result:
-                        print("✓ [SUCCESS] Final image generated using GPT-4 Vision + DALL-E 3")
-                else:
-                    # If GPT-4 Vision refused, use analyze_image_characteristics as fallback
-                    print("[METHOD 3] GPT-4 Vision refused, trying image analysis fallback...")
-                    image_desc = analyze_image_characteristics(image_path)
-                    if image_desc:
-                        print("[METHOD 3] Using image analysis with DALL-E 3...")
-                        prompt = f"""Photorealistic studio portrait.
-
-Subject:
-{image_desc}
-
-Body:
-- Human body with visible human shoulders, neck, and clothing
-- Posture and clothing remain completely human and unchanged
-
-Head:
-- Realistic {breed} dog head
-- Fully formed, expressive, and intelligent-looking
-- Detailed {breed} characteristics and natural fur texture
-- Natural neck anatomy
-- Fur lighting matched to studio light
-- Transition from dog head to human neck looks completely natural and anatomically correct
-
-Style:
-- Ultra-realistic photography
-- Shallow depth of field
-- No illustration or cartoon
-- High detail, seamless anatomical integration
-- 85mm lens
-- Realistic shadows"""
-                        result = generate_single_transformation_image(prompt, final_path)
-                        if result:
-                            print("✓ [SUCCESS] Final image generated using Image Analysis + DALL-E 3")
-                    else:
-                        # Final fallback: simple prompt without image analysis
-                        print("[METHOD 4] Image analysis failed, using simple fallback prompt...")
-                        prompt = f"""Photorealistic studio portrait of a {breed} dog head on a human body. The {breed} dog head is fully formed, expressive, and intelligent-looking with detailed {breed} characteristics and natural fur texture. The human body, clothing, pose, and background remain completely unchanged. Natural neck anatomy with seamless transition from dog head to human neck. Fur lighting matched to studio lighting. Ultra-realistic photography style, shallow depth of field, high detail, seamless anatomical integration."""
-                        result = generate_single_transformation_image(prompt, final_path)
-                        if result:
-                            print("✓ [SUCCESS] Final image generated using Simple Fallback + DALL-E 3")
+            result = generate_edited_frame(
+                image_path, dog_path, breed, final_path, 1.0, analysis,
+                build_final_analysis_prompt, build_final_simple_prompt, "Final image", final_outcome
+            )
             results['final'] = result
             if result:
                 print("✓ Thread 3: Final image completed successfully")
+                report_frame('final', result)
             else:
                 errors['final'] = "Failed to generate final image"
                 print("✗ Thread 3: Final image FAILED - all methods exhausted")
@@ -839,21 +1069,45 @@ Style:
             errors['final'] = str(e)
             print(f"Thread 3: Error generating final image: {e}")
     
+    def blend_trans1():
+        """Blend transition 1 from the upload and the final image (no API call)"""
+        if not results.get('final'):
+            results['trans1'] = None
+            errors['trans1'] = "Final image missing, cannot blend transition 1"
+            return
+        result = blend_transition_frame(image_path, results['final'], trans1_path, 0.3)
+        results['trans1'] = result
+        if result:
+            report_frame('trans1', result)
+        else:
+            errors['trans1'] = "Failed to blend transition 1"
+    
+    def generate_final_then_trans1():
+        generate_final_img()
+        if final_outcome.get('edited') or not results.get('final'):
+            blend_trans1()
+        else:
+            # A prompt-based final is a new composition; blending it with the upload would double-expose
+            print("Transition 1: Final image is not an edit of the upload, generating it with the API")
+            generate_trans1()
+    
+    if LOCAL_TRANSITIONS:
+        branches = [generate_full_dog, generate_final_then_trans1]
+    else:
+        branches = [generate_trans1, generate_full_dog, generate_final_img]
+    
     # Create threads for parallel generation
-    print("Starting parallel image generation with 3 threads...")
-    t1 = threading.Thread(target=generate_trans1)
-    t2 = threading.Thread(target=generate_full_dog)
-    t3 = threading.Thread(target=generate_final_img)
+    print(f"Starting parallel image generation with {len(branches)} threads...")
+    # Branch threads share this run's retry budget
+    threads = [threading.Thread(target=retry.run_in_context(branch)) for branch in branches]
     
     # Start all threads
-    t1.start()
-    t2.start()
-    t3.start()
+    for thread in threads:
+        thread.start()
     
     # Wait for all threads to complete
-    t1.join()
-    t2.join()
-    t3.join()
+    for thread in threads:
+        thread.join()
     
     print("All image generation threads completed")
     
@@ -0,0 +1,80 @@
+"""
+Password hashing in a bounded process pool.
+
+pbkdf2:sha256 is deliberately slow. Running it on request threads lets a
+burst of logins take all of a worker's CPU, so status polls and image
+requests on the same worker wait behind it. Hashes are computed in a small
+pool of separate processes instead, which scales with cores. At most
+PASSWORD_HASH_MAX_PENDING hashes may be queued or running per web process;
+beyond that callers are rejected immediately with PasswordHasherBusy
+rather than piling up.
+
+The pool is a spawn-context process pool (see process_pool).
+"""
+import os
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+import process_pool
+
+PASSWORD_HASH_POOL_ENABLED = os.environ.get('PASSWORD_HASH_POOL_ENABLED', '1') == '1'
+# Hashing processes per web process
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+# Hashes allowed to be queued or running at once before new requests are rejected
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 16))
+# Seconds to wait for a queued hash before giving up
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+
+HASH_METHOD = 'pbkdf2:sha256'
+
+class PasswordHasherBusy(Exception):
+    """The hashing pool is saturated; the caller should ask the user to retry shortly"""
+
+_pool = process_pool.SpawnPool(PASSWORD_HASH_WORKERS)
+_pending_lock = threading.Lock()
+_pending = 0
+
+def _release(_=None):
+    global _pending
+    with _pending_lock:
+        _pending -= 1
+
+def _run(fn, *args):
+    """Run fn(*args) in the pool, rejecting the call if too many are already pending"""
+    global _pending
+    if not PASSWORD_HASH_POOL_ENABLED:
+        return fn(*args)
+
+    with _pending_lock:
+        if _pending >= PASSWORD_HASH_MAX_PENDING:
+            raise PasswordHasherBusy(f"{_pending} password hashes already pending")
+        _pending += 1
+    try:
+        pool = _pool.get()
+        future = pool.submit(fn, *args)
+    except BaseException:
+        _release()
+        raise
+    # The slot is held until the hash is actually finished or cancelled, not until this
+    # caller stops waiting, so abandoned hashes still count against the limit
+    future.add_done_callback(_release)
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FutureTimeoutError:
+        # Drop the hash if it is still queued; one already running keeps its slot until it ends
+        future.cancel()
+        raise PasswordHasherBusy(f"Password hash not finished within {PASSWORD_HASH_TIMEOUT:.0f}s")
+    except BrokenProcessPool as e:
+        # A hashing process died; start a fresh pool next time and hash this one inline
+        print(f"Password hasher: Pool broken ({e}), hashing inline")
+        _pool.discard(pool)
+        return fn(*args)
+
+def hash_password(password):
+    """Hash a password for storage (raises PasswordHasherBusy when saturated)"""
+    return _run(generate_password_hash, password, HASH_METHOD)
+
+def check_password(password_hash, password):
+    """Check a password against a stored hash (raises PasswordHasherBusy when saturated)"""
+    return _run(check_password_hash, password_hash, password)
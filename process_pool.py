@@ -0,0 +1,44 @@
+"""
+Per-process worker pools for CPU-bound work (see password_hasher and image_pool).
+
+Each web process gets its own ProcessPoolExecutor, created on first use.
+Pools use the spawn start method because gunicorn workers are threaded and
+forking a threaded process can deadlock the child. Pools do not survive
+fork either, so a forked process always starts a new pool of its own.
+"""
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+class SpawnPool:
+    """A lazily created spawn-context ProcessPoolExecutor for the current process"""
+
+    def __init__(self, max_workers, initializer=None):
+        self.max_workers = max_workers
+        self.initializer = initializer
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """The pool of this process, started on first use"""
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=self.initializer
+                )
+                self._pid = os.getpid()
+            return self._pool
+
+    def discard(self, pool=None):
+        """Shut down a broken pool (the current one by default); the next get() starts a fresh one"""
+        with self._lock:
+            pool = pool or self._pool
+            if pool is None:
+                return
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
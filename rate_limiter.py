@@ -0,0 +1,85 @@
+"""
+Token-bucket rate limiting for OpenAI calls.
+
+Every job fans out into several threads, and several jobs run in each of the
+gunicorn workers, so without coordination the app easily exceeds the account's
+requests-per-minute limits and gets 429 storms. Each call type has its own
+bucket (chat/vision, image generation, image edit). Bucket state lives in the
+SQLite `rate_limits` table, so all threads and all worker processes on the
+host draw from the same budget. Callers wait for a token instead of failing.
+
+openai_client installs acquire()/acquire_async() as request hooks on the
+shared clients, so every API request (including SDK retries) is limited.
+"""
+import os
+import time
+import asyncio
+import database
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+# Requests per minute for each bucket
+RATE_LIMIT_CHAT_RPM = float(os.environ.get('RATE_LIMIT_CHAT_RPM', 500))
+RATE_LIMIT_IMAGE_RPM = float(os.environ.get('RATE_LIMIT_IMAGE_RPM', 50))
+RATE_LIMIT_EDIT_RPM = float(os.environ.get('RATE_LIMIT_EDIT_RPM', 50))
+# Bucket capacity, as seconds worth of tokens that can be spent in a burst
+RATE_LIMIT_BURST_SECONDS = float(os.environ.get('RATE_LIMIT_BURST_SECONDS', 10))
+
+BUCKETS = {
+    'chat': RATE_LIMIT_CHAT_RPM,
+    'image': RATE_LIMIT_IMAGE_RPM,
+    'edit': RATE_LIMIT_EDIT_RPM,
+}
+
+# Longest single sleep, so waiting callers re-check the shared bucket regularly
+MAX_SLEEP = 5.0
+
+def bucket_for(path):
+    """Map an API request path to its bucket, or None for unlimited endpoints"""
+    if path.endswith('/chat/completions'):
+        return 'chat'
+    if path.endswith('/images/generations'):
+        return 'image'
+    if path.endswith('/images/edits'):
+        return 'edit'
+    return None
+
+def _try_take(bucket):
+    """Seconds to wait before a token is available (0 means one was taken)"""
+    rate = BUCKETS[bucket] / 60.0
+    capacity = max(1.0, rate * RATE_LIMIT_BURST_SECONDS)
+    try:
+        return database.take_rate_limit_token(bucket, rate, capacity, time.time())
+    except Exception as e:
+        # Never fail an API call because the limiter's state is unavailable
+        print(f"Rate limiter: Could not take token for {bucket}, proceeding: {e}")
+        return 0
+
+def acquire(bucket):
+    """Block until a token is available in the bucket"""
+    if not RATE_LIMIT_ENABLED or bucket not in BUCKETS:
+        return
+    waited = 0.0
+    while True:
+        wait = _try_take(bucket)
+        if not wait:
+            break
+        sleep = min(wait, MAX_SLEEP)
+        time.sleep(sleep)
+        waited += sleep
+    if waited:
+        print(f"Rate limiter: Waited {waited:.1f}s for a {bucket} token")
+
+async def acquire_async(bucket):
+    """Coroutine version of acquire(); sleeps without blocking the event loop"""
+    if not RATE_LIMIT_ENABLED or bucket not in BUCKETS:
+        return
+    waited = 0.0
+    while True:
+        wait = await asyncio.to_thread(_try_take, bucket)
+        if not wait:
+            break
+        sleep = min(wait, MAX_SLEEP)
+        await asyncio.sleep(sleep)
+        waited += sleep
+    if waited:
+        print(f"Rate limiter: Waited {waited:.1f}s for a {bucket} token")
@@ -0,0 +1,133 @@
+"""
+Retries for OpenAI calls.
+
+Transient errors (429, 5xx, timeouts, dropped connections) are retried with
+exponential backoff and full jitter, honouring the server's Retry-After
+header. Fatal errors (bad request, auth, content policy, exhausted quota) are
+raised immediately so the caller can fall back. All retry waits of one
+pipeline run are charged against a shared time budget, so a long outage ends
+in the fallback chain instead of an unbounded wait.
+
+The SDK's own retries are disabled in openai_client so this is the only retry layer.
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+import openai
+
+# Attempts per call, including the first one
+RETRY_MAX_ATTEMPTS = int(os.environ.get('RETRY_MAX_ATTEMPTS', 4))
+# Backoff base and cap in seconds (delay = random(0, min(cap, base * 2^attempt)))
+RETRY_BASE_DELAY = float(os.environ.get('RETRY_BASE_DELAY', 1.0))
+RETRY_MAX_DELAY = float(os.environ.get('RETRY_MAX_DELAY', 30.0))
+# Total seconds one pipeline run may spend waiting between retries
+RETRY_BUDGET_SECONDS = float(os.environ.get('RETRY_BUDGET_SECONDS', 120))
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+class RetryBudget:
+    """Seconds of retry waiting left for one job, shared by all of its threads/tasks"""
+    def __init__(self, seconds):
+        self.remaining = seconds
+        self._lock = threading.Lock()
+
+    def take(self, seconds):
+        """Reserve seconds of waiting; returns False if the budget cannot cover it"""
+        with self._lock:
+            if seconds > self.remaining:
+                return False
+            self.remaining -= seconds
+            return True
+
+_budget = contextvars.ContextVar('retry_budget', default=None)
+
+@contextmanager
+def job_budget(seconds=None):
+    """Use one retry budget for every call made in this context (unless one is already active)"""
+    if _budget.get() is not None:
+        yield _budget.get()
+        return
+    token = _budget.set(RetryBudget(RETRY_BUDGET_SECONDS if seconds is None else seconds))
+    try:
+        yield _budget.get()
+    finally:
+        _budget.reset(token)
+
+def run_in_context(target):
+    """Wrap a thread target so it runs with the caller's retry budget"""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(target, *args, **kwargs)
+
+def is_retryable(error):
+    """Transient errors worth retrying; everything else is fatal"""
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    status = getattr(error, 'status_code', None)
+    if status == 429 and getattr(error, 'code', None) == 'insufficient_quota':
+        # Out of credits - waiting will not help
+        return False
+    return status in RETRYABLE_STATUS_CODES
+
+def retry_after(error):
+    """Seconds the server asked us to wait (Retry-After / retry-after-ms), or None"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+def _next_delay(error, attempt, label):
+    """Delay before the next attempt, or None to give up and re-raise"""
+    if not is_retryable(error) or attempt + 1 >= RETRY_MAX_ATTEMPTS:
+        return None
+    delay = retry_after(error)
+    if delay is None:
+        delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+    budget = _budget.get() or RetryBudget(RETRY_BUDGET_SECONDS)
+    if not budget.take(delay):
+        print(f"[Retry] {label}: retry budget exhausted, giving up after {type(error).__name__}")
+        return None
+    print(f"[Retry] {label}: {type(error).__name__} (attempt {attempt + 1}/{RETRY_MAX_ATTEMPTS}), retrying in {delay:.1f}s")
+    return delay
+
+def call(fn, *args, label="OpenAI", **kwargs):
+    """Call fn(*args, **kwargs), retrying transient errors"""
+    attempt = 0
+    while True:
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            delay = _next_delay(e, attempt, label)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+
+async def call_async(fn, *args, label="OpenAI", **kwargs):
+    """Coroutine version of call(): awaits fn(*args, **kwargs), retrying transient errors"""
+    attempt = 0
+    while True:
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            delay = _next_delay(e, attempt, label)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
@@ -127,33 +127,13 @@ document.addEventListener('DOMContentLoaded', function() {
         const imageCard = document.createElement('div');
         imageCard.className = 'image-card';
         
-        const breed = data.breed || 'Unknown';
-        
         // Display images in order 1->2->3->4 from left to right
-        let imageStagesHTML = `
-            <h4>Breed: ${breed}</h4>
-            <div class="image-stages">
-                <div class="image-stage">
-                    <label>1. Original</label>
-                    <img src="${images.original}" alt="Original">
-                </div>
-                <div class="image-stage">
-                    <label>2. Transition</label>
-                    <img src="${images.transition1}" alt="Transition">
-                </div>
-                <div class="image-stage">
-                    <label>3. Final</label>
-                    <img src="${images.final}" alt="Final">
-                </div>
-                <div class="image-stage">
-                    <label>4. Full Dog</label>
-                    <img src="${images.full_dog}" alt="Full Dog">
-                </div>
-            </div>
-            <p class="image-date">Just now</p>
-        `;
-        
-        imageCard.innerHTML = imageStagesHTML;
+        fillImageCard(imageCard, data.breed || 'Unknown', [
+            ['1. Original', images.original, 'Original'],
+            ['2. Transition', images.transition1, 'Transition'],
+            ['3. Final', images.final, 'Final'],
+            ['4. Full Dog', images.full_dog, 'Full Dog']
+        ], 'Just now');
         
         // If gallery doesn't exist (no images yet), create it
         if (!imageGallery) {
@@ -186,28 +166,12 @@ document.addEventListener('DOMContentLoaded', function() {
         const imageCard = document.createElement('div');
         imageCard.className = 'image-card';
         imageCard.setAttribute('data-image-id', imageId);
-        imageCard.innerHTML = `
-            <h4>Breed: ${breed}</h4>
-            <div class="image-stages">
-                <div class="image-stage">
-                    <label>1. Original</label>
-                    <img src="${originalUrl}" alt="Original">
-                </div>
-                <div class="image-stage">
-                    <label>2. Transition</label>
-                    <div style="padding: 2rem; text-align: center; color: #999;">Processing...</div>
-                </div>
-                <div class="image-stage">
-                    <label>3. Final</label>
-                    <div style="padding: 2rem; text-align: center; color: #999;">Processing...</div>
-                </div>
-                <div class="image-stage">
-                    <label>4. Full Dog</label>
-                    <div style="padding: 2rem; text-align: center; color: #999;">Processing...</div>
-                </div>
-            </div>
-            <p class="image-date">Just now - Processing...</p>
-        `;
+        fillImageCard(imageCard, breed || 'Detecting...', [
+            ['1. Original', originalUrl, 'Original'],
+            ['2. Transition', null, 'Transition'],
+            ['3. Final', null, 'Final'],
+            ['4. Full Dog', null, 'Full Dog']
+        ], 'Just now - Processing...');
         
         // Add to gallery
         if (!imageGallery) {
@@ -231,68 +195,258 @@ document.addEventListener('DOMContentLoaded', function() {
         // Scroll to new image
         imageCard.scrollIntoView({ behavior: 'smooth', block: 'nearest' });
         
-        // Poll every 3 seconds
-        let pollCount = 0;
-        const maxPolls = 60; // 3 minutes max (60 * 3 seconds)
+        // Follow status updates pushed by the server
+        watchStatus(imageId, breed);
+    }
+    
+    // Receive status updates from /events (Server-Sent Events), falling back to long-polling
+    function watchStatus(imageId, breed) {
+        const deadline = Date.now() + 3 * 60 * 1000; // 3 minutes max
+        let readyFrames = 0;
+        let progress = '';
+        let finished = false;
         
-        const pollInterval = setInterval(async () => {
-            pollCount++;
-            
-            try {
-                const response = await fetch(`/check-status/${imageId}`);
-                const statusData = await response.json();
-                
-                if (statusData.success && statusData.status === 'complete') {
-                    // All images ready - update the card
-                    clearInterval(pollInterval);
-                    updateImageCard(imageId, statusData.images, breed);
-                } else if (pollCount >= maxPolls) {
-                    // Timeout - stop polling
-                    clearInterval(pollInterval);
-                    const card = document.querySelector(`[data-image-id="${imageId}"]`);
-                    if (card) {
-                        const dateEl = card.querySelector('.image-date');
-                        if (dateEl) {
-                            dateEl.textContent = 'Processing timeout - please refresh the page';
-                            dateEl.style.color = '#e74c3c';
-                        }
+        // Apply one status payload; returns true once everything is done
+        function handleStatus(statusData) {
+            if (finished) return true;
+            // The breed arrives once the job's breed detection stage finishes
+            const breedChanged = statusData.success && statusData.breed && statusData.breed !== breed;
+            if (breedChanged) {
+                breed = statusData.breed;
+            }
+            if (statusData.progress) {
+                progress = statusData.progress;
+            }
+            if (statusData.success && statusData.status === 'complete') {
+                // All images ready - update the card
+                finished = true;
+                updateImageCard(imageId, statusData.images, breed);
+            } else if (statusData.success && statusData.status === 'failed') {
+                // Generation gave up - keep the frames that were made and show why
+                finished = true;
+                updateImageCard(imageId, statusData.images, breed);
+                showMessage(`Generation failed: ${statusData.error}`);
+            } else if (statusData.success && statusData.images && (breedChanged || countReady(statusData.images) > readyFrames)) {
+                // Some stages are done - show them while the rest are generated
+                readyFrames = countReady(statusData.images);
+                updateImageCard(imageId, statusData.images, breed, false);
+            }
+            if (!finished && Date.now() >= deadline) {
+                finished = true;
+                showTimeout();
+            }
+            return finished;
+        }
+        
+        function showMessage(text) {
+            const card = document.querySelector(`[data-image-id="${imageId}"]`);
+            if (card) {
+                const dateEl = card.querySelector('.image-date');
+                if (dateEl) {
+                    dateEl.textContent = text;
+                    dateEl.style.color = '#e74c3c';
+                }
+            }
+        }
+        
+        function showTimeout() {
+            showMessage('Processing timeout - please refresh the page');
+        }
+        
+        // The server is holding as many waiting requests as it allows - poll /check-status instead
+        async function pollStatus(intervalSeconds) {
+            while (!finished) {
+                await new Promise(resolve => setTimeout(resolve, intervalSeconds * 1000));
+                try {
+                    const response = await fetch(`/check-status/${imageId}`);
+                    const statusData = await response.json();
+                    if (!response.ok) {
+                        finished = true;
+                        break;
+                    }
+                    handleStatus(statusData);
+                } catch (error) {
+                    console.error('Polling error:', error);
+                    if (Date.now() >= deadline) {
+                        finished = true;
+                        showTimeout();
                     }
                 }
-            } catch (error) {
-                console.error('Polling error:', error);
-                if (pollCount >= maxPolls) {
-                    clearInterval(pollInterval);
+            }
+        }
+        
+        async function longPoll() {
+            while (!finished) {
+                try {
+                    const response = await fetch(`/events/${imageId}?poll=1&since=${encodeURIComponent(progress)}`);
+                    const statusData = await response.json();
+                    if (!response.ok) {
+                        finished = true;
+                        break;
+                    }
+                    handleStatus(statusData);
+                    if (!finished && statusData.poll_interval) {
+                        pollStatus(statusData.poll_interval);
+                        return;
+                    }
+                } catch (error) {
+                    console.error('Polling error:', error);
+                    if (Date.now() >= deadline) {
+                        finished = true;
+                        showTimeout();
+                        break;
+                    }
+                    // Back off briefly before retrying after a network error
+                    await new Promise(resolve => setTimeout(resolve, 3000));
                 }
             }
-        }, 3000); // Poll every 3 seconds
+        }
+        
+        if (!window.EventSource) {
+            longPoll();
+            return;
+        }
+        
+        const source = new EventSource(`/events/${imageId}`);
+        let received = false;
+        source.onmessage = (event) => {
+            received = true;
+            const statusData = JSON.parse(event.data);
+            if (handleStatus(statusData)) {
+                source.close();
+            } else if (statusData.poll_interval) {
+                source.close();
+                pollStatus(statusData.poll_interval);
+            }
+        };
+        source.onerror = () => {
+            if (finished) {
+                source.close();
+            } else if (!received || source.readyState === EventSource.CLOSED) {
+                // Streaming is not getting through (e.g. a buffering proxy) - long-poll instead
+                source.close();
+                longPoll();
+            } else if (Date.now() >= deadline) {
+                finished = true;
+                source.close();
+                showTimeout();
+            }
+            // Otherwise the stream ended normally and EventSource reconnects by itself
+        };
+    }
+    
+    // Infinite scroll: load older image sets from /gallery when the "Load more" block comes into view
+    const galleryMore = document.getElementById('gallery-more');
+    if (galleryMore && imageGallery) {
+        const loadMoreButton = galleryMore.querySelector('button');
+        let loadingPage = false;
+        
+        async function loadNextPage() {
+            const cursor = galleryMore.dataset.nextCursor;
+            if (loadingPage || !cursor) return;
+            loadingPage = true;
+            loadMoreButton.disabled = true;
+            try {
+                const response = await fetch(`/gallery?before=${encodeURIComponent(cursor)}`);
+                const page = await response.json();
+                if (!response.ok || !page.success) {
+                    throw new Error(page.error || 'Could not load more images');
+                }
+                page.images.forEach(image => imageGallery.appendChild(renderGalleryCard(image)));
+                if (page.next_cursor) {
+                    galleryMore.dataset.nextCursor = page.next_cursor;
+                } else {
+                    // Reached the oldest image set
+                    galleryMore.remove();
+                    if (observer) observer.disconnect();
+                }
+            } catch (error) {
+                console.error('Gallery error:', error);
+            } finally {
+                loadingPage = false;
+                loadMoreButton.disabled = false;
+            }
+        }
+        
+        const observer = window.IntersectionObserver
+            ? new IntersectionObserver(entries => {
+                if (entries.some(entry => entry.isIntersecting)) loadNextPage();
+            }, { rootMargin: '400px' })
+            : null;
+        if (observer) observer.observe(galleryMore);
+        loadMoreButton.addEventListener('click', loadNextPage);
     }
     
-    function updateImageCard(imageId, images, breed) {
+    function renderGalleryCard(image) {
+        // Same layout as the server-rendered cards in dashboard.html: only frames that exist are shown
+        const imageCard = document.createElement('div');
+        imageCard.className = 'image-card';
+        const stages = [
+            ['1. Original', image.images.original, 'Original'],
+            ['2. Transition', image.images.transition1, 'Transition'],
+            ['3. Final', image.images.final, 'Final'],
+            ['4. Full Dog', image.images.full_dog, 'Full Dog'],
+            ['5. Animation', image.images.animation, 'Animation']
+        ].filter(([, url]) => url);
+        fillImageCard(imageCard, image.breed || 'Unknown', stages, image.created_at);
+        return imageCard;
+    }
+    
+    function countReady(images) {
+        return ['transition1', 'final', 'full_dog'].filter(key => images[key]).length;
+    }
+    
+    // Cards are built with DOM APIs, never innerHTML: the breed comes from the model and
+    // must not be interpreted as markup (the server-rendered cards get this from Jinja)
+    function fillImageCard(imageCard, breed, stages, dateText) {
+        const heading = document.createElement('h4');
+        heading.textContent = `Breed: ${breed}`;
+        const stagesEl = document.createElement('div');
+        stagesEl.className = 'image-stages';
+        stages.forEach(([label, url, alt]) => stagesEl.appendChild(renderStage(label, url, alt)));
+        const date = document.createElement('p');
+        date.className = 'image-date';
+        date.textContent = dateText;
+        imageCard.replaceChildren(heading, stagesEl, date);
+    }
+    
+    function renderStage(label, url, alt) {
+        const stage = document.createElement('div');
+        stage.className = 'image-stage';
+        const labelEl = document.createElement('label');
+        labelEl.textContent = label;
+        stage.appendChild(labelEl);
+        if (url) {
+            const img = document.createElement('img');
+            img.src = url;
+            img.alt = alt;
+            stage.appendChild(img);
+        } else {
+            const placeholder = document.createElement('div');
+            placeholder.style.cssText = 'padding: 2rem; text-align: center; color: #999;';
+            placeholder.textContent = 'Processing...';
+            stage.appendChild(placeholder);
+        }
+        return stage;
+    }
+    
+    function updateImageCard(imageId, images, breed, complete = true) {
         const imageCard = document.querySelector(`[data-image-id="${imageId}"]`);
         if (!imageCard) return;
         
-        imageCard.innerHTML = `
-            <h4>Breed: ${breed}</h4>
-            <div class="image-stages">
-                <div class="image-stage">
-                    <label>1. Original</label>
-                    <img src="${images.original}" alt="Original">
-                </div>
-                <div class="image-stage">
-                    <label>2. Transition</label>
-                    <img src="${images.transition1}" alt="Transition">
-                </div>
-                <div class="image-stage">
-                    <label>3. Final</label>
-                    <img src="${images.final}" alt="Final">
-                </div>
-                <div class="image-stage">
-                    <label>4. Full Dog</label>
-                    <img src="${images.full_dog}" alt="Full Dog">
-                </div>
-            </div>
-            <p class="image-date">Just now</p>
-        `;
+        // Frames that are not ready yet keep their "Processing..." placeholder
+        const stages = [
+            ['1. Original', images.original, 'Original'],
+            ['2. Transition', images.transition1, 'Transition'],
+            ['3. Final', images.final, 'Final'],
+            ['4. Full Dog', images.full_dog, 'Full Dog']
+        ];
+        if (images.animation) {
+            stages.push(['5. Animation', images.animation, 'Animation']);
+        }
+        fillImageCard(imageCard, breed || 'Detecting...', stages, complete ? 'Just now' : 'Just now - Processing...');
+        
+        if (!complete) return;
         
         // Hide loading spinner now that images are ready
         const loadingSpinner = document.getElementById('loading-spinner');
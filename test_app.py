@@ -88,6 +88,37 @@ def test_database():
         print(f"[FAIL] Image set saving failed: {e}")
         return False
     
+    # Test progressive frame updates
+    try:
+        database.update_image_frame(image_id, 'final', "test_final_early.png")
+        image_data = database.get_image_by_id(image_id)
+        if image_data['final_dog_image'] == "test_final_early.png" and image_data['transition1_image'] == "test_trans1.png":
+            print("[OK] Single frame recorded")
+        else:
+            print("[FAIL] Single frame update failed")
+            return False
+    except Exception as e:
+        print(f"[FAIL] Single frame update failed: {e}")
+        return False
+    
+    # Test stored generation status
+    try:
+        status_id = database.save_image_set(user_id, "test_status.jpg", None, None, None, None)
+        queued = database.get_image_status(status_id, user_id)
+        database.set_image_status(status_id, 'generating')
+        generating = database.get_image_by_id(status_id)
+        database.update_image_set(status_id, "t1.png", "f.png", "d.png")
+        complete = database.get_image_status(status_id, user_id)
+        if (queued['status'] == 'queued' and generating['status'] == 'generating' and generating['started_at']
+                and complete['status'] == 'complete' and database.get_image_status(status_id, user_id + 1) is None):
+            print("[OK] Image status recorded and read back per user")
+        else:
+            print("[FAIL] Image status not recorded correctly")
+            return False
+    except Exception as e:
+        print(f"[FAIL] Image status test failed: {e}")
+        return False
+    
     # Test get user images
     try:
         images = database.get_user_images(user_id)
@@ -100,9 +131,839 @@ def test_database():
         print(f"[FAIL] Get user images failed: {e}")
         return False
     
+    # Test keyset pagination (pages follow each other without gaps or repeats)
+    try:
+        first_page = database.get_user_images(user_id, 1)
+        second_page = database.get_user_images(user_id, 1, first_page[0]['id'])
+        if [image['id'] for image in first_page + second_page] == [image['id'] for image in images[:2]]:
+            print("[OK] Image pages follow each other")
+        else:
+            print("[FAIL] Image pages out of order")
+            return False
+    except Exception as e:
+        print(f"[FAIL] Image pagination failed: {e}")
+        return False
+    
     print("\n[OK] All database tests passed!")
     return True
 
+def test_job_queue():
+    """Test durable job queue operations (uses a throwaway database file)"""
+    print("Testing job queue...")
+    
+    from concurrent.futures import Future
+    import events
+    import job_queue
+    
+    original_database = database.DATABASE
+    database.DATABASE = "test_jobs_" + str(os.getpid()) + ".db"
+    try:
+        database.init_db()
+        for _ in range(2):
+            database.save_image_set(1, "test_original.jpg", None, None, None, None)
+        first_id = database.enqueue_job(1, 1, "uploads/test_original.jpg", "test_1")
+        second_id = database.enqueue_job(2, 1, "uploads/test_original.jpg", "test_2")
+        print(f"[OK] Jobs enqueued with IDs: {first_id}, {second_id}")
+        
+        # Jobs are claimed in FIFO order and never twice
+        job = database.claim_next_job("test-worker")
+        if job and job['id'] == first_id and job['status'] == 'running':
+            print("[OK] Oldest job claimed first")
+        else:
+            print("[FAIL] Job claim order is wrong")
+            return False
+        
+        # A released job goes back on the queue and can be claimed again
+        database.release_jobs(["test-worker"])
+        job = database.claim_next_job("test-worker-2")
+        if job and job['id'] == first_id:
+            print("[OK] Released job reclaimed")
+        else:
+            print("[FAIL] Released job was not reclaimed")
+            return False
+        
+        database.complete_job(first_id)
+        job = database.claim_next_job("test-worker-2")
+        database.fail_job(job['id'], "test failure")
+        if database.claim_next_job("test-worker-2") is None:
+            print("[OK] Queue drained")
+        else:
+            print("[FAIL] Finished jobs were claimed again")
+            return False
+        
+        failed = database.get_image_status(2, 1)
+        if failed['status'] == 'failed' and failed['error'] == "test failure":
+            print("[OK] Failed job recorded on its image set")
+        else:
+            print("[FAIL] Failed job not recorded on its image set")
+            return False
+        
+        # A renewed lease keeps a long-running job; an expired one puts it back on the queue
+        database.save_image_set(1, "test_original.jpg", None, None, None, None)
+        lease_job_id = database.enqueue_job(3, 1, "uploads/test_original.jpg", "test_3")
+        database.claim_next_job("test-worker-3")
+        backdate = "UPDATE jobs SET claimed_at = datetime('now', '-1 hour') WHERE id = ?"
+        conn = database.get_db_connection()
+        conn.execute(backdate, (lease_job_id,))
+        conn.commit()
+        database.renew_job_leases(["test-worker-3"])
+        kept = database.requeue_stale_jobs(60, 5) == 0
+        conn.execute(backdate, (lease_job_id,))
+        conn.commit()
+        requeued = database.requeue_stale_jobs(60, 5) == 1
+        if kept and requeued:
+            print("[OK] Renewed lease kept, expired lease requeued")
+        else:
+            print("[FAIL] Lease renewal not honoured")
+            return False
+        database.fail_job(database.claim_next_job("test-worker-3")['id'], "lease test done")
+        
+        # A handler that hands the job off returns a future; the job finishes with it
+        database.save_image_set(1, "test_original.jpg", None, None, None, None)
+        database.enqueue_job(4, 1, "uploads/test_original.jpg", "test_4")
+        job = database.claim_next_job("test-worker-4")
+        handed_off = Future()
+        job_queue._in_flight.acquire()
+        job_queue._run_job(job, lambda job: handed_off)
+        running = database.claim_next_job("test-worker-4") is None and database.get_image_status(4, 1)['status'] != 'failed'
+        seen = events.version(4)
+        handed_off.set_exception(RuntimeError("async failure"))
+        failed = database.get_image_status(4, 1)
+        if running and failed['status'] == 'failed' and failed['error'] == "async failure" and events.version(4) > seen:
+            print("[OK] Handed-off job finished from its future, failure published")
+        else:
+            print("[FAIL] Handed-off job not finished from its future")
+            return False
+    except Exception as e:
+        print(f"[FAIL] Job queue test failed: {e}")
+        return False
+    finally:
+        database.close_connection()
+        if os.path.exists(database.DATABASE):
+            os.remove(database.DATABASE)
+        database.DATABASE = original_database
+    
+    print("\n[OK] All job queue tests passed!")
+    return True
+
+def test_user_cache():
+    """Test the user record cache and its invalidation (uses a throwaway database file)"""
+    print("Testing user cache...")
+    
+    import user_cache
+    
+    original_database = database.DATABASE
+    database.DATABASE = "test_user_cache_" + str(os.getpid()) + ".db"
+    try:
+        database.init_db()
+        user_cache.clear()
+        user_id = database.create_user("cached_user", "password123")
+        if user_cache.get(str(user_id))['username'] == "cached_user" and user_cache.get("not-an-id") is None:
+            print("[OK] User loaded through the cache")
+        else:
+            print("[FAIL] User not loaded through the cache")
+            return False
+        
+        # Change the record behind the cache's back: served from cache until invalidated
+        conn = database.get_db_connection()
+        conn.execute('UPDATE users SET username = ? WHERE id = ?', ("renamed_user", user_id))
+        conn.commit()
+        stale = user_cache.get(user_id)['username']
+        user_cache.invalidate(user_id)
+        fresh = user_cache.get(user_id)['username']
+        if stale == "cached_user" and fresh == "renamed_user":
+            print("[OK] Cached record served until invalidated")
+        else:
+            print(f"[FAIL] Unexpected cache behaviour ({stale}, {fresh})")
+            return False
+    except Exception as e:
+        print(f"[FAIL] User cache test failed: {e}")
+        return False
+    finally:
+        user_cache.clear()
+        database.close_connection()
+        if os.path.exists(database.DATABASE):
+            os.remove(database.DATABASE)
+        database.DATABASE = original_database
+    
+    print("\n[OK] All user cache tests passed!")
+    return True
+
+def test_password_hasher():
+    """Test password hashing in the process pool and fast rejection when it is saturated"""
+    print("Testing password hasher...")
+    
+    import time
+    import password_hasher
+    
+    original_max_pending = password_hasher.PASSWORD_HASH_MAX_PENDING
+    original_timeout = password_hasher.PASSWORD_HASH_TIMEOUT
+    try:
+        password_hash = password_hasher.hash_password("secret123")
+        if password_hasher.check_password(password_hash, "secret123") and not password_hasher.check_password(password_hash, "wrong"):
+            print("[OK] Password hashed and checked in the pool")
+        else:
+            print("[FAIL] Password check gave the wrong answer")
+            return False
+        
+        password_hasher.PASSWORD_HASH_MAX_PENDING = 0
+        try:
+            password_hasher.check_password(password_hash, "secret123")
+            print("[FAIL] Saturated pool accepted more work")
+            return False
+        except password_hasher.PasswordHasherBusy:
+            print("[OK] Saturated pool rejects immediately")
+        password_hasher.PASSWORD_HASH_MAX_PENDING = original_max_pending
+        
+        # A hash the caller gave up on keeps its slot until the pool is done with it
+        password_hasher.PASSWORD_HASH_TIMEOUT = 0
+        try:
+            password_hasher.hash_password("secret123")
+        except password_hasher.PasswordHasherBusy:
+            pass
+        deadline = time.time() + 10
+        while password_hasher._pending and time.time() < deadline:
+            time.sleep(0.05)
+        if password_hasher._pending == 0:
+            print("[OK] Timed out hash releases its slot once done")
+        else:
+            print(f"[FAIL] {password_hasher._pending} hash slots still held")
+            return False
+    except Exception as e:
+        print(f"[FAIL] Password hasher test failed: {e}")
+        return False
+    finally:
+        password_hasher.PASSWORD_HASH_MAX_PENDING = original_max_pending
+        password_hasher.PASSWORD_HASH_TIMEOUT = original_timeout
+    
+    print("\n[OK] All password hasher tests passed!")
+    return True
+
+def test_breed_cache():
+    """Test perceptual-hash breed cache (uses a throwaway database file)"""
+    print("Testing breed cache...")
+    
+    from PIL import Image, ImageDraw
+    import breed_cache
+    
+    original_database = database.DATABASE
+    database.DATABASE = "test_breed_cache_" + str(os.getpid()) + ".db"
+    photo_path = "test_photo_" + str(os.getpid()) + ".png"
+    resized_path = "test_photo_" + str(os.getpid()) + "_small.jpg"
+    try:
+        database.init_db()
+        
+        # The same photo re-encoded at a smaller size should hash (nearly) identically
+        img = Image.new('RGB', (400, 400), (240, 240, 240))
+        ImageDraw.Draw(img).ellipse([100, 60, 300, 300], fill=(120, 80, 40))
+        img.save(photo_path)
+        img.resize((200, 200)).save(resized_path, 'JPEG', quality=80)
+        
+        photo_hash = breed_cache.image_hash(photo_path)
+        resized_hash = breed_cache.image_hash(resized_path)
+        if breed_cache.hamming_distance(photo_hash, resized_hash) <= breed_cache.BREED_CACHE_MAX_DISTANCE:
+            print("[OK] Re-encoded photo hashes to a nearby value")
+        else:
+            print("[FAIL] Re-encoded photo hash is too far away")
+            return False
+        
+        breed_cache.put(photo_hash, {"breed": "Beagle", "subject": "smiling adult", "fallback": False})
+        cached = breed_cache.get(resized_hash)
+        if cached and cached["breed"] == "Beagle" and cached["subject"] == "smiling adult":
+            print("[OK] Cached analysis returned for re-upload")
+        else:
+            print("[FAIL] Cached analysis not returned")
+            return False
+        
+        near_hash = f"{int(photo_hash, 16) ^ 1:016x}"
+        cached = breed_cache.get(near_hash)
+        if cached and cached["breed"] == "Beagle" and cached["fallback"] and "subject" not in cached:
+            print("[OK] Near-identical hash reuses only the breed")
+        else:
+            print("[FAIL] Near-identical hash missed")
+            return False
+        
+        inverted_hash = f"{int(photo_hash, 16) ^ 0xffffffffffffffff:016x}"
+        if breed_cache.get(inverted_hash) is None:
+            print("[OK] Unrelated hash is a cache miss")
+        else:
+            print("[FAIL] Unrelated hash hit the cache")
+            return False
+    except Exception as e:
+        print(f"[FAIL] Breed cache test failed: {e}")
+        return False
+    finally:
+        database.close_connection()
+        for path in (database.DATABASE, photo_path, resized_path):
+            if os.path.exists(path):
+                os.remove(path)
+        database.DATABASE = original_database
+    
+    print("\n[OK] All breed cache tests passed!")
+    return True
+
+def test_generation_cache():
+    """Test caching and reusing generated frames (uses a throwaway database and directory)"""
+    print("Testing generation cache...")
+    
+    import shutil
+    import tempfile
+    from PIL import Image
+    import generation_cache
+    
+    original_database = database.DATABASE
+    original_dir = generation_cache.GENERATION_CACHE_DIR
+    original_max_bytes = generation_cache.GENERATION_CACHE_MAX_BYTES
+    work_dir = tempfile.mkdtemp()
+    database.DATABASE = os.path.join(work_dir, "test_generation_cache.db")
+    generation_cache.GENERATION_CACHE_DIR = os.path.join(work_dir, "cache")
+    try:
+        database.init_db()
+        photo_path = os.path.join(work_dir, "photo.png")
+        Image.new('RGB', (64, 64), (200, 100, 50)).save(photo_path)
+        frames = {}
+        for stage in generation_cache.STAGES:
+            frames[stage] = os.path.join(work_dir, f"generated_{stage}.png")
+            with open(frames[stage], 'wb') as f:
+                f.write(stage.encode() * 100)
+        
+        digest = generation_cache.image_digest(photo_path)
+        outputs = {stage: os.path.join(work_dir, f"job_{stage}.png") for stage in generation_cache.STAGES}
+        if generation_cache.restore(digest, "Beagle", outputs):
+            print("[FAIL] Empty cache reported a hit")
+            return False
+        
+        generation_cache.store(digest, "Beagle", frames)
+        restored = generation_cache.restore(digest, " beagle ", outputs)
+        with open(outputs['final'], 'rb') as f:
+            content = f.read()
+        if restored and content == b"final" * 100 and not generation_cache.restore(digest, "Poodle", outputs):
+            print("[OK] Frames restored for the same photo and breed only")
+        else:
+            print("[FAIL] Cached frames not restored correctly")
+            return False
+        
+        # A cache with room for one set keeps only the most recently stored one
+        generation_cache.GENERATION_CACHE_MAX_BYTES = sum(os.path.getsize(path) for path in frames.values())
+        generation_cache.store(digest, "Poodle", frames)
+        if generation_cache.restore(digest, "Beagle", outputs) or not generation_cache.restore(digest, "Poodle", outputs):
+            print("[FAIL] Size limit not enforced")
+            return False
+        print("[OK] Least recently used frames evicted beyond the size limit")
+    except Exception as e:
+        print(f"[FAIL] Generation cache test failed: {e}")
+        return False
+    finally:
+        database.close_connection()
+        database.DATABASE = original_database
+        generation_cache.GENERATION_CACHE_DIR = original_dir
+        generation_cache.GENERATION_CACHE_MAX_BYTES = original_max_bytes
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n[OK] All generation cache tests passed!")
+    return True
+
+def test_dog_head_library():
+    """Test style buckets and dog head lookups in the per-breed library"""
+    print("Testing dog head library...")
+    
+    import shutil
+    import tempfile
+    import dog_head_library
+    
+    original_enabled = dog_head_library.DOG_HEAD_LIBRARY_ENABLED
+    original_dir = dog_head_library.DOG_HEAD_LIBRARY_DIR
+    work_dir = tempfile.mkdtemp()
+    dog_head_library.DOG_HEAD_LIBRARY_ENABLED = True
+    dog_head_library.DOG_HEAD_LIBRARY_DIR = os.path.join(work_dir, "library")
+    try:
+        smiling = {'lighting': 'Bright daylight', 'subject': {'expression': 'big smile'}}
+        bucket = dog_head_library.style_bucket(smiling)
+        if bucket == 'bright-smiling' and dog_head_library.style_bucket({}) == dog_head_library.DEFAULT_BUCKET:
+            print(f"[OK] Analysis mapped to style bucket {bucket}")
+        else:
+            print(f"[FAIL] Unexpected style bucket: {bucket}")
+            return False
+        
+        output_path = os.path.join(work_dir, "dog_head.png")
+        if dog_head_library.fetch("Beagle", smiling, output_path) is not None:
+            print("[FAIL] Empty library reported a hit")
+            return False
+        
+        for name in (dog_head_library.DEFAULT_BUCKET, 'bright-smiling'):
+            path = dog_head_library.asset_path("Beagle", name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(name.encode())
+        dog_head_library.fetch(" beagle", smiling, output_path)
+        with open(output_path, 'rb') as f:
+            exact = f.read()
+        dog_head_library.fetch("Beagle", {'mood': 'moody'}, output_path)
+        with open(output_path, 'rb') as f:
+            fallback = f.read()
+        if exact == b'bright-smiling' and fallback == dog_head_library.DEFAULT_BUCKET.encode():
+            print("[OK] Bucket asset used, default bucket as fallback")
+        else:
+            print("[FAIL] Library assets not fetched correctly")
+            return False
+    except Exception as e:
+        print(f"[FAIL] Dog head library test failed: {e}")
+        return False
+    finally:
+        dog_head_library.DOG_HEAD_LIBRARY_ENABLED = original_enabled
+        dog_head_library.DOG_HEAD_LIBRARY_DIR = original_dir
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n[OK] All dog head library tests passed!")
+    return True
+
+def test_face_blend():
+    """Test blending several dog/human levels in one pass"""
+    print("Testing face blending...")
+    
+    import shutil
+    import tempfile
+    from PIL import Image
+    import face_blend
+    
+    work_dir = tempfile.mkdtemp()
+    try:
+        human_path = os.path.join(work_dir, "human.png")
+        dog_path = os.path.join(work_dir, "dog.png")
+        Image.new('RGB', (200, 200), (0, 0, 0)).save(human_path)
+        Image.new('RGB', (100, 100), (200, 100, 50)).save(dog_path)
+        
+        frames = face_blend.blend_levels(dog_path, human_path, [0.0, 0.5, 1.0])
+        center = [frame.getpixel((100, 60))[:3] for frame in frames]
+        corner = frames[2].getpixel((2, 198))[:3]
+        if len(frames) == 3 and center == [(0, 0, 0), (100, 50, 25), (200, 100, 50)] and corner == (0, 0, 0):
+            print("[OK] Face region blended at every level, background kept")
+        else:
+            print(f"[FAIL] Unexpected blend: {center} {corner}")
+            return False
+        
+        # A square dog image on a wide photo is cropped, not stretched: its green top band is cut off
+        wide_path = os.path.join(work_dir, "wide.png")
+        banded_path = os.path.join(work_dir, "banded.png")
+        Image.new('RGB', (200, 100), (0, 0, 0)).save(wide_path)
+        banded = Image.new('RGB', (100, 100), (255, 0, 0))
+        banded.paste((0, 255, 0), (0, 0, 100, 25))
+        banded.save(banded_path)
+        red, green = face_blend.blend_levels(banded_path, wide_path, [1.0])[0].getpixel((100, 20))[:2]
+        if red > 0 and green == 0:
+            print("[OK] Dog image fitted to the photo's aspect ratio")
+        else:
+            print(f"[FAIL] Dog image stretched: {(red, green)}")
+            return False
+        
+        outputs = [(0.3, os.path.join(work_dir, "t1.png")), (0.7, os.path.join(work_dir, "t2.jpg"))]
+        paths = face_blend.blend_to_files(dog_path, human_path, outputs)
+        if paths == [path for _, path in outputs] and all(os.path.exists(path) for path in paths):
+            print("[OK] Blended levels saved")
+        else:
+            print("[FAIL] Blended levels not saved")
+            return False
+        
+        import openai_generator
+        transition_path = os.path.join(work_dir, "transition1.png")
+        result = openai_generator.blend_transition_frame(human_path, dog_path, transition_path, 0.3)
+        with Image.open(transition_path) as img:
+            pixel = img.getpixel((100, 60))[:3]
+        if result == transition_path and pixel == (60, 30, 15):
+            print("[OK] Transition frame blended locally from the upload and final image")
+        else:
+            print(f"[FAIL] Unexpected local transition: {result} {pixel}")
+            return False
+    except Exception as e:
+        print(f"[FAIL] Face blend test failed: {e}")
+        return False
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n[OK] All face blend tests passed!")
+    return True
+
+def test_morph_sequence():
+    """Test rendering and caching the morph animation of an image set"""
+    print("Testing morph sequence...")
+    
+    import shutil
+    import tempfile
+    from PIL import Image
+    import image_pool
+    import morph_sequence
+    
+    original_frames = morph_sequence.MORPH_FRAMES
+    original_pool_enabled = image_pool.IMAGE_POOL_ENABLED
+    morph_sequence.MORPH_FRAMES = 10
+    work_dir = tempfile.mkdtemp()
+    try:
+        keyframes = []
+        for name, color in (("original", (0, 0, 0)), ("trans1", (60, 60, 60)), ("final", (120, 120, 120)), ("full_dog", (240, 240, 240))):
+            path = os.path.join(work_dir, f"{name}.png")
+            Image.new('RGB', (64, 48), color).save(path)
+            keyframes.append(path)
+        
+        positions = morph_sequence.positions(morph_sequence.MORPH_FRAMES, len(keyframes))
+        frames = morph_sequence.render_batch(morph_sequence.decode_keyframes(keyframes, (64, 48)), positions)
+        levels = [int(frame[0, 0, 0]) for frame in frames]
+        if frames.shape == (10, 48, 64, 3) and levels[0] == 0 and levels[-1] == 240 and levels == sorted(levels):
+            print(f"[OK] Frames interpolated through the keyframes: {levels}")
+        else:
+            print(f"[FAIL] Unexpected frames: {frames.shape} {levels}")
+            return False
+        
+        output_path = morph_sequence.morph_path_for(os.path.join(work_dir, "set"))
+        result = morph_sequence.create(*keyframes, output_path)
+        with Image.open(output_path) as img:
+            animated = img.n_frames == 10 and img.size == (64, 48) and img.info.get('loop') == 0
+            img.seek(img.n_frames - 1)
+            animated = animated and img.convert('RGB').getpixel((0, 0)) == (240, 240, 240)
+        built = os.path.getmtime(output_path)
+        if result == output_path and animated and morph_sequence.create(*keyframes, output_path) and os.path.getmtime(output_path) == built:
+            print("[OK] Animation encoded and reused for the same set")
+        else:
+            print("[FAIL] Animation not encoded or not reused")
+            return False
+        
+        # Rendered on this thread (pool disabled), the keyframes are not put in the process-wide cache
+        image_pool.IMAGE_POOL_ENABLED = False
+        inline_path = morph_sequence.morph_path_for(os.path.join(work_dir, "inline"))
+        if morph_sequence.create(*keyframes, inline_path) == inline_path and morph_sequence._keyframes[0] is None:
+            print("[OK] Inline rendering keeps its keyframes to itself")
+        else:
+            print("[FAIL] Inline rendering used the shared keyframe cache")
+            return False
+    except Exception as e:
+        print(f"[FAIL] Morph sequence test failed: {e}")
+        return False
+    finally:
+        morph_sequence.MORPH_FRAMES = original_frames
+        image_pool.IMAGE_POOL_ENABLED = original_pool_enabled
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n[OK] All morph sequence tests passed!")
+    return True
+
+def test_image_pool():
+    """Test running tasks in the image process pool and passing arrays through shared memory"""
+    print("Testing image pool...")
+    
+    import numpy as np
+    import image_pool
+    
+    try:
+        if image_pool.run(max, 3, 5) == 5:
+            print("[OK] Task ran in the image pool")
+        else:
+            print("[FAIL] Wrong result from the image pool")
+            return False
+        
+        values = np.arange(24, dtype=np.uint8).reshape(2, 3, 4)
+        with image_pool.shared_array(values.shape) as handle:
+            image_pool.run(image_pool.write_shared, handle, values)
+            shared = image_pool.read_shared(handle)
+        if np.array_equal(shared, values):
+            print("[OK] Array written by a pool process read back through shared memory")
+        else:
+            print("[FAIL] Shared array content differs")
+            return False
+    except Exception as e:
+        print(f"[FAIL] Image pool test failed: {e}")
+        return False
+    
+    print("\n[OK] All image pool tests passed!")
+    return True
+
+def test_image_prep():
+    """Test normalization and downscaling of API payloads"""
+    print("Testing image preprocessing...")
+    
+    from PIL import Image
+    import image_prep
+    
+    photo_path = "test_large_" + str(os.getpid()) + ".png"
+    prepared_path = image_prep.prepared_path_for(photo_path)
+    try:
+        Image.new('RGBA', (3000, 2000), (30, 120, 200, 255)).save(photo_path)
+        
+        path = image_prep.prepare(photo_path)
+        with Image.open(path) as img:
+            size, mode = img.size, img.mode
+        if path == prepared_path and max(size) == image_prep.IMAGE_PREP_MAX_SIDE and mode == 'RGB':
+            print(f"[OK] Image downscaled to {size} JPEG")
+        else:
+            print(f"[FAIL] Unexpected prepared image: {path} {size} {mode}")
+            return False
+        
+        if image_prep.get_base64(photo_path) is image_prep.get_base64(photo_path):
+            print("[OK] Base64 string cached")
+        else:
+            print("[FAIL] Base64 string not cached")
+            return False
+    except Exception as e:
+        print(f"[FAIL] Image preprocessing test failed: {e}")
+        return False
+    finally:
+        for path in (photo_path, prepared_path):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    print("\n[OK] All image preprocessing tests passed!")
+    return True
+
+def test_hedging():
+    """Test that a slow method is hedged and the faster result wins"""
+    print("Testing hedged generation...")
+    
+    import time
+    import asyncio
+    import hedging
+    
+    output_path = "test_hedge_" + str(os.getpid()) + ".png"
+    
+    def write(path, content):
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+    
+    def slow(path):
+        time.sleep(0.5)
+        return write(path, "slow")
+    
+    def fast(path):
+        return write(path, "fast")
+    
+    async def slow_async(path):
+        await asyncio.sleep(0.5)
+        return write(path, "slow")
+    
+    async def fast_async(path):
+        return write(path, "fast")
+    
+    try:
+        for name, run in (
+            ("threads", lambda: hedging.run_hedged([slow, fast], output_path, delay=0.05)),
+            ("async", lambda: asyncio.run(hedging.run_hedged_async([slow_async, fast_async], output_path, delay=0.05))),
+        ):
+            result = run()
+            time.sleep(0.6)  # Let an abandoned method finish
+            with open(output_path) as f:
+                content = f.read()
+            leftover = os.path.exists(hedging.attempt_path(output_path, 0))
+            if result == output_path and content == "fast" and not leftover:
+                print(f"[OK] Faster method won ({name})")
+            else:
+                print(f"[FAIL] Hedging ({name}) returned {result}, content {content}, leftover attempt: {leftover}")
+                return False
+            os.remove(output_path)
+    except Exception as e:
+        print(f"[FAIL] Hedging test failed: {e}")
+        return False
+    finally:
+        for path in (output_path, hedging.attempt_path(output_path, 0), hedging.attempt_path(output_path, 1)):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    print("\n[OK] All hedging tests passed!")
+    return True
+
+def test_circuit_breaker():
+    """Test that a failing model is skipped, probed after the cooldown and closed again"""
+    print("Testing circuit breaker...")
+    
+    import circuit_breaker
+    
+    original_database = database.DATABASE
+    database.DATABASE = "test_breaker_" + str(os.getpid()) + ".db"
+    circuit_breaker._breakers = None
+    try:
+        database.init_db()
+        model = "test-model"
+        
+        class StatusError(Exception):
+            def __init__(self, status_code, message):
+                super().__init__(message)
+                self.status_code = status_code
+        
+        # Rate limits and quota errors are about the account, not the model
+        for _ in range(circuit_breaker.BREAKER_FAILURE_THRESHOLD):
+            circuit_breaker.record_failure(model, StatusError(429, "insufficient_quota"))
+        if circuit_breaker.allow(model):
+            print("[OK] 429 responses do not open the breaker")
+        else:
+            print("[FAIL] Breaker opened on 429 responses")
+            return False
+        
+        for _ in range(circuit_breaker.BREAKER_FAILURE_THRESHOLD):
+            circuit_breaker.record_failure(model, StatusError(503, "Service Unavailable"))
+        if not circuit_breaker.allow(model):
+            print("[OK] Breaker opened after repeated failures")
+        else:
+            print("[FAIL] Breaker still closed")
+            return False
+        
+        # State survives a restart
+        circuit_breaker._breakers = None
+        if [state['state'] for state in circuit_breaker.get_states()] != [circuit_breaker.OPEN]:
+            print("[FAIL] Breaker state not persisted")
+            return False
+        circuit_breaker._breakers[model]['opened_at'] -= circuit_breaker.BREAKER_COOLDOWN + 1
+        if circuit_breaker.allow(model) and not circuit_breaker.allow(model):
+            print("[OK] Persisted breaker lets exactly one probe through after the cooldown")
+        else:
+            print("[FAIL] Probe not handled correctly")
+            return False
+        
+        circuit_breaker.record_success(model)
+        states = {state['model']: state['state'] for state in circuit_breaker.get_states()}
+        if states.get(model) == circuit_breaker.CLOSED:
+            print("[OK] Successful probe closed the breaker")
+        else:
+            print(f"[FAIL] Unexpected breaker state: {states}")
+            return False
+    except Exception as e:
+        print(f"[FAIL] Circuit breaker test failed: {e}")
+        return False
+    finally:
+        database.close_connection()
+        if os.path.exists(database.DATABASE):
+            os.remove(database.DATABASE)
+        database.DATABASE = original_database
+        circuit_breaker._breakers = None
+    
+    print("\n[OK] All circuit breaker tests passed!")
+    return True
+
+def test_rate_limiter():
+    """Test the shared token bucket"""
+    print("Testing rate limiter...")
+    
+    original_database = database.DATABASE
+    database.DATABASE = "test_rate_limit_" + str(os.getpid()) + ".db"
+    try:
+        database.init_db()
+        # 1 token per second, burst of 2
+        waits = [database.take_rate_limit_token('test', 1.0, 2.0, 1000.0) for _ in range(3)]
+        if waits[0] == 0 and waits[1] == 0 and waits[2] > 0:
+            print(f"[OK] Burst allowed, then caller told to wait {waits[2]:.1f}s")
+        else:
+            print(f"[FAIL] Unexpected waits: {waits}")
+            return False
+        
+        if database.take_rate_limit_token('test', 1.0, 2.0, 1001.0) == 0:
+            print("[OK] Bucket refilled over time")
+        else:
+            print("[FAIL] Bucket did not refill")
+            return False
+    except Exception as e:
+        print(f"[FAIL] Rate limiter test failed: {e}")
+        return False
+    finally:
+        database.close_connection()
+        if os.path.exists(database.DATABASE):
+            os.remove(database.DATABASE)
+        database.DATABASE = original_database
+    
+    print("\n[OK] All rate limiter tests passed!")
+    return True
+
+def test_retry():
+    """Test retry classification, Retry-After handling and the retry budget"""
+    print("Testing retry engine...")
+    
+    import httpx
+    import openai
+    import retry
+    
+    def api_error(error_class, status, headers=None):
+        request = httpx.Request('POST', 'https://api.openai.com/v1/images/generations')
+        response = httpx.Response(status, headers=headers or {}, request=request)
+        return error_class("error", response=response, body=None)
+    
+    calls = []
+    
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise api_error(openai.RateLimitError, 429, {'retry-after': '0'})
+        return "ok"
+    
+    def bad_request():
+        calls.append(1)
+        raise api_error(openai.BadRequestError, 400)
+    
+    try:
+        if retry.call(flaky) == "ok" and len(calls) == 3:
+            print("[OK] Transient 429 retried until success")
+        else:
+            print(f"[FAIL] Unexpected retry behaviour ({len(calls)} calls)")
+            return False
+        
+        calls.clear()
+        try:
+            retry.call(bad_request)
+            print("[FAIL] Fatal error was swallowed")
+            return False
+        except openai.BadRequestError:
+            if len(calls) == 1:
+                print("[OK] Fatal 400 raised without retrying")
+            else:
+                print(f"[FAIL] Fatal error retried ({len(calls)} calls)")
+                return False
+        
+        error = api_error(openai.RateLimitError, 429, {'retry-after': '30'})
+        if retry.retry_after(error) == 30:
+            print("[OK] Retry-After header parsed")
+        else:
+            print("[FAIL] Retry-After header not parsed")
+            return False
+        
+        with retry.job_budget(10):
+            try:
+                retry.call(lambda: (_ for _ in ()).throw(error))
+                print("[FAIL] Retry budget not enforced")
+                return False
+            except openai.RateLimitError:
+                print("[OK] Retry-After beyond the job's budget gives up immediately")
+    except Exception as e:
+        print(f"[FAIL] Retry test failed: {e}")
+        return False
+    
+    print("\n[OK] All retry tests passed!")
+    return True
+
+def test_events():
+    """Test that status change notifications wake up waiting streams"""
+    print("Testing status events...")
+    
+    import time
+    import threading
+    import events
+    
+    try:
+        seen = events.version(424242)
+        if events.wait(424242, seen, 0.05) == seen:
+            print("[OK] Wait without a change times out")
+        else:
+            print("[FAIL] Wait returned a change that never happened")
+            return False
+        
+        threading.Timer(0.05, events.publish, args=(424242,)).start()
+        start = time.time()
+        new_version = events.wait(424242, seen, 5)
+        if new_version != seen and time.time() - start < 2:
+            print("[OK] Publish wakes up the waiter immediately")
+        else:
+            print("[FAIL] Waiter was not woken by publish")
+            return False
+    except Exception as e:
+        print(f"[FAIL] Events test failed: {e}")
+        return False
+    
+    print("\n[OK] All events tests passed!")
+    return True
+
 def test_imports():
     """Test that all required modules can be imported"""
     print("Testing imports...")
@@ -198,6 +1059,21 @@ def main():
     results.append(("File Structure", test_file_structure()))
     results.append(("Imports", test_imports()))
     results.append(("Database", test_database()))
+    results.append(("Job Queue", test_job_queue()))
+    results.append(("User Cache", test_user_cache()))
+    results.append(("Password Hasher", test_password_hasher()))
+    results.append(("Breed Cache", test_breed_cache()))
+    results.append(("Image Pool", test_image_pool()))
+    results.append(("Image Prep", test_image_prep()))
+    results.append(("Face Blend", test_face_blend()))
+    results.append(("Morph Sequence", test_morph_sequence()))
+    results.append(("Generation Cache", test_generation_cache()))
+    results.append(("Dog Head Library", test_dog_head_library()))
+    results.append(("Hedging", test_hedging()))
+    results.append(("Circuit Breaker", test_circuit_breaker()))
+    results.append(("Rate Limiter", test_rate_limiter()))
+    results.append(("Retry", test_retry()))
+    results.append(("Events", test_events()))
     
     # Summary
     print("\n" + "=" * 50)
@@ -0,0 +1,70 @@
+"""
+In-process cache of user records for Flask-Login's user_loader.
+
+load_user runs on every request that carries a session (status polls, image
+requests, ...), so user records are kept in a small LRU with a TTL instead of
+being read from SQLite each time. Code that creates or changes a user calls
+invalidate(user_id); other worker processes pick the change up once their
+entry expires, so USER_CACHE_TTL bounds how long they can serve a stale record.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+import database
+
+USER_CACHE_ENABLED = os.environ.get('USER_CACHE_ENABLED', '1') == '1'
+# Seconds a cached user record is served before it is read again
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 60))
+# Least recently used records beyond this count are evicted
+USER_CACHE_MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', 1000))
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+# Bumped by every invalidation so a lookup that raced with one does not store a stale record
+_generation = 0
+
+def get(user_id):
+    """User record (dict with id and username) for user_id, or None if there is no such user"""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        # Malformed id in a session cookie
+        return None
+    if not USER_CACHE_ENABLED:
+        return database.get_user_by_id(user_id)
+
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get(user_id)
+        if entry and entry[0] > now:
+            _entries.move_to_end(user_id)
+            return dict(entry[1])
+        generation = _generation
+
+    user = database.get_user_by_id(user_id)
+    if user is None:
+        # Misses are not cached so a user created elsewhere is found right away
+        return None
+
+    with _lock:
+        if generation == _generation:
+            _entries[user_id] = (now + USER_CACHE_TTL, user)
+            _entries.move_to_end(user_id)
+            while len(_entries) > USER_CACHE_MAX_ENTRIES:
+                _entries.popitem(last=False)
+    return dict(user)
+
+def invalidate(user_id):
+    """Drop the cached record of user_id (call after creating or changing the user)"""
+    global _generation
+    with _lock:
+        _generation += 1
+        _entries.pop(int(user_id), None)
+
+def clear():
+    """Drop all cached records"""
+    global _generation
+    with _lock:
+        _generation += 1
+        _entries.clear()